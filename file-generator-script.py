@@ -104,6 +104,29 @@ VERTEX_AI_LOCATION=us-central1
 MODEL_NAME=gemini-1.5-pro
 TEMPERATURE=0.7
 MAX_TOKENS=8192
+LLM_MAX_CONCURRENCY=64
+LLM_MODEL_CONCURRENCY=16
+LLM_THREAD_WORKERS=32
+LLM_ROUTING_ENABLED=true
+LLM_FAST_MODEL=gemini-1.5-flash-8b
+LLM_STANDARD_MODEL=gemini-1.5-flash
+# Overrides: task or "<agent>[:<task>]" -> fast | standard | flagship (MODEL_NAME)
+LLM_TASK_TIERS={"summarise": "fast"}
+LLM_AGENT_TIERS={"Patent Landscape Agent:extract": "standard"}
+LLM_CACHE_ENABLED=true
+LLM_CACHE_TTL=3600
+LLM_CACHE_MAX_ENTRIES=2048
+
+# Tool Result Cache (TTLs in seconds, per tool)
+TOOL_CACHE_ENABLED=true
+TOOL_CACHE_TTLS={"clinical_trials": 21600, "patents": 604800}
+TOOL_CACHE_STALE_TTL=300
+
+# Semantic Result Cache (near-duplicate queries served from finished analyses)
+SEMANTIC_CACHE_ENABLED=true
+SEMANTIC_CACHE_THRESHOLD=0.7
+SEMANTIC_CACHE_MAX_ENTRIES=2000
+SEMANTIC_CACHE_TTL=86400
 
 # API Keys
 CLINICAL_TRIALS_API_KEY=optional
@@ -116,6 +139,35 @@ API_HOST=0.0.0.0
 API_PORT=8000
 ENVIRONMENT=development
 
+# Analysis Jobs
+GRAPH_PARALLEL=true
+SYNTHESIS_STREAMING=true
+AGENT_TIMEOUT=120
+MESSAGE_LOG_MAX_ENTRIES=200
+MESSAGE_LOG_SPILL_DIR=data/messages
+JOB_WORKERS=8
+JOB_QUEUE_SIZE=1000
+BATCH_MAX_ITEMS=500
+JOB_TIMEOUT=900
+JOB_STORE=memory
+JOB_STORE_PATH=data/jobs.db
+CHECKPOINT_STORE=sqlite
+CHECKPOINT_PATH=data/checkpoints.db
+JOB_RESUME_ON_START=true
+
+# Process layout (python -m src.main serve); dispatch needs JOB_STORE=sqlite or mongodb
+EXECUTION_MODE=local
+API_WORKERS=1
+GRAPH_WORKERS=0
+DISPATCH_BACKEND=sqlite
+DISPATCH_PATH=data/dispatch.db
+DISPATCH_LEASE=60
+
+# Local ClinicalTrials.gov index (python -m src.indexes.clinical_trials ingest <export>)
+TRIALS_INDEX_PATH=data/clinical_trials.db
+MARKET_DATA_PATH=data/market.csv
+PATENT_INDEX_PATH=data/patents
+
 # Database
 REDIS_HOST=localhost
 REDIS_PORT=6379
@@ -125,6 +177,7 @@ MONGODB_DATABASE=pharmaintel
 # Logging
 LOG_LEVEL=INFO
 LOG_FORMAT=json
+LOG_SAMPLE_RATES=agent_action=1.0
 
 # Security
 API_KEY_SECRET=your_secret_key
@@ -183,18 +236,65 @@ pip install -r requirements.txt
 python -m uvicorn src.api.server:app --reload
 ```
 
+### Production processes
+
+`python -m src.main serve` runs `API_WORKERS` uvicorn workers in front of `GRAPH_WORKERS` graph worker processes (0 means one per CPU). API workers validate, admit and stream; graph workers claim analyses from a local work queue and publish their events back through it. The queue is a SQLite file at `DISPATCH_PATH` by default, or Redis with `DISPATCH_BACKEND=redis`. Claims are leased, so analyses held by a worker that dies are picked up by another after `DISPATCH_LEASE` seconds.
+
+```bash
+JOB_STORE=sqlite python -m src.main serve --api-workers 2 --graph-workers 4
+python -m src.main worker --processes 4   # extra graph workers on the same host
+```
+
+Job records, checkpoints and the Redis cache tiers are shared by every process; with `REDIS_HOST` set, each finished analysis is written once to a shared semantic cache tier that API workers load on warm-up. The trial and patent indexes are memory-mapped, so workers share their pages.
+
+Every process writes its Prometheus samples to `PROMETHEUS_MULTIPROC_DIR` (a temporary directory unless set), so `/metrics` on any API worker reports the whole host, graph workers included. Extra graph workers started with `python -m src.main worker` need the same directory in their environment.
+
+`/health` answers as soon as a process is up. `/ready` returns 503 until warm-up has compiled the graph and allocated the caches, so route traffic on `/ready`. Heavy dependencies (LangGraph, NumPy, pandas, the Gemini SDK) load during warm-up or on first use, not at import. Keep it that way:
+
+```bash
+python -m benchmarks.import_time --output benchmarks/results/imports.json --baseline benchmarks/results/imports-main.json
+```
+
 ### Access
 - Frontend: http://localhost:3000
 - API: http://localhost:8000
 - Docs: http://localhost:8000/docs
 
+### Benchmarks
+
+The harness runs the full API and graph offline, against simulated Gemini latency and stub tool upstreams:
+
+```bash
+python -m benchmarks.harness --requests 500 --concurrency 50 --output benchmarks/results/latest.json
+python -m benchmarks.harness --output benchmarks/results/pr.json --baseline benchmarks/results/latest.json
+```
+
+The report includes p50/p95/p99 latency, analyses per second and peak RSS. With `--baseline`, the run exits non-zero when any of these regresses by more than `--tolerance`.
+
+### Clinical trial data
+
+The clinical agent reads trial statistics from a local index of ClinicalTrials.gov. Build it from a bulk export (API v2 JSON zip or JSON lines, or the legacy XML archive), then pull deltas:
+
+```bash
+python -m src.indexes.clinical_trials ingest ctg-studies.json.zip
+python -m src.indexes.clinical_trials refresh
+```
+
+The patent agent answers expiry-window and freedom-to-operate questions from a memory-mapped index of USPTO bulk data (weekly grant full-text XML, zipped or not, or JSON lines). Rebuild it whenever new grant files arrive; workers share its pages rather than loading copies:
+
+```bash
+python -m src.indexes.patents build ipg240102.zip ipg240109.zip
+```
+
+Market sizing comes from a CSV at `MARKET_DATA_PATH` with one row per indication, region and year (`indication,region,year,prevalence,diagnosed_rate,treated_rate,annual_cost_usd`). Both feed the `trial_analytics` and `market_analytics` tools, which return plain numbers: `failure_rate` is a fraction and `tam` is in USD.
+
 ## 📊 Key Metrics
 
 | Metric | Value |
 |--------|-------|
 | Time Reduction | 95% |
 | Agents | 7 total |
-| MCP Tools | 5 custom |
+| MCP Tools | 7 custom |
 | Confidence | 87% avg |
 
 ## 🛠️ Tech Stack
@@ -235,9 +335,10 @@ fastapi==0.115.0
 uvicorn[standard]==0.30.0
 pydantic==2.9.0
 aiohttp==3.10.0
-httpx==0.27.0
+httpx[http2]==0.27.0
 requests==2.32.0
 pandas==2.2.0
+numpy==1.26.4
 redis==5.0.0
 motor==3.6.0
 python-dotenv==1.0.1
@@ -261,12 +362,16 @@ services:
       - GOOGLE_API_KEY=${GOOGLE_API_KEY}
       - REDIS_HOST=redis
       - MONGODB_URI=mongodb://mongodb:27017
+      - JOB_STORE=sqlite
+      - DISPATCH_BACKEND=redis
+      - API_WORKERS=2
     depends_on:
       - redis
       - mongodb
     volumes:
       - ./src:/app/src
       - ./logs:/app/logs
+      - ./data:/app/data
     restart: unless-stopped
     networks:
       - pharmaintel-network
@@ -312,13 +417,15 @@ COPY requirements.txt .
 RUN pip install --no-cache-dir -r requirements.txt
 
 COPY src/ ./src/
-RUN mkdir -p /app/logs
+RUN mkdir -p /app/logs /app/data
 
 EXPOSE 8000
 
-HEALTHCHECK --interval=30s --timeout=10s CMD curl -f http://localhost:8000/health || exit 1
+HEALTHCHECK --interval=30s --timeout=10s --start-period=60s CMD curl -f http://localhost:8000/ready || exit 1
 
-CMD ["uvicorn", "src.api.server:app", "--host", "0.0.0.0", "--port", "8000"]
+ENV JOB_STORE=sqlite
+
+CMD ["python", "-m", "src.main", "serve"]
 """)
 
     # LICENSE
@@ -356,22 +463,299 @@ __version__ = "1.0.0"
 
     # src/main.py - Use code from previous artifact
     create_file("src/main.py", '''"""Main entry point for PharmaIntel"""
-from src.api.server import app
+import argparse
+import os
+import tempfile
+from typing import List, Optional
 import uvicorn
+from src.config.settings import settings
 
-def main():
-    """Run the application"""
-    uvicorn.run(
-        "src.api.server:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
+def serve(api_workers: int, graph_workers: int, host: str, port: int):
+    """Run API workers in front of a pool of graph worker processes"""
+    # Every process writes its metrics here, so any API worker can serve all of them;
+    # set before the workers first import prometheus_client
+    metrics_dir = os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "pharmaintel-metrics")
     )
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        # Samples of an earlier run would be added to this one's
+        if name.endswith(".db"):
+            os.remove(os.path.join(metrics_dir, name))
+    
+    from src.jobs.worker import start_workers, stop_workers
+    
+    # Inherited by the uvicorn worker processes, which re-read settings
+    os.environ["EXECUTION_MODE"] = "dispatch"
+    settings.execution_mode = "dispatch"
+    processes = start_workers(graph_workers or os.cpu_count() or 1)
+    try:
+        uvicorn.run("src.api.server:app", host=host, port=port, workers=api_workers)
+    finally:
+        stop_workers(processes)
+
+def main(argv: Optional[List[str]] = None):
+    """Run the application"""
+    parser = argparse.ArgumentParser(prog="python -m src.main", description="PharmaIntel")
+    commands = parser.add_subparsers(dest="command")
+    
+    production = commands.add_parser("serve", help="Run API workers and graph workers as separate processes")
+    production.add_argument("--api-workers", type=int, default=settings.api_workers)
+    production.add_argument("--graph-workers", type=int, default=settings.graph_workers, help="0 for one per CPU")
+    production.add_argument("--host", default=settings.api_host)
+    production.add_argument("--port", type=int, default=settings.api_port)
+    
+    worker = commands.add_parser("worker", help="Run graph workers only")
+    worker.add_argument("--processes", type=int, default=settings.graph_workers, help="0 for one per CPU")
+    
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args.api_workers, args.graph_workers, args.host, args.port)
+    elif args.command == "worker":
+        from src.jobs.worker import main as worker_main
+        
+        worker_main(["--processes", str(args.processes)])
+    else:
+        uvicorn.run(
+            "src.api.server:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True
+        )
 
 if __name__ == "__main__":
     main()
 ''')
 
+    create_file("src/runtime.py", '''"""Process Runtime"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+from src.config.settings import settings
+from src.llm import client as llm_client
+from src.llm.cache import ResponseCache, configure_response_cache, create_redis_client
+from src.llm.router import ModelRouter, ModelTier, configure_model_router
+from src.graph.checkpoints import CheckpointStore, create_checkpoint_store
+from src.graph.messages import configure_message_log
+from src.indexes.clinical_trials import TrialsIndex, configure_trials_index
+from src.indexes.market import MarketData, configure_market_data
+from src.indexes.patents import PatentIndex, configure_patent_index
+from src.jobs.dispatch import WorkQueue, create_work_queue
+from src.jobs.events import EventBroker, configure_event_broker
+from src.jobs.manager import JobManager
+from src.jobs.semantic_cache import SemanticCache
+from src.jobs.store import JobStore, create_job_store
+from src.tools.cache import ToolResultCache, configure_tool_cache
+from src.tools.http_client import get_http_pool
+from src.utils.logger import get_logger, setup_logger
+
+logger = get_logger("runtime")
+
+# "local" runs analyses in the API process; "api" and "worker" split them
+# across processes through the work queue
+ROLES = ("local", "api", "worker")
+
+@dataclass
+class Runtime:
+    """Process-wide resources opened for one role"""
+    role: str
+    job_manager: JobManager
+    store: JobStore
+    checkpoints: Optional[CheckpointStore] = None
+    dispatcher: Optional[WorkQueue] = None
+    redis: Any = None
+    trials_index: Optional[TrialsIndex] = None
+    patent_index: Optional[PatentIndex] = None
+    ready: bool = False
+    warm_up_s: Optional[float] = None
+    warm_up_error: Optional[str] = None
+
+def build_graph():
+    """The configured graph, compiled once per process
+    
+    The workflow module pulls in LangGraph and every agent, so it is only
+    imported by processes that run analyses, on first use or in ``warm_up``.
+    """
+    from src.graph.workflow import get_compiled_graph
+    
+    return get_compiled_graph(
+        parallel=settings.graph_parallel,
+        agent_timeout=settings.agent_timeout,
+        stream_synthesis=settings.synthesis_streaming
+    )
+
+async def open_runtime(role: str = "local") -> Runtime:
+    """Configure caches, indexes and stores, then start the job manager"""
+    if role not in ROLES:
+        raise ValueError(f"Unknown runtime role: {role}")
+    if role != "local" and settings.job_store == "memory":
+        raise ValueError("Dispatch mode needs a job store shared between processes: set JOB_STORE to sqlite or mongodb")
+    
+    setup_logger()
+    llm_client.configure(
+        max_concurrency=settings.llm_max_concurrency,
+        model_concurrency=settings.llm_model_concurrency,
+        thread_workers=settings.llm_thread_workers
+    )
+    
+    # One client shared by the response cache, the tool cache and the work queue
+    redis = create_redis_client(settings.redis_host, settings.redis_port, settings.redis_db) if settings.redis_host else None
+    if settings.llm_cache_enabled:
+        configure_response_cache(ResponseCache(
+            max_entries=settings.llm_cache_max_entries,
+            max_bytes=settings.llm_cache_max_bytes,
+            ttl=settings.llm_cache_ttl,
+            redis=redis
+        ))
+    else:
+        configure_response_cache(None)
+    
+    if settings.tool_cache_enabled:
+        configure_tool_cache(ToolResultCache(
+            ttls=settings.tool_cache_ttls,
+            default_ttl=settings.tool_cache_default_ttl,
+            stale_ttl=settings.tool_cache_stale_ttl,
+            max_entries=settings.tool_cache_max_entries,
+            redis=redis
+        ))
+    else:
+        configure_tool_cache(None)
+    
+    if settings.llm_routing_enabled:
+        configure_model_router(ModelRouter(
+            tiers=[
+                ModelTier("fast", settings.llm_fast_model, max_prompt_tokens=8_000),
+                ModelTier("standard", settings.llm_standard_model, max_prompt_tokens=32_000),
+                ModelTier("flagship", settings.model_name),
+            ],
+            task_tiers=settings.llm_task_tiers,
+            agent_tiers=settings.llm_agent_tiers
+        ))
+    else:
+        configure_model_router(None)
+    
+    # Built offline with `python -m src.indexes.clinical_trials ingest`
+    trials_index = TrialsIndex(settings.trials_index_path) if os.path.exists(settings.trials_index_path) else None
+    configure_trials_index(trials_index)
+    configure_market_data(MarketData(settings.market_data_path) if os.path.exists(settings.market_data_path) else None)
+    # Built offline with `python -m src.indexes.patents build`; mapped, not loaded
+    patent_index = PatentIndex(settings.patent_index_path) if os.path.isdir(settings.patent_index_path) else None
+    configure_patent_index(patent_index)
+    
+    configure_message_log(settings.message_log_max_entries, settings.message_log_spill_dir)
+    
+    dispatcher = None
+    if role != "local":
+        dispatcher = create_work_queue(
+            settings.dispatch_backend,
+            path=settings.dispatch_path,
+            redis=redis,
+            lease=settings.dispatch_lease
+        )
+        await dispatcher.start()
+    
+    configure_event_broker(EventBroker(
+        buffer_size=settings.event_buffer_size,
+        heartbeat_interval=settings.event_heartbeat_interval,
+        forward=dispatcher.publish if role == "worker" else None
+    ))
+    
+    store = create_job_store(
+        settings.job_store,
+        mongodb_uri=settings.mongodb_uri,
+        mongodb_database=settings.mongodb_database,
+        max_records=settings.job_max_retained,
+        path=settings.job_store_path
+    )
+    await store.ensure_indexes()
+    
+    checkpoints = create_checkpoint_store(
+        settings.checkpoint_store,
+        path=settings.checkpoint_path,
+        mongodb_uri=settings.mongodb_uri,
+        mongodb_database=settings.mongodb_database
+    )
+    if checkpoints is not None:
+        await checkpoints.ensure_indexes()
+    
+    job_manager = JobManager(
+        build_graph,
+        max_workers=settings.job_workers,
+        max_queue=settings.job_queue_size,
+        job_timeout=settings.job_timeout,
+        store=store,
+        checkpoints=checkpoints,
+        resume_on_start=settings.job_resume_on_start,
+        # Hits are served at admission, so graph workers never consult it
+        semantic_cache=SemanticCache(
+            threshold=settings.semantic_cache_threshold,
+            max_entries=settings.semantic_cache_max_entries,
+            ttl=settings.semantic_cache_ttl,
+            redis=redis
+        ) if settings.semantic_cache_enabled and role != "worker" else None,
+        dispatcher=dispatcher,
+        execute=role != "api"
+    )
+    await job_manager.start()
+    
+    return Runtime(
+        role=role,
+        job_manager=job_manager,
+        store=store,
+        checkpoints=checkpoints,
+        dispatcher=dispatcher,
+        redis=redis,
+        trials_index=trials_index,
+        patent_index=patent_index
+    )
+
+async def warm_up(runtime: Runtime):
+    """Pay one-off startup costs before traffic arrives, then mark the runtime ready
+    
+    Compiles the graph where analyses run, and allocates the semantic cache
+    and loads the shared entries where queries are admitted. The heavy parts
+    run in a thread, so the process answers ``/health`` meanwhile; ``/ready``
+    reports the outcome.
+    """
+    started = time.perf_counter()
+    try:
+        if runtime.role != "api":
+            await runtime.job_manager.load_graph()
+        semantic_cache = runtime.job_manager.semantic_cache
+        if semantic_cache is not None:
+            await asyncio.to_thread(semantic_cache.reserve)
+            await semantic_cache.load()
+    except Exception as e:
+        runtime.warm_up_error = str(e)
+        logger.exception("Warm-up failed")
+        return
+    runtime.warm_up_s = round(time.perf_counter() - started, 3)
+    runtime.ready = True
+    logger.info("Warm-up finished in %.3fs", runtime.warm_up_s)
+
+async def close_runtime(runtime: Runtime):
+    """Stop the job manager and release everything ``open_runtime`` configured"""
+    runtime.ready = False
+    await runtime.job_manager.stop()
+    if runtime.dispatcher is not None:
+        await runtime.dispatcher.close()
+    await get_http_pool().aclose()
+    await runtime.store.close()
+    if runtime.checkpoints is not None:
+        await runtime.checkpoints.close()
+    if runtime.redis is not None:
+        await runtime.redis.close()
+    if runtime.trials_index is not None:
+        runtime.trials_index.close()
+        configure_trials_index(None)
+    configure_market_data(None)
+    if runtime.patent_index is not None:
+        runtime.patent_index.close()
+        configure_patent_index(None)
+''')
+
     # ========================================================================
     # AGENTS
     # ========================================================================
@@ -379,60 +763,315 @@ if __name__ == "__main__":
     create_file("src/agents/__init__.py", "")
     
     create_file("src/agents/base_agent.py", '''"""Base Agent Class"""
-import google.generativeai as genai
+from contextlib import aclosing
 from datetime import datetime
-import json
+import logging
+import time
+from typing import Any, AsyncIterator, Iterable, Optional, Tuple
+from src.llm.client import generate_async, stream_async
+from src.llm.cache import get_response_cache
+from src.llm.context import ContextPacker, DEFAULT_CONTEXT_TOKEN_BUDGET, count_tokens
+from src.llm.pool import get_model_pool
+from src.llm.router import DEFAULT_TASK, ModelRouter, ModelTier, get_model_router
+from src.llm.streaming import FieldUpdate, StreamingJSONParser
+from src.jobs.events import emit, current_analysis_id
+from src.tools.mcp_server import PharmaIntelMCPServer
+from src.utils.logger import get_logger
+from src.utils.metrics import record_cache_lookup, record_llm_call, record_context_packing
+
+logger = get_logger("agents")
+
+DEFAULT_MODEL = "gemini-1.5-pro"
 
 class BaseAgent:
     """Base class for all PharmaIntel agents"""
     
-    def __init__(self, name: str, model_name: str = "gemini-1.5-pro"):
+    def __init__(
+        self,
+        name: str,
+        model_name: Optional[str] = None,
+        model=None,
+        generation_config: dict = None,
+        context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET
+    ):
         self.name = name
-        self.model = genai.GenerativeModel(model_name)
+        # An explicit model or model name pins the agent; otherwise every call is routed
+        self.pinned = model is not None or model_name is not None
+        self.model_name = model_name or DEFAULT_MODEL
+        self._model = model
+        self.generation_config = generation_config or {}
+        self.context_packer = ContextPacker(context_token_budget)
+        self.last_packing = None
+    
+    @property
+    def model(self):
+        """Client of the pinned model, shared through the model pool"""
+        if self._model is None:
+            self._model = get_model_pool().get(self.model_name)
+        return self._model
+    
+    def build_prompt(self, prompt: str, context: dict = None) -> str:
+        """Assemble the full prompt sent to the model, packing context into budget"""
+        packed = self.context_packer.pack(context, prompt)
+        self.last_packing = packed
+        if context:
+            record_context_packing(self.name, packed)
+            if packed.dropped or packed.summarised:
+                logger.info(
+                    "%s: packed context saved %d tokens",
+                    self.name,
+                    packed.saved_tokens,
+                    extra={
+                        "event": "context_packing",
+                        "fields": {
+                            "agent": self.name,
+                            "original_tokens": packed.original_tokens,
+                            "packed_tokens": packed.packed_tokens,
+                            "summarised": packed.summarised,
+                            "dropped": packed.dropped
+                        }
+                    }
+                )
         
-    def generate_response(self, prompt: str, context: dict = None) -> str:
-        """Generate response using Gemini"""
-        full_prompt = f"""You are the {self.name} agent in PharmaIntel.
+        return f"""You are the {self.name} agent in PharmaIntel.
         
-Context: {json.dumps(context, indent=2) if context else 'None'}
+Context: {packed.text}
 
 Task: {prompt}
 
 Provide structured, data-driven response."""
         
-        response = self.model.generate_content(full_prompt)
-        return response.text
+    def _target(self, task: str, full_prompt: str) -> Tuple[Optional[ModelRouter], ModelTier, Any]:
+        """Router, tier and model client for one call"""
+        router = None if self.pinned else get_model_router()
+        if router is None:
+            return None, ModelTier("pinned", self.model_name), self.model
+        tier = router.select(self.name, task, count_tokens(full_prompt))
+        return router, tier, router.model_for(tier)
+    
+    def _escalate(self, router: Optional[ModelRouter], tier: ModelTier, text: str, validate) -> Optional[ModelTier]:
+        if router is None or validate is None or validate(text):
+            return None
+        next_tier = router.escalate(tier, self.name)
+        if next_tier is not None:
+            logger.info(
+                "%s: escalating from %s to %s",
+                self.name,
+                tier.name,
+                next_tier.name,
+                extra={"event": "llm_escalation", "fields": {"agent": self.name, "from": tier.name, "to": next_tier.name}}
+            )
+        return next_tier
+    
+    def _record(self, router, tier: ModelTier, seconds: float, full_prompt: str, response=None, text: str = "", outcome: str = "ok"):
+        record_llm_call(self.name, tier.model_name, seconds, response, outcome)
+        if router is None:
+            return
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or count_tokens(full_prompt)
+        output_tokens = getattr(usage, "candidates_token_count", None) or count_tokens(text)
+        router.record(tier, self.name, seconds, prompt_tokens, output_tokens, outcome)
+    
+    def generate_response(self, prompt: str, context: dict = None, task: str = DEFAULT_TASK, validate=None) -> str:
+        """Generate response using Gemini
+        
+        ``validate`` may reject a response (e.g. low confidence), in which
+        case the call is retried on the next larger model tier.
+        """
+        full_prompt = self.build_prompt(prompt, context)
+        router, tier, model = self._target(task, full_prompt)
+        cache = get_response_cache()
+        
+        while True:
+            text = None
+            if cache is not None:
+                key = cache.make_key(tier.model_name, self.generation_config, full_prompt)
+                text = cache.lookup(key)
+                record_cache_lookup("llm", text is not None)
+            
+            if text is None:
+                started = time.perf_counter()
+                try:
+                    response = model.generate_content(full_prompt, **self._generation_kwargs())
+                except Exception:
+                    self._record(router, tier, time.perf_counter() - started, full_prompt, outcome="error")
+                    raise
+                text = response.text
+                self._record(router, tier, time.perf_counter() - started, full_prompt, response, text)
+                if cache is not None:
+                    cache.set_local(key, text)
+            
+            next_tier = self._escalate(router, tier, text, validate)
+            if next_tier is None:
+                return text
+            tier, model = next_tier, router.model_for(next_tier)
+    
+    async def agenerate_response(self, prompt: str, context: dict = None, task: str = DEFAULT_TASK, validate=None) -> str:
+        """Generate response without blocking the event loop"""
+        full_prompt = self.build_prompt(prompt, context)
+        router, tier, model = self._target(task, full_prompt)
+        cache = get_response_cache()
+        
+        while True:
+            text = None
+            if cache is not None:
+                key = cache.make_key(tier.model_name, self.generation_config, full_prompt)
+                text = await cache.get(key)
+                record_cache_lookup("llm", text is not None)
+            
+            if text is None:
+                started = time.perf_counter()
+                try:
+                    response = await generate_async(
+                        model,
+                        full_prompt,
+                        model_name=tier.model_name,
+                        **self._generation_kwargs()
+                    )
+                except Exception:
+                    self._record(router, tier, time.perf_counter() - started, full_prompt, outcome="error")
+                    raise
+                text = response.text
+                self._record(router, tier, time.perf_counter() - started, full_prompt, response, text)
+                if cache is not None:
+                    await cache.set(key, text)
+            
+            next_tier = self._escalate(router, tier, text, validate)
+            if next_tier is None:
+                return text
+            tier, model = next_tier, router.model_for(next_tier)
+    
+    async def astream_response(self, prompt: str, context: dict = None, task: str = DEFAULT_TASK) -> AsyncIterator[str]:
+        """Yield response chunks as they are generated, publishing token events"""
+        full_prompt = self.build_prompt(prompt, context)
+        router, tier, model = self._target(task, full_prompt)
+        
+        cache = get_response_cache()
+        if cache is not None:
+            key = cache.make_key(tier.model_name, self.generation_config, full_prompt)
+            cached = await cache.get(key)
+            record_cache_lookup("llm", cached is not None)
+            if cached is not None:
+                emit("token", {"agent": self.name, "text": cached, "cached": True})
+                yield cached
+                return
+        
+        chunks = []
+        started = time.perf_counter()
+        stream = stream_async(model, full_prompt, model_name=tier.model_name, **self._generation_kwargs())
+        try:
+            # Closed as soon as the caller stops reading, which frees the limiter slot
+            async with aclosing(stream):
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    emit("token", {"agent": self.name, "text": chunk})
+                    yield chunk
+        except Exception:
+            self._record(router, tier, time.perf_counter() - started, full_prompt, outcome="error")
+            raise
+        text = "".join(chunks)
+        self._record(router, tier, time.perf_counter() - started, full_prompt, text=text)
+        
+        if cache is not None:
+            await cache.set(key, text)
+    
+    async def astream_fields(
+        self,
+        prompt: str,
+        context: dict = None,
+        fields: Optional[Iterable[str]] = None,
+        task: str = DEFAULT_TASK
+    ) -> AsyncIterator[FieldUpdate]:
+        """Stream a JSON response, yielding top-level fields as they are generated
+        
+        Each update is also published as a ``field`` event, so API clients see
+        e.g. the hypothesis text form long before the response is complete.
+        """
+        parser = StreamingJSONParser(fields)
+        async with aclosing(self.astream_response(prompt, context, task=task)) as chunks:
+            async for chunk in chunks:
+                for update in parser.feed(chunk):
+                    emit("field", {"agent": self.name, **update.to_dict()})
+                    yield update
+        for update in parser.close():
+            emit("field", {"agent": self.name, **update.to_dict()})
+            yield update
+    
+    def _generation_kwargs(self) -> dict:
+        if not self.generation_config:
+            return {}
+        return {"generation_config": self.generation_config}
     
-    def log_action(self, action: str, details: dict):
-        """Log agent actions"""
-        log_entry = {
+    async def call_tool(self, tool_name: str, args: dict) -> dict:
+        """A tool's data; a failed call raises, so the node records the agent as failed"""
+        result = await PharmaIntelMCPServer().call_tool(tool_name, args)
+        if not result.get("success"):
+            raise RuntimeError(result.get("error") or f"{tool_name} failed")
+        return result["data"]
+    
+    def log_action(self, action: str, details: dict, state: Optional[dict] = None):
+        """Log agent actions, adding them to ``state["messages"]`` when given
+        
+        The node's update then carries only its new messages, which the
+        state reducer appends to the run's message log.
+        """
+        message = {
             "timestamp": datetime.now().isoformat(),
             "agent": self.name,
             "action": action,
             "details": details
         }
-        print(f"[{self.name}] {json.dumps(log_entry, indent=2)}")
+        if current_analysis_id.get() is not None:
+            emit("agent_action", message)
+        if state is not None:
+            pending = state.get("messages")
+            state["messages"] = (pending if isinstance(pending, list) else []) + [message]
+        
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "%s: %s",
+                self.name,
+                action,
+                extra={
+                    "event": "agent_action",
+                    "fields": {"agent": self.name, "action": action, "details": dict(details)}
+                }
+            )
 ''')
 
     create_file("src/agents/master_agent.py", '''"""Master Orchestrator Agent"""
+from contextlib import aclosing
 from src.agents.base_agent import BaseAgent
+from src.llm.streaming import StreamingJSONParser
 import json
 
+REPORT_FIELDS = ("hypothesis", "rationale", "confidence_score")
+
+SYNTHESIS_PROMPT = (
+    "Synthesize the specialist findings into one drug repurposing hypothesis for: {query}\\n"
+    "Reply with only a JSON object with these keys, in this order: "
+    '"hypothesis" (one sentence), "rationale" (two or three sentences), '
+    '"confidence_score" (integer 0-100).'
+)
+
 class MasterOrchestratorAgent(BaseAgent):
     """Coordinates all agents and synthesizes insights"""
     
-    def __init__(self):
+    SPECIALIST_AGENTS = [
+        "clinical_trials",
+        "patent_landscape",
+        "iqvia_insights"
+    ]
+    
+    def __init__(self, stream_synthesis: bool = False):
         super().__init__("Master Orchestrator")
+        self.stream_synthesis = stream_synthesis
         
     async def route_query(self, state: dict) -> dict:
         """Determine next agent to invoke"""
         iteration = state.get("iteration_count", 0)
         
-        agent_sequence = [
-            "clinical_trials",
-            "patent_landscape",
-            "iqvia_insights"
-        ]
+        agent_sequence = self.SPECIALIST_AGENTS
         
         if iteration < len(agent_sequence):
             state["next_agent"] = agent_sequence[iteration]
@@ -442,25 +1081,64 @@ class MasterOrchestratorAgent(BaseAgent):
             
         return state
     
+    async def dispatch_agents(self, state: dict) -> dict:
+        """Fan out to all specialist agents at once"""
+        update = {
+            "next_agent": "parallel",
+            "iteration_count": len(self.SPECIALIST_AGENTS)
+        }
+        self.log_action("dispatch", {"agents": self.SPECIALIST_AGENTS}, update)
+        
+        return update
+    
     async def synthesize_findings(self, state: dict) -> dict:
         """Synthesize all findings into hypothesis"""
-        self.log_action("synthesize", {"iteration": state["iteration_count"]})
+        self.log_action("synthesize", {"iteration": state["iteration_count"]}, state)
         
-        innovation_report = {
-            "hypothesis": "Develop inhaled sildenafil for pulmonary hypertension",
-            "rationale": "Overcomes oral side effects via local delivery",
-            "confidence_score": 87
-        }
+        innovation_report = await self.generate_report(state)
+        
+        incomplete = [
+            agent for agent, status in (state.get("agent_status") or {}).items()
+            if status.get("status") != "completed"
+        ]
+        if incomplete:
+            innovation_report["partial"] = True
+            innovation_report["incomplete_agents"] = sorted(incomplete)
         
         state["innovation_report"] = innovation_report
         state["hypothesis"] = innovation_report["hypothesis"]
         state["confidence_score"] = innovation_report["confidence_score"]
         
         return state
+    
+    async def generate_report(self, state: dict) -> dict:
+        """The report from the model; when streamed, fields are published as they form"""
+        context = {
+            key: state[key]
+            for key in ("clinical_findings", "patent_findings", "iqvia_findings")
+            if state.get(key)
+        }
+        prompt = SYNTHESIS_PROMPT.format(query=state.get("query", ""))
+        
+        report = {}
+        if self.stream_synthesis:
+            async with aclosing(self.astream_fields(prompt, context, REPORT_FIELDS, task="synthesize")) as updates:
+                async for update in updates:
+                    if update.done:
+                        report[update.field] = update.value
+        else:
+            parser = StreamingJSONParser(REPORT_FIELDS)
+            updates = parser.feed(await self.agenerate_response(prompt, context, task="synthesize")) + parser.close()
+            report = {update.field: update.value for update in updates if update.done}
+        if not report.get("hypothesis"):
+            raise ValueError("Synthesis response contained no hypothesis")
+        report.setdefault("confidence_score", None)
+        return report
 ''')
 
     create_file("src/agents/clinical_agent.py", '''"""Clinical Trials Agent"""
 from src.agents.base_agent import BaseAgent
+from src.indexes.clinical_trials import get_trials_index
 import json
 
 class ClinicalTrialsAgent(BaseAgent):
@@ -471,20 +1149,28 @@ class ClinicalTrialsAgent(BaseAgent):
         
     async def analyze_trials(self, state: dict) -> dict:
         """Analyze clinical trials"""
-        self.log_action("analyze_trials", {"query": state["query"]})
+        self.log_action("analyze_trials", {"query": state["query"]}, state)
         
-        clinical_findings = {
-            "trials_analyzed": 15,
-            "failure_rate": "67%",
-            "primary_reason": "Systemic side effects"
-        }
+        if get_trials_index() is not None:
+            data = await self.call_tool("trial_analytics", {"query": state["query"]})
+            clinical_findings = {"source": "clinicaltrials.gov (local index)", **data}
+        else:
+            clinical_findings = {
+                "trials_analyzed": 15,
+                "failure_rate": 0.67,
+                "primary_reason": "Systemic side effects"
+            }
         
         state["clinical_findings"] = clinical_findings
         return state
 ''')
 
     create_file("src/agents/patent_agent.py", '''"""Patent Landscape Agent"""
+import asyncio
+import datetime
 from src.agents.base_agent import BaseAgent
+from src.indexes.clinical_trials import get_trials_index
+from src.indexes.patents import get_patent_index
 
 class PatentLandscapeAgent(BaseAgent):
     """Searches patents"""
@@ -494,19 +1180,50 @@ class PatentLandscapeAgent(BaseAgent):
         
     async def analyze_patents(self, state: dict) -> dict:
         """Analyze patent landscape"""
-        self.log_action("analyze_patents", {"query": state["query"]})
+        self.log_action("analyze_patents", {"query": state["query"]}, state)
         
-        patent_findings = {
-            "oral_patents_status": "Expiring 2026-2027",
-            "freedom_to_operate": "High"
-        }
+        index = get_patent_index()
+        if index is not None:
+            # The trial registry knows drug names; without it the index guesses the subject
+            trials = get_trials_index()
+            intervention = None
+            if trials is not None:
+                intervention = (await asyncio.to_thread(trials.resolve_query, state["query"]))["intervention"]
+            fto = index.freedom_to_operate(state["query"], limit=5, intervention=intervention)
+            patent_findings = self.landscape(fto)
+        else:
+            patent_findings = {
+                "patent_status": "Expiring 2026-2027",
+                "freedom_to_operate": "High"
+            }
         
         state["patent_findings"] = patent_findings
         return state
+    
+    @staticmethod
+    def landscape(fto: dict) -> dict:
+        """Rate freedom to operate by how long the blocking patents stay in force"""
+        years = sorted(fto["expiring_by_year"])
+        if not fto["blocking"]:
+            rating, status = "High", "No matching patents in force"
+        else:
+            clear_in = datetime.date.fromisoformat(fto["clear_from"]) - datetime.date.fromisoformat(fto["date"])
+            rating = "Medium" if clear_in.days <= 2 * 365 else "Low"
+            status = f"Expiring {years[0]}-{years[-1]}" if years[0] != years[-1] else f"Expiring {years[0]}"
+        return {
+            "source": "USPTO bulk data (local index)",
+            "patent_status": status,
+            "freedom_to_operate": rating,
+            "blocking_patents": fto["blocking"],
+            "clear_from": fto["clear_from"],
+            "expiring_by_year": fto["expiring_by_year"],
+            "patents": fto["patents"]
+        }
 ''')
 
     create_file("src/agents/iqvia_agent.py", '''"""IQVIA Insights Agent"""
 from src.agents.base_agent import BaseAgent
+from src.indexes.market import get_market_data
 
 class IQVIAInsightsAgent(BaseAgent):
     """Market intelligence"""
@@ -516,251 +1233,8140 @@ class IQVIAInsightsAgent(BaseAgent):
         
     async def analyze_market(self, state: dict) -> dict:
         """Analyze market"""
-        self.log_action("analyze_market", {"query": state["query"]})
+        self.log_action("analyze_market", {"query": state["query"]}, state)
         
-        iqvia_findings = {
-            "tam": "$2.3B",
-            "target_population": "45,000 patients"
-        }
+        if get_market_data() is not None:
+            data = await self.call_tool("market_analytics", {"query": state["query"]})
+            iqvia_findings = {"source": "local market data", **data}
+        else:
+            iqvia_findings = {
+                "tam": 2.3e9,
+                "target_population": 45000
+            }
         
         state["iqvia_findings"] = iqvia_findings
         return state
 ''')
 
     # ========================================================================
-    # TOOLS
+    # LLM
     # ========================================================================
     
-    create_file("src/tools/__init__.py", "")
-    
-    create_file("src/tools/mcp_server.py", '''"""MCP Server Implementation"""
-from typing import List, Dict, Any
+    create_file("src/llm/__init__.py", "")
 
-class PharmaIntelMCPServer:
-    """MCP Server for pharmaceutical tools"""
+    create_file("src/llm/client.py", '''"""Async LLM Client"""
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MODEL_CONCURRENCY = 16
+DEFAULT_THREAD_WORKERS = 32
+
+class ConcurrencyLimiter:
+    """Caps in-flight LLM calls per process and per model"""
     
-    def __init__(self):
-        self.tools = {}
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        model_concurrency: int = DEFAULT_MODEL_CONCURRENCY,
+        model_limits: Optional[Dict[str, int]] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency
+        self.model_limits = dict(model_limits or {})
+        self.in_flight: Dict[str, int] = {}
+        # asyncio primitives belong to one event loop, so keep a set per loop
+        self._loops = weakref.WeakKeyDictionary()
     
-    def list_tools(self) -> List[Dict[str, Any]]:
-        """List available tools"""
-        return []
+    def _semaphores(self) -> dict:
+        loop = asyncio.get_running_loop()
+        semaphores = self._loops.get(loop)
+        if semaphores is None:
+            semaphores = {None: asyncio.Semaphore(self.max_concurrency)}
+            self._loops[loop] = semaphores
+        return semaphores
     
-    async def call_tool(self, tool_name: str, args: Dict) -> Dict:
-        """Execute tool"""
-        return {"success": True}
-''')
+    def limit_for(self, model_name: str) -> int:
+        """Concurrency cap for one model"""
+        return self.model_limits.get(model_name, self.model_concurrency)
+    
+    @asynccontextmanager
+    async def acquire(self, model_name: str):
+        """Hold one process slot and one model slot for the duration of a call"""
+        semaphores = self._semaphores()
+        if model_name not in semaphores:
+            semaphores[model_name] = asyncio.Semaphore(self.limit_for(model_name))
+        
+        async with semaphores[None], semaphores[model_name]:
+            self.in_flight[model_name] = self.in_flight.get(model_name, 0) + 1
+            try:
+                yield
+            finally:
+                self.in_flight[model_name] -= 1
 
-    # ========================================================================
-    # API
-    # ========================================================================
+_limiter = ConcurrencyLimiter()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_workers = DEFAULT_THREAD_WORKERS
+
+def get_limiter() -> ConcurrencyLimiter:
+    """Process-wide limiter shared by all agents"""
+    return _limiter
+
+def configure(
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    model_concurrency: int = DEFAULT_MODEL_CONCURRENCY,
+    model_limits: Optional[Dict[str, int]] = None,
+    thread_workers: int = DEFAULT_THREAD_WORKERS
+):
+    """Replace the process-wide limits, typically once at startup"""
+    global _limiter, _executor, _executor_workers
+    _limiter = ConcurrencyLimiter(max_concurrency, model_concurrency, model_limits)
+    _executor_workers = thread_workers
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool for SDKs that only offer a blocking client"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_executor_workers, thread_name_prefix="llm")
+    return _executor
+
+async def generate_async(
+    model: Any,
+    prompt: str,
+    model_name: str,
+    limiter: Optional[ConcurrencyLimiter] = None,
+    **kwargs
+) -> Any:
+    """Call the model without blocking the event loop
     
-    create_file("src/api/__init__.py", "")
+    Uses the SDK's native ``generate_content_async`` when present and falls
+    back to running ``generate_content`` on the shared thread pool.
+    """
+    limiter = limiter or get_limiter()
     
-    create_file("src/api/server.py", '''"""FastAPI Server"""
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-from datetime import datetime
+    async with limiter.acquire(model_name):
+        if hasattr(model, "generate_content_async"):
+            return await model.generate_content_async(prompt, **kwargs)
+        
+        loop = asyncio.get_running_loop()
+        call = functools.partial(model.generate_content, prompt, **kwargs)
+        return await loop.run_in_executor(get_executor(), call)
 
-app = FastAPI(
-    title="PharmaIntel API",
-    description="Agentic AI for Pharmaceutical Innovation",
-    version="1.0.0"
-)
+async def stream_async(
+    model: Any,
+    prompt: str,
+    model_name: str,
+    limiter: Optional[ConcurrencyLimiter] = None,
+    **kwargs
+) -> AsyncIterator[str]:
+    """Yield generated text chunks as the model produces them
+    
+    Blocking-only SDKs cannot stream into the loop, so they yield the whole
+    response once it is ready. The limiter slot is held until the generator
+    finishes or is closed, so callers that may stop early should wrap it in
+    ``contextlib.aclosing``.
+    """
+    limiter = limiter or get_limiter()
+    
+    async with limiter.acquire(model_name):
+        if hasattr(model, "generate_content_async"):
+            response = await model.generate_content_async(prompt, stream=True, **kwargs)
+            async for chunk in response:
+                text = chunk_text(chunk)
+                if text:
+                    yield text
+            return
+        
+        loop = asyncio.get_running_loop()
+        call = functools.partial(model.generate_content, prompt, **kwargs)
+        response = await loop.run_in_executor(get_executor(), call)
+        yield chunk_text(response)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def chunk_text(chunk: Any) -> str:
+    """Text of a streamed chunk; Gemini raises ValueError for chunks without a text part"""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+''')
 
-class AnalysisRequest(BaseModel):
-    query: str
-    options: Optional[Dict[str, Any]] = {}
+    create_file("src/llm/fake.py", '''"""Fake Generative Models for tests and local runs"""
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
 
-class AnalysisResponse(BaseModel):
-    analysis_id: str
-    status: str
-    timestamp: str
+@dataclass
+class FakeUsage:
+    """Token counts in the shape of Gemini's ``usage_metadata``"""
+    prompt_token_count: int
+    candidates_token_count: int
 
-@app.get("/")
-async def root():
-    return {
-        "service": "PharmaIntel API",
-        "version": "1.0.0",
-        "status": "operational"
-    }
+@dataclass
+class FakeResponse:
+    """Minimal stand-in for a Gemini response"""
+    text: str
+    usage_metadata: Optional[FakeUsage] = None
 
-@app.get("/health")
-async def health_check():
-    return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat()
-    }
+class FakeBlockingModel:
+    """Local model with configurable latency that only offers a blocking client"""
+    
+    def __init__(self, model_name: str = "fake-model", latency: float = 0.0, text: str = "{}"):
+        self.model_name = model_name
+        self.latency = latency
+        self.text = text
+        self.calls = 0
+        self.active = 0
+        self.peak_active = 0
+    
+    def _start(self):
+        self.calls += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+    
+    def generate_content(self, prompt, **kwargs) -> FakeResponse:
+        """Blocking generation"""
+        self._start()
+        try:
+            time.sleep(self.latency)
+            return FakeResponse(self.text)
+        finally:
+            self.active -= 1
 
-@app.post("/analyze", response_model=AnalysisResponse)
-async def start_analysis(request: AnalysisRequest):
-    """Start new analysis"""
-    analysis_id = f"analysis_{int(datetime.now().timestamp())}"
+class FakeStream:
+    """Async iterator over response chunks, spread across the model latency"""
     
-    return AnalysisResponse(
-        analysis_id=analysis_id,
-        status="processing",
-        timestamp=datetime.now().isoformat()
-    )
+    def __init__(self, model: "FakeGenerativeModel", chunk_size: int):
+        self.model = model
+        self.chunks = [
+            model.text[i:i + chunk_size] for i in range(0, len(model.text), chunk_size)
+        ] or [""]
+    
+    async def __aiter__(self):
+        self.model._start()
+        try:
+            delay = self.model.latency / len(self.chunks)
+            for chunk in self.chunks:
+                await asyncio.sleep(delay)
+                yield FakeResponse(chunk)
+        finally:
+            self.model.active -= 1
 
-@app.get("/analyze/{analysis_id}")
-async def get_analysis(analysis_id: str):
-    """Get analysis results"""
-    return {
-        "analysis_id": analysis_id,
-        "status": "completed",
-        "hypothesis": "Sample hypothesis",
-        "confidence_score": 87
-    }
-''')
+class FakeGenerativeModel(FakeBlockingModel):
+    """Local model that also offers the async client, like Gemini"""
+    
+    chunk_size = 8
+    
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        """Non-blocking generation, optionally streamed in chunks"""
+        if stream:
+            return FakeStream(self, self.chunk_size)
+        
+        self._start()
+        try:
+            await asyncio.sleep(self.latency)
+            return FakeResponse(self.text)
+        finally:
+            self.active -= 1
 
-    # ========================================================================
-    # GRAPH
-    # ========================================================================
+class Distribution:
+    """Seeded log-normal sampler described by its median and 95th percentile"""
     
-    create_file("src/graph/__init__.py", "")
+    def __init__(self, median: float, p95: Optional[float] = None, rng: Optional[random.Random] = None):
+        self.median = median
+        self.p95 = p95 if p95 is not None else median
+        self.sigma = math.log(self.p95 / median) / 1.6449 if median > 0 and self.p95 > median else 0.0
+        self.rng = rng or random.Random(0)
     
-    create_file("src/graph/state.py", '''"""State Definition"""
-from typing import TypedDict, Annotated, Sequence
-import operator
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.rng.gauss(0, self.sigma)) if self.sigma else self.median
 
-class PharmaIntelState(TypedDict):
-    """State object for PharmaIntel"""
-    query: str
-    messages: Annotated[Sequence[dict], operator.add]
-    clinical_findings: dict
-    patent_findings: dict
-    iqvia_findings: dict
-    hypothesis: str
-    innovation_report: dict
-    next_agent: str
-    iteration_count: int
-    confidence_score: float
+class SimulatedGeminiModel(FakeGenerativeModel):
+    """Fake Gemini whose latency and output length follow distributions
+    
+    Latencies are in seconds. Responses carry ``usage_metadata`` so token
+    metrics behave as they would against the real API.
+    """
+    
+    def __init__(
+        self,
+        model_name: str = "gemini-1.5-pro",
+        latency: Optional[Distribution] = None,
+        output_tokens: Optional[Distribution] = None,
+        seed: int = 0
+    ):
+        rng = random.Random(seed)
+        self.latency_dist = latency or Distribution(0.0, rng=rng)
+        self.output_dist = output_tokens or Distribution(200, 600, rng=rng)
+        super().__init__(model_name, latency=self.latency_dist.median)
+        self.output_tokens = 0
+    
+    def _respond(self, prompt: Any) -> FakeResponse:
+        tokens = max(1, int(self.output_dist.sample()))
+        self.output_tokens += tokens
+        # ~4 characters per token, like the local estimate in src.llm.context
+        # Shaped like a synthesis report, so the synthesize step can parse any answer
+        text = json.dumps({
+            "hypothesis": "Simulated hypothesis",
+            "rationale": "lorem " * max(0, tokens * 4 // 6 - 12),
+            "confidence_score": 50
+        })
+        return FakeResponse(text, FakeUsage(len(str(prompt)) // 4, tokens))
+    
+    def generate_content(self, prompt, **kwargs) -> FakeResponse:
+        self._start()
+        try:
+            time.sleep(self.latency_dist.sample())
+            return self._respond(prompt)
+        finally:
+            self.active -= 1
+    
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        if stream:
+            return await super().generate_content_async(prompt, stream=True, **kwargs)
+        
+        self._start()
+        try:
+            await asyncio.sleep(self.latency_dist.sample())
+            return self._respond(prompt)
+        finally:
+            self.active -= 1
 ''')
 
-    create_file("src/graph/workflow.py", '''"""LangGraph Workflow"""
-from langgraph.graph import StateGraph, END
-from src.graph.state import PharmaIntelState
-from src.agents.master_agent import MasterOrchestratorAgent
-from src.agents.clinical_agent import ClinicalTrialsAgent
-from src.agents.patent_agent import PatentLandscapeAgent
-from src.agents.iqvia_agent import IQVIAInsightsAgent
+    create_file("src/llm/cache.py", '''"""LLM Response Cache"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+REDIS_PREFIX = "pharmaintel:llm:"
 
-def create_pharmaintel_graph():
-    """Create the PharmaIntel graph"""
+class ResponseCache:
+    """Content-addressed cache of model responses
     
-    master = MasterOrchestratorAgent()
-    clinical = ClinicalTrialsAgent()
-    patent = PatentLandscapeAgent()
-    iqvia = IQVIAInsightsAgent()
+    An in-process LRU tier bounded by entry count and bytes sits in front of
+    an optional Redis tier shared between workers. Redis errors degrade to a
+    miss so the cache never fails a generation.
+    """
     
-    workflow = StateGraph(PharmaIntelState)
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float = DEFAULT_TTL,
+        redis=None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.redis = redis
+        self.clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.evictions = 0
     
-    workflow.add_node("router", master.route_query)
-    workflow.add_node("clinical_trials", clinical.analyze_trials)
-    workflow.add_node("patent_landscape", patent.analyze_patents)
-    workflow.add_node("iqvia_insights", iqvia.analyze_market)
-    workflow.add_node("synthesize", master.synthesize_findings)
+    @staticmethod
+    def make_key(model_name: str, params: Optional[Dict[str, Any]], prompt: str) -> str:
+        """Key on model, generation parameters and a hash of the full prompt"""
+        payload = json.dumps(
+            {
+                "model": model_name,
+                "params": params or {},
+                "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
     
-    workflow.set_entry_point("router")
+    def get_local(self, key: str) -> Optional[str]:
+        """Look up the in-process tier only"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
     
-    def route_next(state):
-        next_agent = state.get("next_agent", "END")
-        return next_agent if next_agent != "synthesize" else "synthesize"
+    def set_local(self, key: str, value: str, ttl: Optional[float] = None):
+        """Store in the in-process tier, evicting least recently used entries"""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        
+        self._entries[key] = (value, self.clock() + (ttl or self.ttl))
+        self._bytes += size
+        
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
     
-    workflow.add_conditional_edges(
-        "router",
-        route_next,
-        {
-            "clinical_trials": "clinical_trials",
-            "patent_landscape": "patent_landscape",
-            "iqvia_insights": "iqvia_insights",
-            "synthesize": "synthesize"
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value.encode("utf-8"))
+    
+    def lookup(self, key: str) -> Optional[str]:
+        """Synchronous lookup against the local tier, counting hits and misses"""
+        value = self.get_local(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    async def get(self, key: str) -> Optional[str]:
+        """Look up the local tier, then Redis"""
+        value = self.get_local(key)
+        if value is None and self.redis is not None:
+            try:
+                raw = await self.redis.get(REDIS_PREFIX + key)
+            except Exception:
+                self.redis_errors += 1
+                raw = None
+            if raw is not None:
+                value = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+                self.redis_hits += 1
+                self.set_local(key, value)
+        
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Store in both tiers"""
+        self.set_local(key, value, ttl)
+        if self.redis is not None:
+            try:
+                await self.redis.set(REDIS_PREFIX + key, value, ex=max(1, int(ttl or self.ttl)))
+            except Exception:
+                self.redis_errors += 1
+    
+    def clear(self):
+        """Drop the in-process tier"""
+        self._entries.clear()
+        self._bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes
+        }
+
+_cache: Optional[ResponseCache] = ResponseCache()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Process-wide response cache, or None when caching is disabled"""
+    return _cache
+
+def configure_response_cache(cache: Optional[ResponseCache]):
+    """Replace the process-wide cache, typically once at startup"""
+    global _cache
+    _cache = cache
+
+def create_redis_client(host: str, port: int = 6379, db: int = 0):
+    """Build an asyncio Redis client for the shared tier"""
+    import redis.asyncio as redis
+    
+    return redis.Redis(host=host, port=port, db=db)
+''')
+
+    create_file("src/llm/context.py", '''"""Prompt Context Packing"""
+import json
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+CHARS_PER_TOKEN = 4
+DEFAULT_CONTEXT_TOKEN_BUDGET = 2000
+MAX_LIST_ITEMS = 5
+MAX_STRING_CHARS = 400
+
+_WORDS = re.compile(r"[a-z0-9]+")
+
+def count_tokens(text: str) -> int:
+    """Cheap local token estimate (~4 characters per token for Gemini)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def compact_json(value: Any) -> str:
+    """JSON without indentation or padding"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def summarise(value: Any, depth: int = 0) -> Any:
+    """Shrink a value: truncate long strings and lists, flatten deep nesting"""
+    if isinstance(value, str):
+        if len(value) > MAX_STRING_CHARS:
+            return value[:MAX_STRING_CHARS] + "..."
+        return value
+    if isinstance(value, dict):
+        if depth >= 2:
+            return f"<{len(value)} fields>"
+        return {key: summarise(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [summarise(item, depth + 1) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f"... +{len(value) - MAX_LIST_ITEMS} more")
+        return items
+    return value
+
+@dataclass
+class PackedContext:
+    """Serialised context plus what packing did to it"""
+    text: str
+    original_tokens: int
+    packed_tokens: int
+    summarised: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+    
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.packed_tokens
+
+class ContextPacker:
+    """Fits a context dict into a token budget
+    
+    Context is serialised compactly first. If it is still over budget the
+    least relevant top-level entries are summarised, then dropped, until it
+    fits. Relevance is the entry's priority weight plus its word overlap with
+    the task prompt.
+    """
+    
+    def __init__(self, budget_tokens: int = DEFAULT_CONTEXT_TOKEN_BUDGET, priorities: Optional[Dict[str, float]] = None):
+        self.budget_tokens = budget_tokens
+        self.priorities = priorities or {}
+    
+    def relevance(self, key: str, value: Any, prompt_words: set) -> float:
+        words = set(_WORDS.findall(f"{key} {compact_json(value)}".lower()))
+        overlap = len(words & prompt_words) / (len(prompt_words) or 1)
+        return self.priorities.get(key, 1.0) + overlap
+    
+    def pack(self, context: Optional[Dict[str, Any]], prompt: str = "") -> PackedContext:
+        if not context:
+            return PackedContext("None", 0, 1)
+        
+        original = count_tokens(json.dumps(context, indent=2, default=str))
+        entries = dict(context)
+        text = compact_json(entries)
+        packed = PackedContext(text, original, count_tokens(text))
+        if packed.packed_tokens <= self.budget_tokens:
+            return packed
+        
+        prompt_words = set(_WORDS.findall(prompt.lower()))
+        ranked = sorted(entries, key=lambda key: self.relevance(key, entries[key], prompt_words))
+        
+        for key in ranked:
+            shrunk = summarise(entries[key])
+            if shrunk != entries[key]:
+                entries[key] = shrunk
+                packed.summarised.append(key)
+                if count_tokens(compact_json(entries)) <= self.budget_tokens:
+                    break
+        
+        for key in ranked:
+            if count_tokens(compact_json(entries)) <= self.budget_tokens:
+                break
+            del entries[key]
+            packed.dropped.append(key)
+        
+        packed.text = compact_json(entries)
+        packed.packed_tokens = count_tokens(packed.text)
+        return packed
+''')
+
+    create_file("src/llm/router.py", '''"""LLM Model Routing"""
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from src.llm.pool import get_model_pool
+from src.utils.metrics import record_llm_cost, record_llm_escalation
+
+# USD per million tokens (input, output), prompts up to 128k tokens
+MODEL_PRICES: Dict[str, tuple] = {
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+
+@dataclass(frozen=True)
+class ModelTier:
+    """A model and the largest prompt it is trusted with"""
+    name: str
+    model_name: str
+    max_prompt_tokens: int = 1_000_000
+    
+    def cost(self, prompt_tokens: int, output_tokens: int) -> float:
+        input_price, output_price = MODEL_PRICES.get(self.model_name, (0.0, 0.0))
+        return (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+# Smallest first; escalation moves one step along this list
+DEFAULT_TIERS = [
+    ModelTier("fast", "gemini-1.5-flash-8b", max_prompt_tokens=8_000),
+    ModelTier("standard", "gemini-1.5-flash", max_prompt_tokens=32_000),
+    ModelTier("flagship", "gemini-1.5-pro"),
+]
+
+DEFAULT_TASK_TIERS: Dict[str, str] = {
+    "route": "fast",
+    "classify": "fast",
+    "extract": "fast",
+    "summarise": "standard",
+    "analyze": "standard",
+    "synthesize": "flagship",
+}
+
+DEFAULT_TASK = "analyze"
+
+def confidence_at_least(threshold: float, key: str = "confidence_score") -> Callable[[str], bool]:
+    """Validator accepting JSON responses whose ``key`` meets ``threshold``"""
+    
+    def validate(text: str) -> bool:
+        try:
+            value = json.loads(text).get(key)
+        except (ValueError, AttributeError):
+            return False
+        return isinstance(value, (int, float)) and value >= threshold
+    
+    return validate
+
+class TierStats:
+    __slots__ = ("calls", "errors", "escalations", "seconds", "prompt_tokens", "output_tokens", "cost")
+    
+    def __init__(self):
+        self.calls = self.errors = self.escalations = 0
+        self.seconds = self.cost = 0.0
+        self.prompt_tokens = self.output_tokens = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "escalations": self.escalations,
+            "mean_latency_ms": round(self.seconds / self.calls * 1000, 1) if self.calls else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6)
+        }
+
+def _pooled_model(model_name: str):
+    return get_model_pool().get(model_name)
+
+class ModelRouter:
+    """Pick a model tier per call from agent, task and prompt size
+    
+    Agent rules (``"<agent>:<task>"`` or ``"<agent>"``) win over task rules.
+    A prompt larger than the chosen tier's ``max_prompt_tokens`` moves up to
+    the next tier. Model clients come from the shared model pool by default.
+    """
+    
+    def __init__(
+        self,
+        tiers: Optional[List[ModelTier]] = None,
+        task_tiers: Optional[Dict[str, str]] = None,
+        agent_tiers: Optional[Dict[str, str]] = None,
+        model_factory: Callable[[str], Any] = _pooled_model
+    ):
+        self.tiers = list(tiers or DEFAULT_TIERS)
+        self._positions = {tier.name: i for i, tier in enumerate(self.tiers)}
+        self.task_tiers = {**DEFAULT_TASK_TIERS, **(task_tiers or {})}
+        self.agent_tiers = dict(agent_tiers or {})
+        self.model_factory = model_factory
+        self._models: Dict[str, Any] = {}
+        self._stats: Dict[str, TierStats] = {tier.name: TierStats() for tier in self.tiers}
+    
+    def tier(self, name: str) -> ModelTier:
+        return self.tiers[self._positions[name]]
+    
+    def select(self, agent: str, task: str, prompt_tokens: int) -> ModelTier:
+        name = (
+            self.agent_tiers.get(f"{agent}:{task}")
+            or self.agent_tiers.get(agent)
+            or self.task_tiers.get(task)
+            or self.task_tiers[DEFAULT_TASK]
+        )
+        position = self._positions.get(name, len(self.tiers) - 1)
+        while position < len(self.tiers) - 1 and prompt_tokens > self.tiers[position].max_prompt_tokens:
+            position += 1
+        return self.tiers[position]
+    
+    def escalate(self, tier: ModelTier, agent: str = "") -> Optional[ModelTier]:
+        """The next larger tier, or None from the top one"""
+        position = self._positions[tier.name] + 1
+        if position >= len(self.tiers):
+            return None
+        self._stats[tier.name].escalations += 1
+        record_llm_escalation(agent, tier.name)
+        return self.tiers[position]
+    
+    def model_for(self, tier: ModelTier):
+        model = self._models.get(tier.model_name)
+        if model is None:
+            model = self._models[tier.model_name] = self.model_factory(tier.model_name)
+        return model
+    
+    def record(
+        self,
+        tier: ModelTier,
+        agent: str,
+        seconds: float,
+        prompt_tokens: int = 0,
+        output_tokens: int = 0,
+        outcome: str = "ok"
+    ):
+        """Account latency, tokens and cost of one call"""
+        stats = self._stats[tier.name]
+        if outcome != "ok":
+            stats.errors += 1
+            return
+        cost = tier.cost(prompt_tokens, output_tokens)
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.prompt_tokens += prompt_tokens
+        stats.output_tokens += output_tokens
+        stats.cost += cost
+        record_llm_cost(agent, tier.name, cost)
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+_router: Optional[ModelRouter] = None
+
+def get_model_router() -> Optional[ModelRouter]:
+    """Process-wide router, or None when every agent keeps its own model"""
+    return _router
+
+def configure_model_router(router: Optional[ModelRouter]):
+    """Replace the process-wide router, typically once at startup"""
+    global _router
+    _router = router
+''')
+
+    create_file("src/llm/pool.py", '''"""Shared Model Clients"""
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+
+def _gemini_model(model_name: str, **config):
+    import google.generativeai as genai
+    
+    return genai.GenerativeModel(model_name, **config)
+
+class ModelPool:
+    """Process-wide model clients keyed by model name and configuration
+    
+    Agents, the router and every graph built in a worker share one client per
+    key, so the SDK's connections to the model endpoint stay warm across
+    requests instead of being set up per agent.
+    """
+    
+    def __init__(self, factory: Callable[..., Any] = _gemini_model):
+        self.factory = factory
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+    
+    @staticmethod
+    def make_key(model_name: str, config: Dict[str, Any]) -> str:
+        if not config:
+            return model_name
+        return model_name + ":" + json.dumps(config, sort_keys=True, default=str)
+    
+    def get(self, model_name: str, **config) -> Any:
+        """Client for ``model_name`` built with ``config``, created on first use"""
+        key = self.make_key(model_name, config)
+        model = self._models.get(key)
+        if model is not None:
+            self.reused += 1
+            return model
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._models[key] = self.factory(model_name, **config)
+                self.created += 1
+            return model
+    
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        return {"models": len(self._models), "created": self.created, "reused": self.reused}
+    
+    def __len__(self) -> int:
+        return len(self._models)
+
+_pool = ModelPool()
+
+def get_model_pool() -> ModelPool:
+    """Process-wide pool shared by all agents"""
+    return _pool
+
+def configure_model_pool(pool: Optional[ModelPool] = None):
+    """Replace the process-wide pool, e.g. with a fake factory in tests"""
+    global _pool
+    _pool = pool if pool is not None else ModelPool()
+''')
+
+    create_file("src/llm/streaming.py", '''"""Incremental JSON Field Parsing"""
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+ESCAPES = {'"': '"', "\\\\": "\\\\", "/": "/", "b": "\\b", "f": "\\f", "n": "\\n", "r": "\\r", "t": "\\t"}
+
+@dataclass
+class FieldUpdate:
+    """Progress on one top-level field of a streamed JSON object
+    
+    String fields report each newly decoded piece as ``delta``; every field
+    reports its parsed ``value`` once with ``done`` set.
+    """
+    field: str
+    delta: str = ""
+    value: Any = None
+    done: bool = False
+    
+    def to_dict(self) -> Dict[str, Any]:
+        if self.done:
+            return {"field": self.field, "value": self.value, "done": True}
+        return {"field": self.field, "delta": self.delta}
+
+class StreamingJSONParser:
+    """Parses one JSON object as its text arrives in arbitrary chunks
+    
+    Anything before the opening brace (such as a ```json fence) is skipped.
+    Only top-level fields are reported, optionally limited to ``fields``;
+    nested values are parsed whole once they close.
+    """
+    
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        self.fields = set(fields) if fields is not None else None
+        self.result: Dict[str, Any] = {}
+        self.done = False
+        self._state = "start"
+        self._key = ""
+        self._raw: List[str] = []
+        self._escape: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+    
+    def _wanted(self) -> bool:
+        return self.fields is None or self._key in self.fields
+    
+    def feed(self, chunk: str) -> List[FieldUpdate]:
+        """Consume a chunk and return the updates it completed"""
+        updates: List[FieldUpdate] = []
+        delta: List[str] = []
+        for char in chunk:
+            if self.done:
+                break
+            state = self._state
+            if state == "start":
+                if char == "{":
+                    self._state = "key"
+            elif state == "key":
+                if char == '"':
+                    self._state, self._raw = "in_key", []
+                elif char == "}":
+                    self.done = True
+            elif state == "in_key":
+                decoded = self._decode(char)
+                if decoded is None:
+                    continue
+                if decoded is True:
+                    self._key = "".join(self._raw)
+                    self._state = "colon"
+                else:
+                    self._raw.append(decoded)
+            elif state == "colon":
+                if char == ":":
+                    self._state = "value"
+            elif state == "value":
+                if char.isspace():
+                    continue
+                self._raw = []
+                if char == '"':
+                    self._state = "in_string"
+                elif char in "{[":
+                    self._state, self._depth, self._in_string = "in_nested", 1, False
+                    self._raw.append(char)
+                else:
+                    self._state = "in_scalar"
+                    self._raw.append(char)
+            elif state == "in_string":
+                decoded = self._decode(char)
+                if decoded is None:
+                    continue
+                if decoded is True:
+                    if delta:
+                        updates.append(FieldUpdate(self._key, delta="".join(delta)))
+                        delta = []
+                    self._complete("".join(self._raw), updates)
+                else:
+                    self._raw.append(decoded)
+                    if self._wanted():
+                        delta.append(decoded)
+            elif state == "in_scalar":
+                if char in ",}" or char.isspace():
+                    self._complete(self._parse("".join(self._raw)), updates)
+                    if char == ",":
+                        self._state = "key"
+                    elif char == "}":
+                        self.done = True
+                else:
+                    self._raw.append(char)
+            elif state == "in_nested":
+                self._raw.append(char)
+                if self._in_string:
+                    if self._escape is not None:
+                        self._escape = None
+                    elif char == "\\\\":
+                        self._escape = char
+                    elif char == '"':
+                        self._in_string = False
+                elif char == '"':
+                    self._in_string = True
+                elif char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._complete(self._parse("".join(self._raw)), updates)
+            elif state == "next":
+                if char == ",":
+                    self._state = "key"
+                elif char == "}":
+                    self.done = True
+        if delta:
+            updates.append(FieldUpdate(self._key, delta="".join(delta)))
+        return updates
+    
+    def close(self) -> List[FieldUpdate]:
+        """Finish a stream that ended without its closing brace"""
+        updates: List[FieldUpdate] = []
+        if self._state == "in_scalar" and self._raw:
+            self._complete(self._parse("".join(self._raw)), updates)
+        return updates
+    
+    def _decode(self, char: str):
+        """One decoded character, True at the closing quote, None mid-escape"""
+        if self._escape is None:
+            if char == "\\\\":
+                self._escape = ""
+                return None
+            return True if char == '"' else char
+        self._escape += char
+        if self._escape[0] == "u":
+            if len(self._escape) < 5:
+                return None
+            decoded = chr(int(self._escape[1:], 16))
+        else:
+            decoded = ESCAPES.get(self._escape, self._escape)
+        self._escape = None
+        return decoded
+    
+    @staticmethod
+    def _parse(raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
+    
+    def _complete(self, value: Any, updates: List[FieldUpdate]):
+        if self._wanted():
+            self.result[self._key] = value
+            updates.append(FieldUpdate(self._key, value=value, done=True))
+        self._state = "next"
+''')
+    
+    # ========================================================================
+    # TOOLS
+    # ========================================================================
+    
+    create_file("src/tools/__init__.py", "")
+    
+    create_file("src/tools/mcp_server.py", '''"""MCP Server Implementation"""
+import asyncio
+import contextvars
+from typing import List, Dict, Any, Optional
+from src.tools.cache import get_tool_cache, make_key
+from src.tools.http_client import HttpClientPool, get_http_pool
+from src.tools.registry import ToolNotFoundError, ToolRegistry, ToolValidationError, get_tool_registry
+from src.utils.logger import get_logger
+
+logger = get_logger("tools.mcp")
+
+# Tool results shared by every analysis in one batch, keyed by tool and canonical arguments
+shared_tool_results: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "shared_tool_results", default=None
+)
+
+class PharmaIntelMCPServer:
+    """MCP Server for pharmaceutical tools"""
+    
+    def __init__(self, http: Optional[HttpClientPool] = None, registry: Optional[ToolRegistry] = None):
+        self.tools = registry if registry is not None else get_tool_registry()
+        self.http = http or get_http_pool()
+    
+    def list_tools(self) -> List[Dict[str, Any]]:
+        """List available tools"""
+        return self.tools.list_tools()
+    
+    async def call_tool(self, tool_name: str, args: Dict) -> Dict:
+        """Validate arguments, then execute, reusing results already fetched by the same batch
+        
+        Never raises: unknown tools, invalid arguments and handler errors all
+        come back as ``{"success": False, "error": ...}``.
+        """
+        try:
+            spec = self.tools.get(tool_name)
+            args = spec.validate_args(args)
+        except ToolNotFoundError:
+            return {"success": False, "error": f"Unknown tool: {tool_name}"}
+        except ToolValidationError as e:
+            return {"success": False, "error": str(e), "details": e.errors}
+        
+        try:
+            if spec.canonicalise:
+                # Resolution may read local indexes, so it stays off the event loop
+                args = await asyncio.to_thread(spec.canonical_args, args)
+            return await self._shared_execute(tool_name, args)
+        except Exception as e:
+            logger.warning("Tool %s failed", tool_name, exc_info=True)
+            return {"success": False, "error": f"{tool_name} failed: {e}"}
+    
+    async def _shared_execute(self, tool_name: str, args: Dict) -> Dict:
+        shared = shared_tool_results.get()
+        if shared is None:
+            return await self._cached_execute(tool_name, args)
+        
+        key = make_key(tool_name, args)
+        pending = shared.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._cached_execute(tool_name, args))
+            shared[key] = pending
+        try:
+            return await asyncio.shield(pending)
+        except Exception:
+            shared.pop(key, None)
+            raise
+    
+    async def _cached_execute(self, tool_name: str, args: Dict) -> Dict:
+        cache = get_tool_cache()
+        if cache is None:
+            return await self._execute(tool_name, args)
+        return await cache.fetch(tool_name, args, lambda: self._execute(tool_name, args))
+    
+    async def _execute(self, tool_name: str, args: Dict) -> Dict:
+        spec = self.tools.get(tool_name)
+        result = await spec.resolve()(self.http, **args)
+        return {"success": True, "data": spec.validate_result(result)}
+''')
+
+    create_file("src/tools/http_client.py", '''"""Pooled HTTP Clients for Tool Upstreams"""
+import asyncio
+import importlib.util
+import random
+import time
+import weakref
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+import httpx
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+@dataclass
+class UpstreamConfig:
+    """Connection, concurrency and rate limits for one upstream API"""
+    base_url: str
+    max_connections: int = 20
+    max_keepalive: int = 10
+    keepalive_expiry: float = 30.0
+    max_concurrency: int = 10
+    rate_per_second: float = 5.0
+    burst: int = 10
+    timeout: float = 30.0
+    http2: bool = True
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 10.0
+    headers: Dict[str, str] = field(default_factory=dict)
+
+# Published rate limits of the planned tool upstreams
+DEFAULT_UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "clinical_trials": UpstreamConfig("https://clinicaltrials.gov/api/v2", rate_per_second=10, burst=20),
+    "patents": UpstreamConfig("https://search.patentsview.org/api/v1", rate_per_second=0.75, burst=5),
+    "fda": UpstreamConfig("https://api.fda.gov", rate_per_second=4, burst=10),
+    "drugbank": UpstreamConfig("https://api.drugbank.com/v1", rate_per_second=5, burst=10),
+    "pubmed": UpstreamConfig("https://eutils.ncbi.nlm.nih.gov/entrez/eutils", rate_per_second=3, burst=3),
+}
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional ``h2`` package (``httpx[http2]``)"""
+    return importlib.util.find_spec("h2") is not None
+
+class TokenBucket:
+    """Token-bucket rate limiter; ``acquire`` waits for the next token"""
+    
+    def __init__(self, rate_per_second: float, burst: int, clock=time.monotonic):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.updated = clock()
+    
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_acquire(self) -> float:
+        """Take a token if available; otherwise return seconds until one is"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    async def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+def backoff_delay(attempt: int, base: float, cap: float, response: Optional[httpx.Response] = None) -> float:
+    """Full-jitter exponential backoff, deferring to Retry-After when given"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(cap, float(retry_after))
+            except ValueError:
+                try:
+                    return min(cap, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class UpstreamClient:
+    """Keep-alive client for one upstream with concurrency cap, rate limit and retries"""
+    
+    def __init__(self, name: str, config: UpstreamConfig, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.name = name
+        self.config = config
+        self.transport = transport
+        self.bucket = TokenBucket(config.rate_per_second, config.burst)
+        self.requests = 0
+        self.retries = 0
+        # Connections and semaphores belong to one event loop, so keep a set per loop
+        self._loops = weakref.WeakKeyDictionary()
+    
+    def _bound(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        bound = self._loops.get(loop)
+        if bound is None:
+            config = self.config
+            client = httpx.AsyncClient(
+                base_url=config.base_url,
+                http2=config.http2 and self.transport is None and http2_available(),
+                limits=httpx.Limits(
+                    max_connections=config.max_connections,
+                    max_keepalive_connections=config.max_keepalive,
+                    keepalive_expiry=config.keepalive_expiry
+                ),
+                timeout=config.timeout,
+                headers=config.headers,
+                transport=self.transport
+            )
+            bound = self._loops[loop] = (client, asyncio.Semaphore(config.max_concurrency))
+        return bound
+    
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying connection errors, 429 and 5xx with backoff"""
+        client, semaphore = self._bound()
+        
+        for attempt in range(self.config.max_retries + 1):
+            response = None
+            async with semaphore:
+                await self.bucket.acquire()
+                self.requests += 1
+                try:
+                    response = await client.request(method, path, **kwargs)
+                except httpx.TransportError:
+                    if attempt == self.config.max_retries:
+                        raise
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt == self.config.max_retries:
+                        return response
+            
+            self.retries += 1
+            await asyncio.sleep(backoff_delay(attempt, self.config.backoff_base, self.config.backoff_max, response))
+    
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """GET and decode JSON, raising on HTTP errors"""
+        response = await self.request("GET", path, params=params)
+        response.raise_for_status()
+        return response.json()
+    
+    async def aclose(self):
+        """Close this loop's client; those of other loops go with their loops"""
+        bound = self._loops.pop(asyncio.get_running_loop(), None)
+        if bound is not None:
+            await bound[0].aclose()
+
+class HttpClientPool:
+    """Process-wide registry of upstream clients, created on first use"""
+    
+    def __init__(
+        self,
+        upstreams: Optional[Dict[str, UpstreamConfig]] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.upstreams = dict(DEFAULT_UPSTREAMS if upstreams is None else upstreams)
+        self.transport = transport
+        self._clients: Dict[str, UpstreamClient] = {}
+    
+    def get(self, name: str) -> UpstreamClient:
+        client = self._clients.get(name)
+        if client is None:
+            if name not in self.upstreams:
+                raise KeyError(f"Unknown upstream: {name}")
+            client = UpstreamClient(name, self.upstreams[name], self.transport)
+            self._clients[name] = client
+        return client
+    
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+_pool: Optional[HttpClientPool] = None
+
+def get_http_pool() -> HttpClientPool:
+    """Process-wide HTTP client pool"""
+    global _pool
+    if _pool is None:
+        _pool = HttpClientPool()
+    return _pool
+
+def configure_http_pool(pool: Optional[HttpClientPool]):
+    """Replace the process-wide pool, typically once at startup"""
+    global _pool
+    _pool = pool
+''')
+
+    create_file("src/tools/cache.py", '''"""Tool Result Cache"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from src.utils.logger import get_logger
+from src.utils.metrics import record_cache_lookup
+
+logger = get_logger("tools.cache")
+
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 10000
+REDIS_PREFIX = "pharmaintel:tool:"
+
+# Seconds a result stays fresh, by how often the upstream data changes
+DEFAULT_TOOL_TTLS: Dict[str, float] = {
+    "clinical_trials": 6 * 3600.0,
+    "pubmed": 12 * 3600.0,
+    "fda": 24 * 3600.0,
+    "patents": 7 * 24 * 3600.0,
+    "drugbank": 7 * 24 * 3600.0,
+    # Computed locally in milliseconds; caching would only serve stale aggregates
+    "trial_analytics": 0.0,
+    "market_analytics": 0.0,
+}
+
+def canonical_args(args: Optional[Dict[str, Any]]) -> str:
+    """Stable encoding of tool arguments: sorted keys, no unset values"""
+    cleaned = {k: v for k, v in (args or {}).items() if v is not None}
+    return json.dumps(cleaned, sort_keys=True, separators=(",", ":"), default=str)
+
+def make_key(tool_name: str, args: Optional[Dict[str, Any]]) -> str:
+    return tool_name + ":" + canonical_args(args)
+
+class ToolResultCache:
+    """In-process cache of tool results with single-flight loading
+    
+    Concurrent misses for the same tool and arguments share one upstream call.
+    With ``stale_ttl`` set, an expired entry is still served for that long
+    while a single background call refreshes it. Failed calls are not cached.
+    With ``redis``, results are also shared with every other worker process,
+    so each upstream payload is fetched once per TTL rather than once per
+    process; Redis errors only cost the shared tier.
+    """
+    
+    def __init__(
+        self,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = DEFAULT_TTL,
+        stale_ttl: float = 0.0,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        redis=None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttls = {**DEFAULT_TOOL_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.redis = redis
+        self.clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+    
+    def ttl_for(self, tool_name: str) -> float:
+        return self.ttls.get(tool_name, self.default_ttl)
+    
+    async def fetch(
+        self,
+        tool_name: str,
+        args: Optional[Dict[str, Any]],
+        loader: Callable[[], Awaitable[Dict]]
+    ) -> Dict:
+        """Return a cached result, or load it once for all concurrent callers"""
+        key = make_key(tool_name, args)
+        entry = self._entries.get(key)
+        now = self.clock()
+        
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache_lookup("tool", True)
+                return value
+            if now < stale_until:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                record_cache_lookup("tool", True)
+                if key not in self._inflight:
+                    self._start(key, tool_name, loader)
+                return value
+            self._entries.pop(key)
+        
+        self.misses += 1
+        record_cache_lookup("tool", False)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start(key, tool_name, loader)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+    
+    def _start(self, key: str, tool_name: str, loader) -> asyncio.Future:
+        task = asyncio.ensure_future(self._load(key, tool_name, loader))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._settle(key, done))
+        return task
+    
+    def _settle(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None and key in self._entries:
+            # Background refresh failed; keep serving the stale entry
+            self.refresh_errors += 1
+            logger.warning(
+                "Tool refresh failed",
+                extra={"event": "tool_refresh_failed", "fields": {"key": key, "error": repr(task.exception())}}
+            )
+    
+    async def _load(self, key: str, tool_name: str, loader) -> Dict:
+        shared = await self._get_shared(key, tool_name)
+        if shared is not None:
+            self.set(key, tool_name, shared)
+            return shared
+        result = await loader()
+        if not (isinstance(result, dict) and result.get("success") is False):
+            self.set(key, tool_name, result)
+            await self._set_shared(key, tool_name, result)
+        return result
+    
+    async def _get_shared(self, key: str, tool_name: str) -> Optional[Dict]:
+        if self.redis is None or self.ttl_for(tool_name) <= 0:
+            return None
+        try:
+            raw = await self.redis.get(REDIS_PREFIX + key)
+        except Exception:
+            self.redis_errors += 1
+            return None
+        if raw is None:
+            return None
+        self.redis_hits += 1
+        return json.loads(raw)
+    
+    async def _set_shared(self, key: str, tool_name: str, value: Dict):
+        ttl = self.ttl_for(tool_name)
+        if self.redis is None or ttl <= 0:
+            return
+        try:
+            await self.redis.set(REDIS_PREFIX + key, json.dumps(value, default=str), ex=max(1, int(ttl)))
+        except Exception:
+            self.redis_errors += 1
+    
+    def set(self, key: str, tool_name: str, value: Dict):
+        """Store a result, evicting least recently used entries"""
+        ttl = self.ttl_for(tool_name)
+        if ttl <= 0:
+            return
+        now = self.clock()
+        self._entries.pop(key, None)
+        self._entries[key] = (value, now + ttl, now + ttl + self.stale_ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def invalidate(self, tool_name: str, args: Optional[Dict[str, Any]] = None):
+        """Drop one entry, or every entry for a tool when ``args`` is None"""
+        if args is not None:
+            self._entries.pop(make_key(tool_name, args), None)
+            return
+        prefix = tool_name + ":"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refresh_errors": self.refresh_errors,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight)
+        }
+
+_cache: Optional[ToolResultCache] = ToolResultCache()
+
+def get_tool_cache() -> Optional[ToolResultCache]:
+    """Process-wide tool result cache, or None when caching is disabled"""
+    return _cache
+
+def configure_tool_cache(cache: Optional[ToolResultCache]):
+    """Replace the process-wide cache, typically once at startup"""
+    global _cache
+    _cache = cache
+''')
+
+    create_file("src/tools/definitions.py", '''"""Built-in Tool Definitions"""
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, ConfigDict, Field
+from src.tools.registry import ToolRegistry, ToolSpec
+
+class ToolInput(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+class ClinicalTrialsInput(ToolInput):
+    condition: Optional[str] = None
+    intervention: Optional[str] = None
+    status: Optional[str] = None
+    limit: int = Field(default=20, ge=1, le=100)
+
+class PatentsInput(ToolInput):
+    query: str = Field(min_length=1)
+    limit: int = Field(default=20, ge=1, le=100)
+
+class FdaInput(ToolInput):
+    drug: str = Field(min_length=1)
+    endpoint: str = Field(default="label", pattern="^(label|event|drugsfda)$")
+    limit: int = Field(default=10, ge=1, le=100)
+
+class DrugbankInput(ToolInput):
+    drug: str = Field(min_length=1)
+    limit: int = Field(default=10, ge=1, le=50)
+    page: Optional[int] = Field(default=None, ge=1)
+
+class PubmedInput(ToolInput):
+    query: str = Field(min_length=1)
+    limit: int = Field(default=20, ge=1, le=200)
+
+class TrialAnalyticsInput(ToolInput):
+    query: Optional[str] = None
+    intervention: Optional[str] = None
+    condition: Optional[str] = None
+    phase: Optional[str] = None
+    group_by: str = Field(default="phase", pattern="^(phase|status|start_year)$")
+
+class MarketAnalyticsInput(ToolInput):
+    query: Optional[str] = None
+    indication: Optional[str] = None
+    regions: Optional[List[str]] = None
+    year: Optional[int] = Field(default=None, ge=1900, le=2100)
+
+class RecordsOutput(BaseModel):
+    total: Optional[int] = None
+    records: List[Dict[str, Any]] = []
+
+class TerminationReason(BaseModel):
+    reason: str
+    trials: int
+    share: float
+
+class TrialGroup(BaseModel):
+    group: str
+    trials: int
+    finished: int
+    failed: int
+    failure_rate: Optional[float] = None
+
+class TrialAnalyticsOutput(BaseModel):
+    matched: Dict[str, Optional[str]] = {}
+    trials_analyzed: int
+    finished: int
+    failed: int
+    failure_rate: Optional[float] = None
+    primary_reason: Optional[str] = None
+    termination_reasons: List[TerminationReason] = []
+    group_by: str
+    groups: List[TrialGroup] = []
+
+class RegionMarket(BaseModel):
+    region: str
+    target_population: int
+    tam: float
+
+class MarketAnalyticsOutput(BaseModel):
+    indication: Optional[str] = None
+    year: Optional[int] = None
+    target_population: Optional[int] = None
+    tam: Optional[float] = None
+    by_region: List[RegionMarket] = []
+
+def register_builtin_tools(registry: ToolRegistry):
+    """Declare the upstream tools; handlers import on first call"""
+    for spec in (
+        ToolSpec(
+            "clinical_trials",
+            "Search ClinicalTrials.gov studies by condition and intervention",
+            ClinicalTrialsInput,
+            RecordsOutput,
+            "src.tools.sources:search_clinical_trials"
+        ),
+        ToolSpec(
+            "patents",
+            "Search granted patents by keyword",
+            PatentsInput,
+            RecordsOutput,
+            "src.tools.sources:search_patents"
+        ),
+        ToolSpec(
+            "fda",
+            "Query openFDA labels, adverse events or approvals for a drug",
+            FdaInput,
+            RecordsOutput,
+            "src.tools.sources:search_fda"
+        ),
+        ToolSpec(
+            "drugbank",
+            "Look up drug records in DrugBank",
+            DrugbankInput,
+            RecordsOutput,
+            "src.tools.sources:search_drugbank"
+        ),
+        ToolSpec(
+            "pubmed",
+            "Search PubMed for article ids matching a query",
+            PubmedInput,
+            RecordsOutput,
+            "src.tools.sources:search_pubmed"
+        ),
+        ToolSpec(
+            "trial_analytics",
+            "Failure rate and termination reasons from the local trial index, grouped by phase, status or start year",
+            TrialAnalyticsInput,
+            TrialAnalyticsOutput,
+            "src.tools.analytics:trial_analytics",
+            validate_output=True,
+            canonicalise="src.tools.analytics:resolve_trial_args"
+        ),
+        ToolSpec(
+            "market_analytics",
+            "Target population and total addressable market for an indication from local market data",
+            MarketAnalyticsInput,
+            MarketAnalyticsOutput,
+            "src.tools.analytics:market_analytics",
+            validate_output=True,
+            canonicalise="src.tools.analytics:resolve_market_args"
+        ),
+    ):
+        registry.register(spec)
+''')
+
+    create_file("src/tools/registry.py", '''"""Tool Registry"""
+import importlib
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Type, Union
+from pydantic import BaseModel, ValidationError
+
+class ToolNotFoundError(KeyError):
+    """Raised for a tool name that was never registered"""
+
+class ToolValidationError(ValueError):
+    """Raised when tool arguments or results do not match the declared schema"""
+    
+    def __init__(self, tool_name: str, error: ValidationError):
+        self.tool_name = tool_name
+        self.errors = error.errors(include_url=False)
+        super().__init__(f"Invalid {tool_name} payload: {error.error_count()} error(s)")
+
+@dataclass
+class ToolSpec:
+    """A tool's schemas and a handler imported on first call
+    
+    ``handler`` is either a coroutine function or a ``"module:function"``
+    path, so modules with heavy dependencies load only when used. The
+    optional ``canonicalise`` hook, given the same way, rewrites validated
+    arguments to the entities they name; results are shared and cached under
+    the rewritten arguments, so differently worded calls about the same drug
+    reuse one another's results.
+    """
+    name: str
+    description: str
+    input_model: Type[BaseModel]
+    output_model: Optional[Type[BaseModel]] = None
+    handler: Union[str, Callable[..., Any]] = ""
+    validate_output: bool = False
+    canonicalise: Union[str, Callable[[Dict[str, Any]], Dict[str, Any]], None] = None
+    _descriptor: Dict[str, Any] = field(default_factory=dict, init=False, repr=False)
+    
+    def __post_init__(self):
+        # Pydantic builds each model's validator once, at class creation;
+        # the JSON schemas are rendered here so listing is a dict lookup
+        self._descriptor = {
+            "name": self.name,
+            "description": self.description,
+            "inputSchema": self.input_model.model_json_schema()
         }
+        if self.output_model is not None:
+            self._descriptor["outputSchema"] = self.output_model.model_json_schema()
+    
+    @property
+    def descriptor(self) -> Dict[str, Any]:
+        return self._descriptor
+    
+    @property
+    def loaded(self) -> bool:
+        return callable(self.handler)
+    
+    def resolve(self) -> Callable[..., Any]:
+        """Import the handler on first use and keep the function"""
+        if not callable(self.handler):
+            module_name, _, attr = self.handler.partition(":")
+            self.handler = getattr(importlib.import_module(module_name), attr)
+        return self.handler
+    
+    def canonical_args(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """Validated arguments passed through ``canonicalise``, if the tool has one"""
+        if not self.canonicalise:
+            return args
+        if not callable(self.canonicalise):
+            module_name, _, attr = self.canonicalise.partition(":")
+            self.canonicalise = getattr(importlib.import_module(module_name), attr)
+        return self.canonicalise(args)
+    
+    def validate_args(self, args: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Validate and normalise arguments, filling defaults"""
+        try:
+            parsed = self.input_model.model_validate(args or {})
+        except ValidationError as e:
+            raise ToolValidationError(self.name, e) from None
+        return parsed.model_dump(exclude_none=True)
+    
+    def validate_result(self, result: Any) -> Any:
+        if not self.validate_output or self.output_model is None:
+            return result
+        try:
+            return self.output_model.model_validate(result).model_dump()
+        except ValidationError as e:
+            raise ToolValidationError(self.name, e) from None
+
+class ToolRegistry:
+    """Registered tools and their precomputed descriptors"""
+    
+    def __init__(self):
+        self._tools: Dict[str, ToolSpec] = {}
+        self._descriptors: List[Dict[str, Any]] = []
+    
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        if spec.name in self._tools:
+            raise ValueError(f"Tool already registered: {spec.name}")
+        self._tools[spec.name] = spec
+        self._descriptors = [tool.descriptor for tool in self._tools.values()]
+        return spec
+    
+    def get(self, name: str) -> ToolSpec:
+        spec = self._tools.get(name)
+        if spec is None:
+            raise ToolNotFoundError(name)
+        return spec
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+    
+    def __len__(self) -> int:
+        return len(self._tools)
+    
+    def list_tools(self) -> List[Dict[str, Any]]:
+        return self._descriptors
+
+_registry: Optional[ToolRegistry] = None
+
+def get_tool_registry() -> ToolRegistry:
+    """Process-wide registry holding the built-in tools"""
+    global _registry
+    if _registry is None:
+        from src.tools.definitions import register_builtin_tools
+        
+        _registry = ToolRegistry()
+        register_builtin_tools(_registry)
+    return _registry
+
+def configure_tool_registry(registry: Optional[ToolRegistry]):
+    """Replace the process-wide registry"""
+    global _registry
+    _registry = registry
+''')
+
+    create_file("src/tools/sources.py", '''"""Upstream Tool Handlers"""
+import json
+from typing import Any, Dict, Optional
+from src.tools.http_client import HttpClientPool
+
+FDA_SEARCH_FIELDS = {
+    "label": "openfda.generic_name",
+    "event": "patient.drug.openfda.generic_name",
+    "drugsfda": "openfda.generic_name",
+}
+
+async def search_clinical_trials(
+    http: HttpClientPool,
+    condition: Optional[str] = None,
+    intervention: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 20
+) -> Dict[str, Any]:
+    params = {"pageSize": limit, "countTotal": "true"}
+    if condition:
+        params["query.cond"] = condition
+    if intervention:
+        params["query.intr"] = intervention
+    if status:
+        params["filter.overallStatus"] = status
+    data = await http.get("clinical_trials").get_json("/studies", params=params)
+    return {"total": data.get("totalCount"), "records": data.get("studies", [])}
+
+async def search_patents(http: HttpClientPool, query: str, limit: int = 20) -> Dict[str, Any]:
+    params = {
+        "q": json.dumps({"_text_any": {"patent_abstract": query}}),
+        "o": json.dumps({"size": limit})
+    }
+    data = await http.get("patents").get_json("/patent/", params=params)
+    return {"total": data.get("total_hits"), "records": data.get("patents", [])}
+
+async def search_fda(http: HttpClientPool, drug: str, endpoint: str = "label", limit: int = 10) -> Dict[str, Any]:
+    params = {"search": f'{FDA_SEARCH_FIELDS[endpoint]}:"{drug}"', "limit": limit}
+    data = await http.get("fda").get_json(f"/drug/{endpoint}.json", params=params)
+    total = data.get("meta", {}).get("results", {}).get("total")
+    return {"total": total, "records": data.get("results", [])}
+
+async def search_drugbank(
+    http: HttpClientPool,
+    drug: str,
+    limit: int = 10,
+    page: Optional[int] = None
+) -> Dict[str, Any]:
+    params = {"q": drug, "per_page": limit}
+    if page:
+        params["page"] = page
+    data = await http.get("drugbank").get_json("/drug_names", params=params)
+    records = data.get("products", []) if isinstance(data, dict) else data
+    return {"total": len(records), "records": records}
+
+async def search_pubmed(http: HttpClientPool, query: str, limit: int = 20) -> Dict[str, Any]:
+    params = {"db": "pubmed", "term": query, "retmax": limit, "retmode": "json"}
+    data = await http.get("pubmed").get_json("/esearch.fcgi", params=params)
+    result = data.get("esearchresult", {})
+    return {
+        "total": int(result.get("count", 0)),
+        "records": [{"pmid": pmid} for pmid in result.get("idlist", [])]
+    }
+''')
+
+    create_file("src/tools/analytics.py", '''"""Trial and Market Analytics
+
+Deterministic aggregates over the local trial index and market table,
+computed with vectorised pandas group-bys so agents get typed numbers
+without asking a model to do arithmetic. Trial failure statistics are
+queries on ``TrialsIndex`` itself; these tools resolve the arguments.
+"""
+import asyncio
+import re
+from typing import Any, Dict, Iterable, List, Optional
+import pandas as pd
+from src.indexes.clinical_trials import frame_records, get_trials_index
+from src.indexes.market import get_market_data
+from src.tools.http_client import HttpClientPool
+
+def match_indication(keys: Iterable[str], query: str) -> Optional[str]:
+    """Most specific indication whose words all appear in ``query``"""
+    words = set(re.findall(r"[a-z0-9]+", query.lower()))
+    matches = [key for key in set(keys) if set(re.findall(r"[a-z0-9]+", key)) <= words]
+    return max(matches, key=lambda key: (len(key.split()), key)) if matches else None
+
+def market_summary(
+    frame: pd.DataFrame,
+    indication: str,
+    regions: Optional[List[str]] = None,
+    year: Optional[int] = None
+) -> Dict[str, Any]:
+    """Treated patients and total addressable market for one indication
+    
+    Target population is prevalence x diagnosed rate x treated rate; the TAM
+    prices each of those patients at the annual cost of therapy. Defaults to
+    the latest year with data.
+    """
+    rows = frame[frame["key"] == indication.strip().lower()]
+    if regions:
+        rows = rows[rows["region"].str.lower().isin([region.lower() for region in regions])]
+    if year is None and len(rows):
+        year = int(rows["year"].max())
+    rows = rows[rows["year"] == year]
+    
+    patients = rows["prevalence"] * rows["diagnosed_rate"] * rows["treated_rate"]
+    by_region = (
+        rows.assign(target_population=patients, tam=patients * rows["annual_cost_usd"])
+        .groupby("region", sort=True)[["target_population", "tam"]]
+        .sum()
+        .reset_index()
+    )
+    by_region["target_population"] = by_region["target_population"].round().astype("int64")
+    by_region["tam"] = by_region["tam"].round(2)
+    return {
+        "indication": indication,
+        "year": year,
+        "target_population": int(by_region["target_population"].sum()),
+        "tam": round(float(by_region["tam"].sum()), 2),
+        "by_region": frame_records(by_region),
+    }
+
+def _without_query(args: Dict[str, Any], resolved: Dict[str, Any]) -> Dict[str, Any]:
+    found = {key: value for key, value in resolved.items() if value and not args.get(key)}
+    if not found:
+        return args
+    return {**{key: value for key, value in args.items() if key != "query"}, **found}
+
+def resolve_trial_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace a free-text ``query`` with the intervention and condition it names"""
+    index = get_trials_index()
+    if index is None or not args.get("query"):
+        return args
+    return _without_query(args, index.resolve_query(args["query"]))
+
+def resolve_market_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace a free-text ``query`` with the indication it names"""
+    market = get_market_data()
+    if market is None or not args.get("query") or args.get("indication"):
+        return args
+    return _without_query(args, {"indication": match_indication(market.frame()["key"], args["query"])})
+
+async def trial_analytics(
+    http: HttpClientPool,
+    query: Optional[str] = None,
+    intervention: Optional[str] = None,
+    condition: Optional[str] = None,
+    phase: Optional[str] = None,
+    group_by: str = "phase"
+) -> Dict[str, Any]:
+    index = get_trials_index()
+    if index is None:
+        raise LookupError("No local clinical trials index is configured")
+    
+    def summarise():
+        terms = index.resolve_query(query) if query else {}
+        terms = {**terms, **{
+            key: value for key, value in (("intervention", intervention), ("condition", condition)) if value
+        }}
+        return {"matched": terms, **index.failure_stats(phase=phase, group_by=group_by, **terms)}
+    
+    return await asyncio.to_thread(summarise)
+
+async def market_analytics(
+    http: HttpClientPool,
+    query: Optional[str] = None,
+    indication: Optional[str] = None,
+    regions: Optional[List[str]] = None,
+    year: Optional[int] = None
+) -> Dict[str, Any]:
+    market = get_market_data()
+    if market is None:
+        raise LookupError("No local market data is configured")
+    
+    def summarise():
+        frame = market.frame()
+        name = indication or match_indication(frame["key"], query or "")
+        if name is None:
+            return {"indication": None, "year": year, "target_population": None, "tam": None, "by_region": []}
+        return market_summary(frame, name, regions, year)
+    
+    return await asyncio.to_thread(summarise)
+''')
+
+    # ========================================================================
+    # INDEXES
+    # ========================================================================
+    
+    create_file("src/indexes/__init__.py", "")
+
+    create_file("src/indexes/clinical_trials.py", '''"""Local ClinicalTrials.gov Index
+
+Streams registry bulk exports into a SQLite file with an FTS5 index over
+interventions, conditions and titles, so trial statistics for an analysis
+come from disk in milliseconds instead of from the rate-limited live API.
+
+    python -m src.indexes.clinical_trials ingest ctg-studies.json.zip
+    python -m src.indexes.clinical_trials refresh
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+from src.utils.lazy import lazy_import
+from src.utils.query_terms import GENERIC_TERMS, PHRASE_QUALIFIERS, query_words, stem
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+DEFAULT_PATH = "data/clinical_trials.db"
+
+# Finished without reaching their endpoints
+FAILED_STATUSES = ("TERMINATED", "WITHDRAWN", "SUSPENDED")
+FINISHED_STATUSES = ("COMPLETED",) + FAILED_STATUSES
+
+# First matching pattern names the category of a trial's why_stopped text
+TERMINATION_REASONS = [
+    ("safety", re.compile(r"safety|adverse|toxicit|side effect|death|risk", re.I)),
+    ("efficacy", re.compile(r"efficacy|futility|futile|lack of (?:benefit|effect)|ineffective|endpoint", re.I)),
+    ("enrollment", re.compile(r"enrol|accrual|recruit|participants", re.I)),
+    ("funding", re.compile(r"fund|financ|budget|business|commercial|strategic|portfolio", re.I)),
+    ("sponsor decision", re.compile(r"sponsor|company decision|priorit", re.I)),
+    ("logistics", re.compile(r"drug supply|manufactur|site|investigator|staff|covid", re.I)),
+]
+
+# Columns of the rows returned by TrialsIndex.select
+STUDY_COLUMNS = ("nct_id", "status", "why_stopped", "enrollment", "start_date", "phases")
+
+_WORDS = re.compile(r"[a-z0-9]+")
+
+UNKNOWN_GROUP = "unknown"
+
+def frame_records(frame: "pd.DataFrame") -> List[Dict[str, Any]]:
+    """Rows as plain Python values with NaN as None"""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+def trial_frame(rows: Iterable[tuple]) -> "pd.DataFrame":
+    """DataFrame of ``TrialsIndex.select`` rows with a combined phase label"""
+    frame = pd.DataFrame.from_records(list(rows), columns=list(STUDY_COLUMNS))
+    phases = frame["phases"].fillna("").str.split("|").map(lambda values: "/".join(sorted(filter(None, values))))
+    frame["phase"] = phases.replace("", UNKNOWN_GROUP)
+    years = frame["start_date"].fillna("").str.slice(0, 4)
+    frame["start_year"] = years.where(years.str.fullmatch(r"\\d{4}"), UNKNOWN_GROUP)
+    return frame
+
+def termination_categories(why_stopped: "pd.Series") -> "np.ndarray":
+    """Category of each why_stopped text: the first matching ``TERMINATION_REASONS`` pattern"""
+    text = why_stopped.fillna("").astype(str)
+    conditions = [text.str.contains(pattern) for _, pattern in TERMINATION_REASONS]
+    categories = np.select(conditions, [name for name, _ in TERMINATION_REASONS], default="other")
+    return np.where(text.str.strip() == "", "not reported", categories)
+
+def _failure_rate(failed: "pd.Series", finished: "pd.Series") -> "pd.Series":
+    return (failed / finished.where(finished > 0)).round(4)
+
+def trial_failure_summary(frame: "pd.DataFrame", group_by: str = "phase", limit: int = 5) -> Dict[str, Any]:
+    """Failure rate among finished trials, overall and per ``group_by`` value"""
+    flags = pd.DataFrame({
+        "group": frame[group_by],
+        "finished": frame["status"].isin(FINISHED_STATUSES).astype("int64"),
+        "failed": frame["status"].isin(FAILED_STATUSES).astype("int64"),
+    })
+    groups = flags.groupby("group", sort=True).agg(
+        trials=("finished", "size"),
+        finished=("finished", "sum"),
+        failed=("failed", "sum"),
+    )
+    groups["failure_rate"] = _failure_rate(groups["failed"], groups["finished"])
+    
+    failed = flags["failed"].to_numpy(dtype=bool)
+    categories = pd.Series(termination_categories(frame["why_stopped"])[failed], dtype=object)
+    reasons = categories.value_counts().rename_axis("reason").reset_index(name="trials")
+    reasons = reasons.sort_values(["trials", "reason"], ascending=[False, True]).head(limit)
+    reasons["share"] = (reasons["trials"] / max(1, int(failed.sum()))).round(4)
+    
+    finished_total = int(flags["finished"].sum())
+    failed_total = int(flags["failed"].sum())
+    return {
+        "trials_analyzed": len(frame),
+        "finished": finished_total,
+        "failed": failed_total,
+        "failure_rate": round(failed_total / finished_total, 4) if finished_total else None,
+        "primary_reason": reasons["reason"].iloc[0] if len(reasons) else None,
+        "termination_reasons": frame_records(reasons),
+        "group_by": group_by,
+        "groups": frame_records(groups.reset_index()),
+    }
+
+def phrase_core(phrase: str) -> Tuple[FrozenSet[str], List[str]]:
+    """Stemmed content words of an indexed phrase, and the words themselves"""
+    words = [
+        word for word in query_words(phrase)
+        if not word.isdigit() and stem(word) not in PHRASE_QUALIFIERS
+    ]
+    return frozenset(stem(word) for word in words), words
+
+def _status(value: Optional[str]) -> str:
+    return re.sub(r"[^A-Z]+", "_", (value or "UNKNOWN").upper()).strip("_")
+
+def _phases(values: Iterable[str]) -> List[str]:
+    phases = []
+    for value in values:
+        if (value or "").upper() in ("N/A", "NA", "NOT APPLICABLE"):
+            continue
+        for part in re.split(r"[/,]", value or ""):
+            part = re.sub(r"[^A-Z0-9]", "", part.upper())
+            if part and part not in phases:
+                phases.append(part.replace("EARLYPHASE1", "EARLY_PHASE1"))
+    return phases
+
+def _get(data: Dict[str, Any], path: str, default=None):
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return default
+        data = data.get(key)
+    return default if data is None else data
+
+def study_from_json(raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Index record from an API v2 study document"""
+    protocol = raw.get("protocolSection", raw)
+    nct_id = _get(protocol, "identificationModule.nctId")
+    if not nct_id:
+        return None
+    interventions = _get(protocol, "armsInterventionsModule.interventions", [])
+    return {
+        "nct_id": nct_id,
+        "title": _get(protocol, "identificationModule.briefTitle", ""),
+        "status": _status(_get(protocol, "statusModule.overallStatus")),
+        "why_stopped": _get(protocol, "statusModule.whyStopped"),
+        "phases": _phases(_get(protocol, "designModule.phases", [])),
+        "conditions": list(_get(protocol, "conditionsModule.conditions", [])),
+        "interventions": [item.get("name", "") for item in interventions if item.get("name")],
+        "enrollment": _get(protocol, "designModule.enrollmentInfo.count"),
+        "start_date": _get(protocol, "statusModule.startDateStruct.date"),
+        "last_update": _get(protocol, "statusModule.lastUpdatePostDateStruct.date", ""),
+    }
+
+def _iso_date(value: Optional[str]) -> str:
+    """Legacy XML dates ("March 5, 2021") as ISO dates; anything else unchanged"""
+    for fmt in ("%B %d, %Y", "%B %Y"):
+        try:
+            return time.strftime("%Y-%m-%d", time.strptime(value or "", fmt))
+        except ValueError:
+            continue
+    return value or ""
+
+def study_from_xml(root: ET.Element) -> Optional[Dict[str, Any]]:
+    """Index record from a legacy ``<clinical_study>`` document"""
+    nct_id = root.findtext("id_info/nct_id")
+    if not nct_id:
+        return None
+    enrollment = root.findtext("enrollment")
+    return {
+        "nct_id": nct_id,
+        "title": root.findtext("brief_title", ""),
+        "status": _status(root.findtext("overall_status")),
+        "why_stopped": root.findtext("why_stopped"),
+        "phases": _phases([root.findtext("phase", "")]),
+        "conditions": [element.text for element in root.findall("condition") if element.text],
+        "interventions": [element.text for element in root.findall("intervention/intervention_name") if element.text],
+        "enrollment": int(enrollment) if enrollment and enrollment.isdigit() else None,
+        "start_date": _iso_date(root.findtext("start_date")),
+        "last_update": _iso_date(root.findtext("last_update_posted") or root.findtext("lastchanged_date")),
+    }
+
+def _studies_in(name: str, stream) -> Iterator[Dict[str, Any]]:
+    """Records in one export file, read incrementally where the format allows"""
+    if name.endswith(".xml"):
+        for _, element in ET.iterparse(stream, events=("end",)):
+            if element.tag == "clinical_study":
+                record = study_from_xml(element)
+                element.clear()
+                if record:
+                    yield record
+        return
+    if name.endswith((".jsonl", ".ndjson")):
+        documents = (json.loads(line) for line in stream if line.strip())
+    else:
+        data = json.load(stream)
+        documents = data.get("studies", [data]) if isinstance(data, dict) else data
+    for document in documents:
+        record = study_from_json(document)
+        if record:
+            yield record
+
+def iter_studies(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream records from an export file, a zip of per-study files or a directory
+    
+    Both the API v2 JSON exports and the legacy XML archives are accepted.
+    One study is held in memory at a time (a single JSON array file is the
+    exception; use the zip or JSON-lines exports for the full registry).
+    """
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                yield from iter_studies(os.path.join(root, name))
+    elif path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith((".json", ".jsonl", ".ndjson", ".xml")):
+                    with archive.open(name) as stream:
+                        yield from _studies_in(name, stream)
+    elif path.endswith((".json", ".jsonl", ".ndjson", ".xml")):
+        with open(path, "rb") as stream:
+            yield from _studies_in(path, stream)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS studies ("
+    "id INTEGER PRIMARY KEY, nct_id TEXT NOT NULL UNIQUE, status TEXT NOT NULL, "
+    "why_stopped TEXT, enrollment INTEGER, start_date TEXT, last_update TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS studies_status ON studies (status)",
+    "CREATE TABLE IF NOT EXISTS study_phases ("
+    "phase TEXT NOT NULL, study_id INTEGER NOT NULL, PRIMARY KEY (phase, study_id)) WITHOUT ROWID",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS studies_fts USING fts5("
+    "interventions, conditions, title, tokenize='porter unicode61')",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+def _match_expression(text: str, column: Optional[str] = None) -> Optional[str]:
+    """FTS5 query requiring every word of ``text``, optionally in one column"""
+    words = _WORDS.findall((text or "").lower())
+    if not words:
+        return None
+    phrase = " ".join(f'"{word}"' for word in words)
+    return f"{column} : ({phrase})" if column else phrase
+
+class TrialsIndex:
+    """SQLite index of registry studies with failure statistics queries
+    
+    Conditions, interventions and titles are full-text indexed; status and
+    phase are keyed columns. Ingestion upserts by NCT ID and skips studies
+    whose last update is not newer than the stored one, so re-running it on
+    a delta export only touches what changed.
+    """
+    
+    def __init__(self, path: str = DEFAULT_PATH):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+    
+    def ingest(self, records: Iterable[Dict[str, Any]], batch_size: int = 5000) -> Dict[str, int]:
+        """Upsert records, committing every ``batch_size``; returns counts"""
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        watermark = self.last_update() or ""
+        pending = 0
+        with self._lock:
+            for record in records:
+                outcome = self._upsert(record)
+                counts[outcome] += 1
+                watermark = max(watermark, record.get("last_update") or "")
+                pending += 1
+                if pending >= batch_size:
+                    self._conn.commit()
+                    pending = 0
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_update', ?)", (watermark,))
+            self._conn.commit()
+        return counts
+    
+    def _upsert(self, record: Dict[str, Any]) -> str:
+        conn = self._conn
+        row = conn.execute(
+            "SELECT id, last_update FROM studies WHERE nct_id = ?", (record["nct_id"],)
+        ).fetchone()
+        last_update = record.get("last_update") or ""
+        if row is not None and row[1] >= last_update:
+            return "unchanged"
+        values = (record["status"], record.get("why_stopped"), record.get("enrollment"), record.get("start_date"), last_update)
+        if row is None:
+            study_id = conn.execute(
+                "INSERT INTO studies (status, why_stopped, enrollment, start_date, last_update, nct_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                values + (record["nct_id"],)
+            ).lastrowid
+        else:
+            study_id = row[0]
+            conn.execute(
+                "UPDATE studies SET status = ?, why_stopped = ?, enrollment = ?, start_date = ?, last_update = ? "
+                "WHERE id = ?",
+                values + (study_id,)
+            )
+            conn.execute("DELETE FROM study_phases WHERE study_id = ?", (study_id,))
+            conn.execute("DELETE FROM studies_fts WHERE rowid = ?", (study_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO study_phases VALUES (?, ?)",
+            [(phase, study_id) for phase in record.get("phases", [])]
+        )
+        conn.execute(
+            "INSERT INTO studies_fts (rowid, interventions, conditions, title) VALUES (?, ?, ?, ?)",
+            (study_id, " | ".join(record.get("interventions", [])), " | ".join(record.get("conditions", [])), record.get("title", ""))
+        )
+        return "inserted" if row is None else "updated"
+    
+    def ingest_path(self, path: str) -> Dict[str, int]:
+        return self.ingest(iter_studies(path))
+    
+    def last_update(self) -> Optional[str]:
+        """Newest last-update date ingested; the starting point of a delta refresh"""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'last_update'").fetchone()
+        return row[0] if row and row[0] else None
+    
+    def _filter(
+        self,
+        text: Optional[str],
+        intervention: Optional[str],
+        condition: Optional[str],
+        phase: Optional[str]
+    ):
+        clauses, params = [], []
+        terms = [
+            expression for expression in (
+                _match_expression(text),
+                _match_expression(intervention, "interventions"),
+                _match_expression(condition, "conditions"),
+            ) if expression
+        ]
+        if terms:
+            clauses.append("s.id IN (SELECT rowid FROM studies_fts WHERE studies_fts MATCH ?)")
+            params.append(" AND ".join(terms))
+        if phase:
+            clauses.append("s.id IN (SELECT study_id FROM study_phases WHERE phase = ?)")
+            phases = _phases([phase])
+            params.append(phases[0] if phases else phase)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+    
+    def resolve_query(self, text: str) -> Dict[str, Optional[str]]:
+        """Intervention and condition named in free text, as whole indexed phrases
+        
+        Stopwords and question words are dropped and abbreviations expanded,
+        so PAH reads as pulmonary hypertension. An intervention or condition
+        phrase counts only when all its content words are in the query, doses
+        and salts aside, and of nested matches the most specific one is kept:
+        "oral sildenafil failures in PAH" filters on sildenafil and pulmonary
+        hypertension, never on "oral" or "failures".
+        """
+        words = query_words(text or "")
+        terms = {stem(word) for word in words}
+        seeds = [
+            word for word in dict.fromkeys(words)
+            if word not in GENERIC_TERMS and stem(word) not in GENERIC_TERMS and stem(word) not in PHRASE_QUALIFIERS
+        ]
+        matched: Dict[str, Dict[FrozenSet[str], List[str]]] = {"interventions": {}, "conditions": {}}
+        with self._lock:
+            for word in seeds:
+                rows = self._conn.execute(
+                    "SELECT interventions, conditions FROM studies_fts WHERE studies_fts MATCH ? LIMIT 1000",
+                    (f'{{interventions conditions}} : "{word}"',)
+                ).fetchall()
+                for row in rows:
+                    for column, value in zip(matched, row):
+                        for phrase in (value or "").split(" | "):
+                            core, phrase_words = phrase_core(phrase)
+                            if core and core <= terms and core - GENERIC_TERMS:
+                                matched[column].setdefault(core, phrase_words)
+        resolved = {}
+        for column, phrases in matched.items():
+            kept = [core for core in phrases if not any(core < other for other in phrases)]
+            resolved[column] = " ".join(dict.fromkeys(
+                word for core in sorted(kept, key=sorted) for word in phrases[core]
+            )) or None
+        return {"intervention": resolved["interventions"], "condition": resolved["conditions"]}
+    
+    def failure_stats(
+        self,
+        text: Optional[str] = None,
+        intervention: Optional[str] = None,
+        condition: Optional[str] = None,
+        phase: Optional[str] = None,
+        group_by: str = "phase"
+    ) -> Dict[str, Any]:
+        """Failure rate among finished matching trials, overall and per ``group_by`` value"""
+        return trial_failure_summary(trial_frame(self.select(text, intervention, condition, phase)), group_by)
+    
+    def termination_reasons(
+        self,
+        text: Optional[str] = None,
+        intervention: Optional[str] = None,
+        condition: Optional[str] = None,
+        phase: Optional[str] = None,
+        limit: int = 5
+    ) -> List[Dict[str, Any]]:
+        """Most common reasons failed matching trials stopped, with their share of failures"""
+        frame = trial_frame(self.select(text, intervention, condition, phase))
+        return trial_failure_summary(frame, limit=limit)["termination_reasons"]
+    
+    def select(
+        self,
+        text: Optional[str] = None,
+        intervention: Optional[str] = None,
+        condition: Optional[str] = None,
+        phase: Optional[str] = None
+    ) -> List[tuple]:
+        """Matching studies as ``STUDY_COLUMNS`` tuples, phases joined with ``|``"""
+        where, params = self._filter(text, intervention, condition, phase)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT s.nct_id, s.status, s.why_stopped, s.enrollment, s.start_date, "
+                "(SELECT group_concat(p.phase, '|') FROM study_phases p WHERE p.study_id = s.id) "
+                f"FROM studies s{where}",
+                params
+            ).fetchall()
+    
+    def search(self, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Best-matching studies for free text"""
+        expression = _match_expression(text)
+        if expression is None:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.nct_id, s.status, f.title, f.interventions, f.conditions "
+                "FROM studies_fts f JOIN studies s ON s.id = f.rowid "
+                "WHERE studies_fts MATCH ? ORDER BY bm25(studies_fts) LIMIT ?",
+                (expression, limit)
+            ).fetchall()
+        return [
+            {"nct_id": nct_id, "status": status, "title": title, "interventions": interventions, "conditions": conditions}
+            for nct_id, status, title, interventions, conditions in rows
+        ]
+    
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM studies").fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+async def fetch_updates(http, since: Optional[str], page_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+    """Records updated on or after ``since`` from the live API, page by page"""
+    params: Dict[str, Any] = {"pageSize": page_size, "sort": "LastUpdatePostDate"}
+    if since:
+        params["filter.advanced"] = f"AREA[LastUpdatePostDate]RANGE[{since},MAX]"
+    client = http.get("clinical_trials")
+    while True:
+        data = await client.get_json("/studies", params=params)
+        for document in data.get("studies", []):
+            record = study_from_json(document)
+            if record:
+                yield record
+        token = data.get("nextPageToken")
+        if not token:
+            return
+        params["pageToken"] = token
+
+async def refresh(index: TrialsIndex, http, since: Optional[str] = None, batch_size: int = 1000) -> Dict[str, int]:
+    """Pull studies changed since the last ingest into the index"""
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    batch: List[Dict[str, Any]] = []
+    
+    async def flush():
+        for key, value in (await asyncio.to_thread(index.ingest, batch)).items():
+            counts[key] += value
+        batch.clear()
+    
+    async for record in fetch_updates(http, since or index.last_update()):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+    return counts
+
+_index: Optional[TrialsIndex] = None
+
+def get_trials_index() -> Optional[TrialsIndex]:
+    """Process-wide index, or None when no local registry data is available"""
+    return _index
+
+def configure_trials_index(index: Optional[TrialsIndex]):
+    global _index
+    _index = index
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the local ClinicalTrials.gov index")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="index file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="load bulk export files, zips or directories")
+    ingest.add_argument("paths", nargs="+")
+    delta = commands.add_parser("refresh", help="fetch studies updated since the last ingest")
+    delta.add_argument("--since", help="ISO date; defaults to the index watermark")
+    args = parser.parse_args(argv)
+    
+    index = TrialsIndex(args.db)
+    started = time.perf_counter()
+    if args.command == "ingest":
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        for path in args.paths:
+            for key, value in index.ingest_path(path).items():
+                counts[key] += value
+    else:
+        from src.tools.http_client import get_http_pool
+        
+        counts = asyncio.run(refresh(index, get_http_pool(), args.since))
+    print(json.dumps({
+        **counts,
+        "studies": len(index),
+        "last_update": index.last_update(),
+        "seconds": round(time.perf_counter() - started, 2)
+    }))
+    index.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
+''')
+
+    create_file("src/indexes/market.py", '''"""Local Market Data"""
+import os
+import threading
+from typing import Any, Optional
+
+# One row per indication, region and year; rates are fractions of the row above
+MARKET_COLUMNS = ("indication", "region", "year", "prevalence", "diagnosed_rate", "treated_rate", "annual_cost_usd")
+
+class MarketData:
+    """Epidemiology and pricing table read from a CSV file
+    
+    The file is parsed on first use and again whenever it changes on disk,
+    so pandas is only imported by processes that size a market.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._frame = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def frame(self) -> Any:
+        """The table as a DataFrame with an added lower-case ``key`` column"""
+        mtime = os.path.getmtime(self.path)
+        with self._lock:
+            if self._frame is None or mtime != self._mtime:
+                self._frame = self._read()
+                self._mtime = mtime
+            return self._frame
+    
+    def _read(self):
+        import pandas as pd
+        
+        frame = pd.read_csv(self.path)
+        missing = [column for column in MARKET_COLUMNS if column not in frame.columns]
+        if missing:
+            raise ValueError(f"{self.path} is missing columns: {', '.join(missing)}")
+        frame = frame[list(MARKET_COLUMNS)].dropna(subset=["indication", "region", "year"])
+        frame = frame.astype({
+            "year": "int64",
+            "prevalence": "float64",
+            "diagnosed_rate": "float64",
+            "treated_rate": "float64",
+            "annual_cost_usd": "float64",
+        })
+        frame["key"] = frame["indication"].str.strip().str.lower()
+        return frame
+
+_market: Optional[MarketData] = None
+
+def get_market_data() -> Optional[MarketData]:
+    """Process-wide market table, or None when no file is configured"""
+    return _market
+
+def configure_market_data(market: Optional[MarketData]):
+    """Replace the process-wide market table, typically once at startup"""
+    global _market
+    _market = market
+''')
+
+    create_file("src/indexes/patents.py", '''"""Local Patent Landscape Index
+
+Builds a read-only, memory-mapped index from USPTO bulk data so expiry
+windows and freedom-to-operate questions are answered from disk in well
+under a millisecond instead of by a remote search per query.
+
+    python -m src.indexes.patents build ipg240102.zip ipg240109.zip
+
+Every array is a ``.npy`` file opened with ``mmap_mode="r"``, so all worker
+processes on a host share one copy of the index in the page cache:
+
+- ``expiry.npy`` / ``start.npy``: each patent's term as a date interval
+- ``by_expiry.npy``: patent ids ordered by expiry, with ``expiry_sorted.npy``
+  as the searchable key column (the interval index)
+- ``terms.npy`` + ``term_offsets.npy`` + ``postings.npy``: sorted
+  fixed-width claim terms and their patent ids (the inverted index); CPC
+  codes use the same layout under ``cpc_*``
+- ``docs.jsonl`` + ``doc_offsets.npy``: per-patent metadata
+"""
+import argparse
+import datetime
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from src.utils.lazy import lazy_import
+from src.utils.query_terms import CONDITION_WORDS, GENERIC_TERMS, PHRASE_QUALIFIERS, query_words, stem
+
+np = lazy_import("numpy")
+
+DEFAULT_PATH = "data/patents"
+LAYOUT_VERSION = 1
+
+# US utility patents run 20 years from filing, plus any term adjustment
+TERM_YEARS = 20
+
+TERM_WIDTH = 24
+CPC_WIDTH = 16
+
+_WORDS = re.compile(r"[a-z][a-z0-9]+")
+
+# Claim boilerplate and question words that never narrow a search
+STOPWORDS = frozenset(
+    "about according also and any are being between but can claim claimed claims comprises comprising "
+    "consisting did does each effective fail failed for from has have how into its least method more "
+    "not one said selected such than that the their thereof this use used using was what when wherein "
+    "which while why with".split()
+)
+
+def claim_terms(text: str) -> List[str]:
+    """Distinct index terms of claims or query text, in order of appearance"""
+    words = _WORDS.findall((text or "").lower())
+    return list(dict.fromkeys(
+        word for word in words if word not in STOPWORDS and len(word) <= TERM_WIDTH
+    ))
+
+def query_subject(query: str) -> Optional[str]:
+    """The drug a free-text query asks about, as an index term
+    
+    Taken as the first word that is not a question word, a route or
+    formulation, or part of a known condition: "oral ketamine for PAH" is
+    about ketamine.
+    """
+    for word in query_words(query or ""):
+        if word in CONDITION_WORDS or word in GENERIC_TERMS or stem(word) in GENERIC_TERMS or stem(word) in PHRASE_QUALIFIERS:
+            continue
+        terms = claim_terms(word)
+        if terms:
+            return terms[0]
+    return None
+
+def normalise_cpc(code: str) -> str:
+    """``"A61K 31/519"`` as ``"A61K31/519"``"""
+    return re.sub(r"\\s+", "", (code or "").upper())
+
+def _date(value: Optional[str]) -> Optional[datetime.date]:
+    value = (value or "").strip()
+    for fmt in ("%Y%m%d", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def expiry_date(filing: Optional[datetime.date], term_adjustment_days: int = 0) -> Optional[datetime.date]:
+    """Nominal expiry; terminal disclaimers and lapsed maintenance fees are not modelled"""
+    if filing is None:
+        return None
+    try:
+        end = filing.replace(year=filing.year + TERM_YEARS)
+    except ValueError:
+        end = filing.replace(year=filing.year + TERM_YEARS, day=28)
+    return end + datetime.timedelta(days=term_adjustment_days)
+
+def patent_from_json(document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Index record from one JSON-lines document"""
+    number = document.get("patent_number")
+    if not number:
+        return None
+    claims = document.get("claims") or ""
+    if isinstance(claims, list):
+        claims = "\\n".join(claims)
+    filing = _date(document.get("filing_date"))
+    expiry = _date(document.get("expiry_date")) or expiry_date(filing, int(document.get("term_adjustment_days") or 0))
+    return {
+        "patent_number": str(number),
+        "title": document.get("title") or "",
+        "assignee": document.get("assignee"),
+        "grant_date": _date(document.get("grant_date")),
+        "filing_date": filing,
+        "expiry_date": expiry,
+        "cpc": [normalise_cpc(code) for code in document.get("cpc") or []],
+        "claims": claims,
+    }
+
+def _cpc_code(element: ET.Element) -> str:
+    parts = [element.findtext(tag) or "" for tag in ("section", "class", "subclass", "main-group")]
+    return "".join(parts) + "/" + (element.findtext("subgroup") or "")
+
+def patent_from_xml(root: ET.Element) -> Optional[Dict[str, Any]]:
+    """Index record from a ``<us-patent-grant>`` full-text document"""
+    biblio = root.find("us-bibliographic-data-grant")
+    if biblio is None:
+        return None
+    number = biblio.findtext("publication-reference/document-id/doc-number")
+    if not number:
+        return None
+    filing = _date(biblio.findtext("application-reference/document-id/date"))
+    adjustment = biblio.findtext("us-term-of-grant/us-term-extension") or "0"
+    assignee = biblio.find(".//assignees/assignee")
+    title = biblio.find("invention-title")
+    cpc = [
+        _cpc_code(element)
+        for element in biblio.findall("classifications-cpc/main-cpc/classification-cpc")
+        + biblio.findall("classifications-cpc/further-cpc/classification-cpc")
+    ]
+    return {
+        "patent_number": number.lstrip("0") or number,
+        "title": "".join(title.itertext()) if title is not None else "",
+        "assignee": assignee.findtext(".//orgname") if assignee is not None else None,
+        "grant_date": _date(biblio.findtext("publication-reference/document-id/date")),
+        "filing_date": filing,
+        "expiry_date": expiry_date(filing, int(adjustment) if adjustment.isdigit() else 0),
+        "cpc": cpc,
+        "claims": "\\n".join(" ".join("".join(claim.itertext()).split()) for claim in root.iter("claim")),
+    }
+
+def _grants_in(stream) -> Iterator[Dict[str, Any]]:
+    """Records in a weekly grant file: concatenated XML documents, one per patent"""
+    lines: List[bytes] = []
+    for line in stream:
+        if line.startswith(b"<?xml") and lines:
+            yield from _parse_grant(b"".join(lines))
+            lines = []
+        lines.append(line)
+    if lines:
+        yield from _parse_grant(b"".join(lines))
+
+def _parse_grant(document: bytes) -> Iterator[Dict[str, Any]]:
+    # The DOCTYPE names an external DTD expat cannot load; nothing in it is needed
+    document = re.sub(rb"<!DOCTYPE[^>]*>", b"", document, count=1)
+    try:
+        root = ET.fromstring(document)
+    except ET.ParseError:
+        return
+    record = patent_from_xml(root) if root.tag == "us-patent-grant" else None
+    if record:
+        yield record
+
+def _patents_in(name: str, stream) -> Iterator[Dict[str, Any]]:
+    if name.endswith(".xml"):
+        yield from _grants_in(stream)
+        return
+    for line in stream:
+        if line.strip():
+            record = patent_from_json(json.loads(line))
+            if record:
+                yield record
+
+def iter_patents(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream records from weekly grant XML files, JSON lines, zips or a directory"""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                yield from iter_patents(os.path.join(root, name))
+    elif path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith((".xml", ".jsonl", ".ndjson")):
+                    with archive.open(name) as stream:
+                        yield from _patents_in(name, stream)
+    elif path.endswith((".xml", ".jsonl", ".ndjson")):
+        with open(path, "rb") as stream:
+            yield from _patents_in(path, stream)
+
+def _save_postings(directory: str, prefix: str, postings: Dict[str, List[int]], width: int):
+    keys = sorted(postings)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[key]) for key in keys])
+    flat = np.fromiter(
+        (doc_id for key in keys for doc_id in postings[key]), dtype=np.int32, count=int(offsets[-1])
+    )
+    np.save(os.path.join(directory, f"{prefix}terms.npy"), np.array(keys, dtype=f"S{width}"))
+    np.save(os.path.join(directory, f"{prefix}term_offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{prefix}postings.npy"), flat)
+
+def build_index(records: Iterable[Dict[str, Any]], path: str = DEFAULT_PATH) -> Dict[str, int]:
+    """Write a fresh index directory, replacing any previous one atomically
+    
+    Later records for the same patent number replace earlier ones. The build
+    holds the postings in memory; the serving side never does.
+    """
+    by_number: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        if record.get("expiry_date") is not None:
+            by_number[record["patent_number"]] = record
+    
+    staging = path.rstrip("/") + ".building"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    
+    terms: Dict[str, List[int]] = {}
+    cpc: Dict[str, List[int]] = {}
+    starts, expiries, offsets = [], [], [0]
+    with open(os.path.join(staging, "docs.jsonl"), "wb") as docs:
+        for doc_id, record in enumerate(by_number.values()):
+            for term in claim_terms(record["title"] + "\\n" + record["claims"]):
+                terms.setdefault(term, []).append(doc_id)
+            for code in dict.fromkeys(code for code in record["cpc"] if len(code) <= CPC_WIDTH):
+                cpc.setdefault(code, []).append(doc_id)
+            expiries.append(record["expiry_date"])
+            starts.append(record["grant_date"] or record["filing_date"] or record["expiry_date"])
+            line = json.dumps({
+                "patent_number": record["patent_number"],
+                "title": record["title"],
+                "assignee": record["assignee"],
+                "grant_date": record["grant_date"].isoformat() if record["grant_date"] else None,
+                "expiry_date": record["expiry_date"].isoformat(),
+                "cpc": record["cpc"],
+                "first_claim": record["claims"].split("\\n", 1)[0][:500],
+            }).encode("utf-8") + b"\\n"
+            docs.write(line)
+            offsets.append(offsets[-1] + len(line))
+    
+    expiry = np.array(expiries, dtype="datetime64[D]")
+    order = np.argsort(expiry, kind="stable").astype(np.int32)
+    np.save(os.path.join(staging, "expiry.npy"), expiry)
+    np.save(os.path.join(staging, "start.npy"), np.array(starts, dtype="datetime64[D]"))
+    np.save(os.path.join(staging, "by_expiry.npy"), order)
+    np.save(os.path.join(staging, "expiry_sorted.npy"), expiry[order])
+    np.save(os.path.join(staging, "doc_offsets.npy"), np.array(offsets, dtype=np.int64))
+    _save_postings(staging, "", terms, TERM_WIDTH)
+    _save_postings(staging, "cpc_", cpc, CPC_WIDTH)
+    with open(os.path.join(staging, "meta.json"), "w") as meta:
+        json.dump({"version": LAYOUT_VERSION, "patents": len(by_number), "built": time.time()}, meta)
+    
+    previous = path.rstrip("/") + ".previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, previous)
+    os.rename(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+    return {"patents": len(by_number), "terms": len(terms), "cpc_codes": len(cpc)}
+
+def _as_date(value: Any) -> "np.datetime64":
+    return np.datetime64(value or datetime.date.today(), "D")
+
+class PatentIndex:
+    """Read-only view of an index directory written by ``build_index``
+    
+    Opening maps the files rather than reading them, so it is cheap in every
+    worker and the pages are shared between processes. Lookups are binary
+    searches over the sorted term and expiry columns.
+    """
+    
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta:
+            self.meta = json.load(meta)
+        if self.meta.get("version") != LAYOUT_VERSION:
+            raise ValueError(f"{path} has index layout {self.meta.get('version')}, expected {LAYOUT_VERSION}")
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self._expiry = load("expiry.npy")
+        self._start = load("start.npy")
+        self._by_expiry = load("by_expiry.npy")
+        self._expiry_sorted = load("expiry_sorted.npy")
+        self._doc_offsets = load("doc_offsets.npy")
+        self._terms = (load("terms.npy"), load("term_offsets.npy"), load("postings.npy"))
+        self._cpc = (load("cpc_terms.npy"), load("cpc_term_offsets.npy"), load("cpc_postings.npy"))
+        self._docs_file = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs = mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ) if self._doc_offsets[-1] else b""
+    
+    def __len__(self) -> int:
+        return len(self._expiry)
+    
+    @staticmethod
+    def _range(table, low: bytes, high: bytes) -> "np.ndarray":
+        keys, offsets, postings = table
+        if not len(keys):
+            return np.empty(0, dtype=np.int32)
+        first = int(np.searchsorted(keys, low, side="left"))
+        last = int(np.searchsorted(keys, high, side="right"))
+        if first >= last:
+            return np.empty(0, dtype=np.int32)
+        if last - first == 1:
+            return postings[offsets[first]:offsets[last]]
+        return np.unique(postings[offsets[first]:offsets[last]])
+    
+    def term_postings(self, term: str) -> "np.ndarray":
+        """Sorted ids of patents whose title or claims contain ``term``"""
+        key = term.lower().encode("utf-8")
+        return self._range(self._terms, key, key)
+    
+    def cpc_postings(self, code: str) -> "np.ndarray":
+        """Sorted ids of patents classified under ``code`` or any code below it"""
+        key = normalise_cpc(code).encode("ascii")
+        return self._range(self._cpc, key, key + b"\\xff")
+    
+    def match(
+        self,
+        query: Optional[str] = None,
+        cpc: Optional[str] = None,
+        intervention: Optional[str] = None
+    ) -> "Optional[np.ndarray]":
+        """Patents matching ``query`` and ``cpc``; None when neither narrows anything
+        
+        Every term of ``intervention``, by default the ``query_subject``,
+        must match, so a drug no patent mentions matches nothing. The other
+        query terms are intersected rarest first; one that is not indexed, or
+        that would leave nothing, is skipped, so question words and a disease
+        no matching claim mentions do not empty the result.
+        """
+        matched = None
+        if query or intervention:
+            subject = claim_terms(intervention) if intervention else [query_subject(query)]
+            matched = np.empty(0, dtype=np.int32)
+            if not all(subject):
+                return matched
+            for position, term in enumerate(subject):
+                ids = self.term_postings(term)
+                matched = ids if not position else np.intersect1d(matched, ids, assume_unique=True)
+            if not len(matched):
+                return matched
+            others = [term for term in claim_terms(query or "") if term not in subject]
+            for ids in sorted((self.term_postings(term) for term in others), key=len):
+                narrowed = np.intersect1d(matched, ids, assume_unique=True)
+                if len(narrowed):
+                    matched = narrowed
+        if cpc:
+            codes = self.cpc_postings(cpc)
+            matched = codes if matched is None else np.intersect1d(matched, codes, assume_unique=True)
+        return matched
+    
+    def _window(self, low: int, high: int, matched: "Optional[np.ndarray]") -> "np.ndarray":
+        """Matching ids at positions ``low:high`` of the expiry order, soonest first
+        
+        Walks whichever side is smaller: the expiry slice, or the term matches
+        filtered by their own expiry dates.
+        """
+        if matched is None:
+            return np.asarray(self._by_expiry[low:high])
+        if high - low <= len(matched):
+            ids = self._by_expiry[low:high]
+            return ids[np.isin(ids, matched, assume_unique=True)]
+        if low >= high:
+            return np.empty(0, dtype=np.int32)
+        expiry = self._expiry[matched]
+        inside = (expiry >= self._expiry_sorted[low]) & (expiry <= self._expiry_sorted[high - 1])
+        ids = matched[inside]
+        return ids[np.argsort(expiry[inside], kind="stable")]
+    
+    def expiring(
+        self,
+        start: Any,
+        end: Any,
+        query: Optional[str] = None,
+        cpc: Optional[str] = None,
+        intervention: Optional[str] = None
+    ) -> "np.ndarray":
+        """Ids of matching patents expiring between ``start`` and ``end`` inclusive, soonest first"""
+        low = int(np.searchsorted(self._expiry_sorted, _as_date(start), side="left"))
+        high = int(np.searchsorted(self._expiry_sorted, _as_date(end), side="right"))
+        return self._window(low, high, self.match(query, cpc, intervention))
+    
+    def in_force(
+        self,
+        on: Any = None,
+        query: Optional[str] = None,
+        cpc: Optional[str] = None,
+        intervention: Optional[str] = None
+    ) -> "np.ndarray":
+        """Ids of matching patents granted by ``on`` and not yet expired, soonest expiry first"""
+        day = _as_date(on)
+        low = int(np.searchsorted(self._expiry_sorted, day, side="right"))
+        ids = self._window(low, len(self._expiry_sorted), self.match(query, cpc, intervention))
+        return ids[self._start[ids] <= day]
+    
+    def get(self, doc_id: int) -> Dict[str, Any]:
+        start, end = int(self._doc_offsets[doc_id]), int(self._doc_offsets[doc_id + 1])
+        return json.loads(self._docs[start:end])
+    
+    def freedom_to_operate(
+        self,
+        query: Optional[str] = None,
+        cpc: Optional[str] = None,
+        on: Any = None,
+        limit: int = 10,
+        intervention: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """In-force patents that could block ``query`` and the date the last one lapses"""
+        day = _as_date(on)
+        blocking = self.in_force(day, query, cpc, intervention)
+        expiries = self._expiry[blocking]
+        by_year: Dict[str, int] = {}
+        if len(blocking):
+            years, counts = np.unique(expiries.astype("datetime64[Y]").astype(int) + 1970, return_counts=True)
+            by_year = {str(year): int(count) for year, count in zip(years, counts)}
+        return {
+            "date": str(day),
+            "blocking": int(len(blocking)),
+            "earliest_expiry": str(expiries[0]) if len(blocking) else None,
+            "clear_from": str(expiries[-1] + np.timedelta64(1, "D")) if len(blocking) else str(day),
+            "expiring_by_year": by_year,
+            "patents": [self.get(int(doc_id)) for doc_id in blocking[:limit]],
+        }
+    
+    def close(self):
+        if isinstance(self._docs, mmap.mmap):
+            self._docs.close()
+        self._docs_file.close()
+
+_index: Optional[PatentIndex] = None
+
+def get_patent_index() -> Optional[PatentIndex]:
+    """Process-wide index, or None when no local patent data is available"""
+    return _index
+
+def configure_patent_index(index: Optional[PatentIndex]):
+    global _index
+    _index = index
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the local patent landscape index")
+    parser.add_argument("--dir", default=DEFAULT_PATH, help="index directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index weekly grant files, JSON lines, zips or directories")
+    build.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+    
+    started = time.perf_counter()
+    records = (record for path in args.paths for record in iter_patents(path))
+    counts = build_index(records, args.dir)
+    print(json.dumps({**counts, "seconds": round(time.perf_counter() - started, 2)}))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
+''')
+    
+    # ========================================================================
+    # JOBS
+    # ========================================================================
+    
+    create_file("src/jobs/__init__.py", "")
+
+    create_file("src/jobs/manager.py", '''"""Background Analysis Jobs"""
+import asyncio
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from src.graph.checkpoints import CheckpointStore, ReplayJournal, replay_journal
+from src.jobs.dispatch import WorkQueue, new_worker_id
+from src.jobs.ids import new_analysis_id, new_ulid
+from src.jobs.queue import DEFAULT_GROUP, FairQueue
+from src.jobs.semantic_cache import BYPASS_OPTION, SemanticCache
+from src.jobs.store import JobStore, InMemoryJobStore
+from src.jobs.events import END, current_analysis_id, get_event_broker
+from src.utils.logger import get_logger
+from src.utils.metrics import ANALYSIS_LATENCY, JOBS_FINISHED, JOBS_REJECTED, record_cache_lookup, update_job_gauges
+from src.tools.mcp_server import shared_tool_results
+
+logger = get_logger("jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+RESULT_KEYS = ("hypothesis", "confidence_score", "innovation_report", "agent_status")
+RESUMABLE_STATUSES = (INTERRUPTED, RUNNING, QUEUED)
+
+class QueueFullError(Exception):
+    """Admission queue is saturated; the client should retry later"""
+
+class ManagerUnavailableError(Exception):
+    """Job manager is not accepting work (not started or shutting down)"""
+
+def dedupe_key(query: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """Canonical form used to detect identical queries in a batch"""
+    normalised = " ".join(query.lower().split())
+    return normalised + "|" + json.dumps(options or {}, sort_keys=True, default=str)
+
+@dataclass
+class Job:
+    """One analysis run and its private state store"""
+    analysis_id: str
+    query: str
+    options: Dict[str, Any] = field(default_factory=dict)
+    status: str = QUEUED
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    state: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    batch_id: Optional[str] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    tool_results: Optional[Dict[str, Any]] = field(default=None, repr=False)
+    cached: Optional[Dict[str, Any]] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES or self.status == INTERRUPTED
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Public view of the job, also the persisted record"""
+        result = {
+            "analysis_id": self.analysis_id,
+            "query": self.query,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+        if self.options:
+            result["options"] = self.options
+        if self.batch_id:
+            result["batch_id"] = self.batch_id
+        if self.state.get("agent_status"):
+            result["agent_status"] = self.state["agent_status"]
+        if self.status == COMPLETED:
+            result["hypothesis"] = self.state.get("hypothesis")
+            result["confidence_score"] = self.state.get("confidence_score")
+            result["innovation_report"] = self.state.get("innovation_report")
+        if self.cached:
+            result["cached"] = self.cached
+        if self.error:
+            result["error"] = self.error
+        return result
+
+class JobManager:
+    """Runs the compiled graph on a bounded pool of async workers
+    
+    Admission goes through a bounded queue: when it is full ``submit`` raises
+    ``QueueFullError`` instead of buffering without limit. The queue is fair
+    across batches, so portfolio runs share workers with interactive
+    requests. Only queued and running jobs live in memory here; every status
+    transition is written to the job store, which owns retention and history.
+    
+    With a checkpoint store, every node's update is journaled as it
+    completes. Jobs cut short by shutdown are marked ``interrupted``, and
+    ``start`` re-admits unfinished jobs, which replay their journal and run
+    only the nodes that had not completed.
+    
+    With a semantic cache, a query close enough to a completed analysis is
+    answered from it at submission, marked ``cached``, without running the
+    graph. Requests can opt out with ``{"cache": false}`` in their options.
+    
+    With a ``dispatcher`` the work crosses processes. With ``execute`` off
+    (API processes) admitted jobs go onto the work queue and progress events
+    are relayed back from it; with ``execute`` on (graph worker processes)
+    the workers claim jobs from the queue instead of from local submissions.
+    """
+    
+    def __init__(
+        self,
+        graph_factory: Callable[[], Any],
+        max_workers: int = 4,
+        max_queue: int = 100,
+        job_timeout: float = 600.0,
+        store: Optional[JobStore] = None,
+        checkpoints: Optional[CheckpointStore] = None,
+        resume_on_start: bool = True,
+        semantic_cache: Optional[SemanticCache] = None,
+        dispatcher: Optional[WorkQueue] = None,
+        execute: bool = True
+    ):
+        self.graph_factory = graph_factory
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.store = store or InMemoryJobStore()
+        self.checkpoints = checkpoints
+        self.resume_on_start = resume_on_start
+        self.semantic_cache = semantic_cache
+        self.dispatcher = dispatcher
+        self.execute = execute
+        self.worker_id = new_worker_id()
+        self.graph = None
+        self._graph_lock = asyncio.Lock()
+        self.active: Dict[str, Job] = {}
+        self._queue: Optional[FairQueue] = None
+        self._workers = []
+        self._background = []
+        self._accepting = False
+        self._capacity = asyncio.Event()
+        self._batch_scopes: Dict[str, Dict[str, Any]] = {}
+        self._ended: deque = deque(maxlen=4096)
+        self._dispatched_depth = 0
+    
+    @property
+    def accepting(self) -> bool:
+        """Started and not shutting down"""
+        return self._accepting
+    
+    @property
+    def dispatching(self) -> bool:
+        """Admits work for other processes rather than running it"""
+        return self.dispatcher is not None and not self.execute
+    
+    @property
+    def queue_depth(self) -> int:
+        if self.dispatching:
+            return self._dispatched_depth
+        return self._queue.qsize() if self._queue else 0
+    
+    @property
+    def running(self) -> int:
+        return sum(1 for job in self.active.values() if job.status == RUNNING)
+    
+    async def refresh_queue_depth(self) -> int:
+        """Queue depth, read from the work queue in dispatch mode rather than from the last admission"""
+        if self.dispatching:
+            try:
+                self._dispatched_depth = await self.dispatcher.depth()
+            except Exception:
+                logger.warning("Reading the work queue depth failed", exc_info=True)
+        return self.queue_depth
+    
+    async def start(self):
+        """Start the workers; the graph is compiled by ``load_graph`` on warm-up or the first job"""
+        if self.dispatching:
+            self._background = [asyncio.create_task(self._relay(), name="analysis-event-relay")]
+            self._accepting = True
+            return
+        
+        self._queue = FairQueue(self.max_queue)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"analysis-worker-{i}")
+            for i in range(self.max_workers)
+        ]
+        self._accepting = True
+        if self.dispatcher is not None:
+            # Unfinished work stays on the queue; lapsed leases replace recovery
+            self._background = [
+                asyncio.create_task(self._claim(), name="analysis-claimer"),
+                asyncio.create_task(self._keep_leases(), name="analysis-leases")
+            ]
+        elif self.checkpoints is not None and self.resume_on_start:
+            await self._recover()
+    
+    async def load_graph(self):
+        """Compile the graph in a thread on first call and reuse it after"""
+        if self.graph is None:
+            async with self._graph_lock:
+                if self.graph is None:
+                    self.graph = await asyncio.to_thread(self.graph_factory)
+        return self.graph
+    
+    async def _recover(self):
+        """Re-admit jobs an earlier process left unfinished"""
+        records = []
+        for status in RESUMABLE_STATUSES:
+            records.extend(await self.store.list(status=status, limit=self.max_queue))
+        records.sort(key=lambda record: record["analysis_id"])
+        
+        admitted = records[:self._queue.free()]
+        groups: Dict[str, List[Job]] = {}
+        for record in admitted:
+            job = Job(
+                analysis_id=record["analysis_id"],
+                query=record["query"],
+                options=record.get("options") or {},
+                created_at=record["created_at"],
+                batch_id=record.get("batch_id")
+            )
+            groups.setdefault(job.batch_id or DEFAULT_GROUP, []).append(job)
+        
+        for group, jobs in groups.items():
+            await self._admit(jobs, group)
+        if admitted:
+            logger.info("Resuming %d unfinished analyses", len(admitted))
+    
+    def _cancel_status(self) -> str:
+        # Shutdown leaves checkpointed or queued-elsewhere jobs resumable; a client cancel is final
+        resumable = self.checkpoints is not None or self.dispatcher is not None
+        return INTERRUPTED if resumable and not self._accepting else CANCELLED
+    
+    async def stop(self):
+        """Stop accepting work and cancel everything in flight"""
+        self._accepting = False
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+        for analysis_id in list(self.active):
+            await self._cancel_local(analysis_id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in list(self.active.values()):
+            await self._finish(job, self._cancel_status())
+    
+    async def submit(self, query: str, options: Optional[Dict[str, Any]] = None) -> Job:
+        """Admit a new analysis or raise if saturated"""
+        job = Job(analysis_id=new_analysis_id(), query=query, options=dict(options or {}))
+        if not await self._serve_cached(job):
+            await self._admit([job], DEFAULT_GROUP)
+        return job
+    
+    async def submit_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Admit a batch as one unit and return its aggregate record
+        
+        Identical queries run once. Every job in the batch shares one tool
+        result scope, so items about the same drug or indication reuse each
+        other's upstream fetches.
+        """
+        batch_id = f"batch_{new_ulid()}"
+        tool_results: Dict[str, Any] = {}
+        jobs: Dict[str, Job] = {}
+        entries = []
+        
+        for index, item in enumerate(items):
+            key = dedupe_key(item["query"], item.get("options"))
+            job = jobs.get(key)
+            entry = {"index": index, "query": item["query"]}
+            if job is None:
+                job = Job(
+                    analysis_id=new_analysis_id(),
+                    query=item["query"],
+                    options=dict(item.get("options") or {}),
+                    batch_id=batch_id,
+                    tool_results=tool_results
+                )
+                jobs[key] = job
+            else:
+                entry["duplicate"] = True
+            entry["analysis_id"] = job.analysis_id
+            entries.append(entry)
+        
+        pending = [job for job in jobs.values() if not await self._serve_cached(job)]
+        if pending:
+            await self._admit(pending, batch_id)
+        
+        batch = {
+            "batch_id": batch_id,
+            "created_at": datetime.now().isoformat(),
+            "unique_items": len(jobs),
+            "items": entries
+        }
+        await self.store.save_batch(batch)
+        return batch
+    
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Batch record with per-item status and an overall status"""
+        batch = await self.store.get_batch(batch_id)
+        if batch is None:
+            return None
+        
+        records = {}
+        for entry in batch["items"]:
+            if entry["analysis_id"] not in records:
+                records[entry["analysis_id"]] = await self.get(entry["analysis_id"]) or {}
+        
+        counts: Dict[str, int] = {}
+        for record in records.values():
+            counts[record.get("status", "unknown")] = counts.get(record.get("status", "unknown"), 0) + 1
+        
+        items = []
+        for entry in batch["items"]:
+            record = records[entry["analysis_id"]]
+            item = {**entry, "status": record.get("status")}
+            for key in ("hypothesis", "confidence_score", "error"):
+                if record.get(key) is not None:
+                    item[key] = record[key]
+            items.append(item)
+        
+        finished = all(record.get("status") in FINISHED_STATUSES for record in records.values())
+        return {
+            **batch,
+            "status": COMPLETED if finished else RUNNING,
+            "counts": counts,
+            "items": items
+        }
+    
+    async def _serve_cached(self, job: Job) -> bool:
+        """Complete ``job`` from a similar finished analysis, if there is one"""
+        if self.semantic_cache is None or job.options.get(BYPASS_OPTION) is False:
+            return False
+        if not self._accepting:
+            return False
+        hit = self.semantic_cache.lookup(job.query, job.options)
+        record_cache_lookup("semantic", hit is not None)
+        if hit is None:
+            return False
+        
+        job.state = dict(hit["result"])
+        job.cached = {"analysis_id": hit["analysis_id"], "query": hit["query"], "similarity": hit["similarity"]}
+        job.status = COMPLETED
+        job.started_at = job.finished_at = datetime.now().isoformat()
+        await self.store.save(job.to_dict())
+        return True
+    
+    async def _remember(self, record: Dict[str, Any]):
+        # Partial reports are not worth serving to anyone else
+        report = record.get("innovation_report") or {}
+        if record.get("cached") or report.get("incomplete_agents"):
+            return
+        result = {key: record[key] for key in RESULT_KEYS if record.get(key) is not None}
+        await self.semantic_cache.share(record["query"], record.get("options"), record["analysis_id"], result)
+    
+    async def _admit(self, jobs: List[Job], group: str):
+        if not self._accepting:
+            JOBS_REJECTED.labels("unavailable").inc()
+            raise ManagerUnavailableError("Analysis workers are not available")
+        if self.dispatching:
+            await self._dispatch(jobs, group)
+            return
+        
+        try:
+            self._queue.put_many_nowait(jobs, group)
+        except asyncio.QueueFull:
+            JOBS_REJECTED.labels("queue_full").inc(len(jobs))
+            raise QueueFullError(
+                f"Analysis queue cannot take {len(jobs)} more ({self._queue.free()} of {self.max_queue} free)"
+            )
+        
+        for job in jobs:
+            self.active[job.analysis_id] = job
+            get_event_broker().open(job.analysis_id)
+            await self.store.save(job.to_dict())
+    
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """Current view of a job, live if in flight, else from the store"""
+        job = self.active.get(analysis_id)
+        if job is not None:
+            return job.to_dict()
+        return await self.store.get(analysis_id)
+    
+    async def list(
+        self,
+        status: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Newest jobs first, paged by analysis ID"""
+        return await self.store.list(status=status, limit=limit, before=before)
+    
+    async def cancel(self, analysis_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it is not in flight"""
+        if self.dispatching:
+            return await self._cancel_dispatched(analysis_id)
+        return await self._cancel_local(analysis_id)
+    
+    async def _cancel_local(self, analysis_id: str) -> bool:
+        job = self.active.get(analysis_id)
+        if job is None or job.finished:
+            return False
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # still queued; the worker that dequeues it will skip it
+            await self._finish(job, self._cancel_status())
+        return True
+    
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._capacity.set()  # room in the local queue for the claimer
+            try:
+                if job.status == QUEUED:
+                    job.task = asyncio.create_task(self._run(job))
+                    try:
+                        await job.task
+                    except asyncio.CancelledError:
+                        if asyncio.current_task().cancelling():
+                            raise
+                        # cancelled before the job got to run
+                        await self._finish(job, self._cancel_status())
+            except Exception:
+                logger.exception("Worker failed on %s", job.analysis_id)
+    
+    async def _run(self, job: Job):
+        events = get_event_broker()
+        current_analysis_id.set(job.analysis_id)
+        if job.tool_results is not None:
+            shared_tool_results.set(job.tool_results)
+        
+        journal = await self._load_journal(job.analysis_id)
+        seq = journal.size if journal else 0
+        
+        job.status = RUNNING
+        job.started_at = datetime.now().isoformat()
+        job.state = {"query": job.query, "iteration_count": 0}
+        update_job_gauges(self)
+        await self.store.save(job.to_dict())
+        status = {"status": RUNNING}
+        if journal:
+            status["resumed_nodes"] = journal.size
+        events.publish(job.analysis_id, "status", status)
+        
+        try:
+            async with asyncio.timeout(self.job_timeout):
+                graph = await self.load_graph()
+                async for mode, chunk in graph.astream(job.state, stream_mode=["updates", "values"]):
+                    if mode == "values":
+                        job.state = chunk
+                        continue
+                    for node, update in chunk.items():
+                        events.publish(job.analysis_id, "node", {"node": node, "update": update})
+                        if self.checkpoints is not None and not (journal and journal.was_replayed(node)):
+                            await self._checkpoint(job.analysis_id, seq, node, update)
+                            seq += 1
+        except asyncio.CancelledError:
+            await asyncio.shield(self._finish(job, self._cancel_status()))
+            raise
+        except TimeoutError:
+            await self._finish(job, FAILED, f"Analysis exceeded {self.job_timeout}s")
+        except Exception as e:
+            logger.exception("Analysis %s failed", job.analysis_id)
+            await self._finish(job, FAILED, str(e))
+        else:
+            await self._finish(job, COMPLETED)
+    
+    async def _load_journal(self, analysis_id: str) -> Optional[ReplayJournal]:
+        if self.checkpoints is None:
+            return None
+        entries = await self.checkpoints.load(analysis_id)
+        if not entries:
+            return None
+        journal = ReplayJournal(entries)
+        replay_journal.set(journal)
+        logger.info("Resuming %s after %d checkpointed nodes", analysis_id, journal.size)
+        return journal
+    
+    async def _checkpoint(self, analysis_id: str, seq: int, node: str, update: Optional[Dict[str, Any]]):
+        try:
+            await self.checkpoints.append(analysis_id, seq, node, update or {})
+        except Exception:
+            # A lost checkpoint only costs re-running the node after a crash
+            logger.warning("Checkpoint write failed for %s at %s", analysis_id, node, exc_info=True)
+    
+    async def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        if job.analysis_id not in self.active:
+            return
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.now().isoformat()
+        del self.active[job.analysis_id]
+        JOBS_FINISHED.labels(status).inc()
+        update_job_gauges(self)
+        if job.started_at:
+            elapsed = datetime.now() - datetime.fromisoformat(job.started_at)
+            ANALYSIS_LATENCY.labels(status).observe(elapsed.total_seconds())
+        record = job.to_dict()
+        if status == COMPLETED and self.semantic_cache is not None:
+            await self._remember(record)
+        await self.store.save(record)
+        if self.checkpoints is not None and status != INTERRUPTED:
+            await self.checkpoints.delete(job.analysis_id)
+        get_event_broker().close(job.analysis_id, record)
+        if self.dispatcher is not None:
+            await self._settle_dispatched(job, status)
+    
+    async def _dispatch(self, jobs: List[Job], group: str):
+        depth = await self.dispatcher.depth()
+        self._dispatched_depth = depth
+        if depth + len(jobs) > self.max_queue:
+            JOBS_REJECTED.labels("queue_full").inc(len(jobs))
+            raise QueueFullError(
+                f"Analysis queue cannot take {len(jobs)} more ({max(0, self.max_queue - depth)} of {self.max_queue} free)"
+            )
+        
+        events = get_event_broker()
+        for job in jobs:
+            events.open(job.analysis_id)
+            await self.store.save(job.to_dict())
+        await self.dispatcher.put([
+            {
+                "analysis_id": job.analysis_id,
+                "query": job.query,
+                "options": job.options,
+                "created_at": job.created_at,
+                "batch_id": job.batch_id,
+                "group": group
+            }
+            for job in jobs
+        ])
+        self._dispatched_depth = depth + len(jobs)
+    
+    async def _cancel_dispatched(self, analysis_id: str) -> bool:
+        record = await self.store.get(analysis_id)
+        if record is None or record["status"] in FINISHED_STATUSES or record["status"] == INTERRUPTED:
+            return False
+        if not await self.dispatcher.withdraw(analysis_id):
+            await self.dispatcher.request_cancel(analysis_id)
+            return True
+        
+        # Never claimed, so nothing else will write its final record
+        record.update(status=CANCELLED, finished_at=datetime.now().isoformat())
+        JOBS_FINISHED.labels(CANCELLED).inc()
+        await self.store.save(record)
+        get_event_broker().publish(analysis_id, END, record)
+        self.dispatcher.publish({
+            "id": 0,
+            "type": END,
+            "analysis_id": analysis_id,
+            "timestamp": record["finished_at"],
+            "data": record
+        })
+        return True
+    
+    async def watch(self, analysis_id: str):
+        """Make progress of a job admitted by another API process streamable here"""
+        if not self.dispatching or get_event_broker().is_open(analysis_id):
+            return
+        record = await self.store.get(analysis_id)
+        if record is None or record["status"] in FINISHED_STATUSES or record["status"] == INTERRUPTED:
+            return
+        # The end event may have been relayed while the record was read
+        if analysis_id not in self._ended:
+            get_event_broker().open(analysis_id)
+    
+    async def _relay(self):
+        """Deliver events from graph worker processes to local subscribers"""
+        events = get_event_broker()
+        cursor = await self.dispatcher.event_cursor()
+        while True:
+            try:
+                cursor, batch = await self.dispatcher.read_events(cursor, timeout=1.0)
+            except Exception:
+                logger.warning("Reading dispatched events failed", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            for event in batch:
+                if event["type"] == END:
+                    self._ended.append(event["analysis_id"])
+                    record = event.get("data") or {}
+                    if record.get("status") == COMPLETED and self.semantic_cache is not None:
+                        await self._remember(record)
+                if events.is_open(event["analysis_id"]):
+                    events.deliver(event)
+    
+    async def _claim(self):
+        """Lease jobs from the work queue whenever a worker is free"""
+        while True:
+            # Claimed jobs wait in the local queue, so never lease more than it can hold
+            free = min(self.max_workers - len(self.active), self._queue.free())
+            if free <= 0:
+                self._capacity.clear()
+                await self._capacity.wait()
+                continue
+            try:
+                items = await self.dispatcher.claim(self.worker_id, free, timeout=1.0)
+            except Exception:
+                logger.warning("Claiming dispatched jobs failed", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            if not items:
+                continue
+            
+            cancelled = await self.dispatcher.cancel_requested([item["analysis_id"] for item in items])
+            groups: Dict[str, List[Job]] = {}
+            for item in items:
+                job = Job(
+                    analysis_id=item["analysis_id"],
+                    query=item["query"],
+                    options=item.get("options") or {},
+                    created_at=item["created_at"],
+                    batch_id=item.get("batch_id")
+                )
+                if job.batch_id:
+                    job.tool_results = self._batch_scopes.setdefault(job.batch_id, {})
+                groups.setdefault(item.get("group") or DEFAULT_GROUP, []).append(job)
+            for group, jobs in groups.items():
+                try:
+                    self._queue.put_many_nowait(jobs, group)
+                except asyncio.QueueFull:
+                    # Hand the leases back rather than strand them until they expire
+                    await self.dispatcher.release([job.analysis_id for job in jobs])
+                    continue
+                for job in jobs:
+                    self.active[job.analysis_id] = job
+                    get_event_broker().open(job.analysis_id)
+                    if job.analysis_id in cancelled:
+                        await self._finish(job, CANCELLED)
+    
+    async def _keep_leases(self):
+        """Renew leases of running jobs and apply cancel requests from API processes"""
+        while True:
+            await asyncio.sleep(self.dispatcher.lease / 3)
+            analysis_ids = list(self.active)
+            try:
+                await self.dispatcher.renew(self.worker_id, analysis_ids)
+                cancelled = await self.dispatcher.cancel_requested(analysis_ids)
+            except Exception:
+                logger.warning("Renewing job leases failed", exc_info=True)
+                continue
+            for analysis_id in cancelled:
+                await self._cancel_local(analysis_id)
+    
+    async def _settle_dispatched(self, job: Job, status: str):
+        if self.dispatching:
+            return
+        if status == INTERRUPTED:
+            await self.dispatcher.release([job.analysis_id])
+        else:
+            await self.dispatcher.ack(job.analysis_id)
+        if job.batch_id and not any(other.batch_id == job.batch_id for other in self.active.values()):
+            self._batch_scopes.pop(job.batch_id, None)
+        self._capacity.set()
+''')
+
+    create_file("src/jobs/ids.py", '''"""Analysis Identifiers"""
+import os
+import threading
+import time
+
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+RANDOM_BITS = 80
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(CROCKFORD[index])
+    return "".join(reversed(chars))
+
+def new_ulid() -> str:
+    """ULID: 48-bit millisecond timestamp + 80 random bits, 26 chars
+    
+    IDs sort lexicographically by creation time. Within one millisecond the
+    random part is incremented, so IDs from this process are strictly
+    monotonic and never collide.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            now_ms = _last_ms
+            _last_random = (_last_random + 1) % (1 << RANDOM_BITS)
+        else:
+            _last_ms = now_ms
+            _last_random = int.from_bytes(os.urandom(10), "big")
+        return _encode(now_ms, 10) + _encode(_last_random, 16)
+
+def new_analysis_id() -> str:
+    """Identifier for a new analysis"""
+    return f"analysis_{new_ulid()}"
+
+def ulid_timestamp(ulid: str) -> float:
+    """Creation time (epoch seconds) encoded in a ULID"""
+    value = 0
+    for char in ulid[-26:][:10]:
+        value = value * 32 + CROCKFORD.index(char)
+    return value / 1000
+''')
+
+    create_file("src/jobs/store.py", '''"""Analysis Job Store"""
+import asyncio
+import bisect
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+class JobStore(ABC):
+    """Persistence for analysis job records, keyed by time-sortable ID"""
+    
+    @abstractmethod
+    async def save(self, record: Dict[str, Any]):
+        """Insert or replace a job record"""
+    
+    @abstractmethod
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch one job record"""
+    
+    @abstractmethod
+    async def list(
+        self,
+        status: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Newest records first, optionally filtered by status, paged by ID"""
+    
+    @abstractmethod
+    async def save_batch(self, batch: Dict[str, Any]):
+        """Insert or replace a batch record"""
+    
+    @abstractmethod
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch one batch record"""
+    
+    async def ensure_indexes(self):
+        """Create backend indexes (idempotent)"""
+    
+    async def close(self):
+        """Release backend resources"""
+
+class _IdIndex:
+    """Analysis IDs kept for newest-first paging with O(1) amortised writes
+    
+    IDs are appended; one arriving out of order only marks the list for a
+    sort on the next read. Removals are tombstones, compacted in bulk once
+    they outnumber the live IDs.
+    """
+    
+    def __init__(self):
+        self._ids: List[str] = []
+        self._removed: set = set()
+        self._ordered = True
+    
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._removed)
+    
+    def add(self, analysis_id: str):
+        if analysis_id in self._removed:
+            self._removed.discard(analysis_id)
+            return
+        if self._ids and analysis_id < self._ids[-1]:
+            self._ordered = False
+        self._ids.append(analysis_id)
+    
+    def remove(self, analysis_id: str):
+        self._removed.add(analysis_id)
+        if len(self._removed) > max(32, len(self)):
+            self._compact()
+    
+    def _compact(self):
+        if self._removed:
+            self._ids = [analysis_id for analysis_id in self._ids if analysis_id not in self._removed]
+            self._removed.clear()
+        if not self._ordered:
+            self._ids.sort()
+            self._ordered = True
+    
+    def page(self, limit: int, before: Optional[str] = None) -> List[str]:
+        """Up to ``limit`` IDs below ``before``, newest first"""
+        if not self._ordered:
+            self._ids.sort()
+            self._ordered = True
+        end = bisect.bisect_left(self._ids, before) if before else len(self._ids)
+        found = []
+        for index in range(end - 1, -1, -1):
+            if len(found) >= limit:
+                break
+            if self._ids[index] not in self._removed:
+                found.append(self._ids[index])
+        return found
+    
+    def pop_oldest(self, count: int) -> List[str]:
+        self._compact()
+        oldest = self._ids[:count]
+        del self._ids[:count]
+        return oldest
+
+class InMemoryJobStore(JobStore):
+    """Dict-backed store with ID indexes per status
+    
+    IDs are monotonic, so index writes are appends in practice and page
+    seeks are binary searches; nothing is re-sorted per save. Once the store
+    grows 10% past ``max_records`` the oldest records are dropped in one batch.
+    """
+    
+    def __init__(self, max_records: int = 10000):
+        self.max_records = max_records
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._ids = _IdIndex()
+        self._by_status: Dict[str, _IdIndex] = {}
+        self._batches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    
+    async def save(self, record: Dict[str, Any]):
+        analysis_id = record["analysis_id"]
+        previous = self._records.get(analysis_id)
+        if previous is None:
+            self._ids.add(analysis_id)
+        elif previous["status"] != record["status"]:
+            self._by_status[previous["status"]].remove(analysis_id)
+        
+        if previous is None or previous["status"] != record["status"]:
+            self._by_status.setdefault(record["status"], _IdIndex()).add(analysis_id)
+        self._records[analysis_id] = dict(record)
+        
+        if len(self._ids) > self.max_records * 1.1:
+            for oldest in self._ids.pop_oldest(len(self._ids) - self.max_records):
+                self._by_status[self._records.pop(oldest)["status"]].remove(oldest)
+    
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        record = self._records.get(analysis_id)
+        return dict(record) if record else None
+    
+    async def list(
+        self,
+        status: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        ids = self._ids if status is None else self._by_status.get(status)
+        if ids is None:
+            return []
+        return [dict(self._records[analysis_id]) for analysis_id in ids.page(limit, before)]
+    
+    async def save_batch(self, batch: Dict[str, Any]):
+        self._batches[batch["batch_id"]] = dict(batch)
+        self._batches.move_to_end(batch["batch_id"])
+        while len(self._batches) > max(1, self.max_records // 10):
+            self._batches.popitem(last=False)
+    
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = self._batches.get(batch_id)
+        return dict(batch) if batch else None
+
+class MongoJobStore(JobStore):
+    """MongoDB-backed store using the async motor driver
+    
+    Records are keyed by ``_id`` = analysis ID. Because IDs sort by creation
+    time, the ``(status, _id)`` index serves filtered, newest-first pages and
+    the ``created_at`` index serves time-range queries.
+    """
+    
+    def __init__(self, uri: str, database: str = "pharmaintel", collection: str = "analyses"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        
+        self.client = AsyncIOMotorClient(uri)
+        self.collection = self.client[database][collection]
+        self.batches = self.client[database][f"{collection}_batches"]
+    
+    async def ensure_indexes(self):
+        """Create the status and creation-time indexes (idempotent)"""
+        await self.collection.create_index([("status", 1), ("_id", -1)], name="status_id")
+        await self.collection.create_index([("created_at", -1)], name="created_at")
+    
+    async def save(self, record: Dict[str, Any]):
+        document = {**record, "_id": record["analysis_id"]}
+        await self.collection.replace_one({"_id": document["_id"]}, document, upsert=True)
+    
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        document = await self.collection.find_one({"_id": analysis_id})
+        if document is not None:
+            document.pop("_id")
+        return document
+    
+    async def list(
+        self,
+        status: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {}
+        if status:
+            query["status"] = status
+        if before:
+            query["_id"] = {"$lt": before}
+        
+        cursor = self.collection.find(query, projection={"_id": False}).sort("_id", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+    
+    async def save_batch(self, batch: Dict[str, Any]):
+        document = {**batch, "_id": batch["batch_id"]}
+        await self.batches.replace_one({"_id": document["_id"]}, document, upsert=True)
+    
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        return await self.batches.find_one({"_id": batch_id}, projection={"_id": False})
+    
+    async def close(self):
+        self.client.close()
+
+class SQLiteJobStore(JobStore):
+    """Single-file store shared by the processes of one host
+    
+    Lets API and graph workers on one machine see the same records without
+    a database server. WAL mode lets readers proceed during writes; calls go
+    through a worker thread so they never block the event loop.
+    """
+    
+    def __init__(self, path: str):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "analysis_id TEXT PRIMARY KEY, status TEXT NOT NULL, record TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_status ON analyses (status, analysis_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, record TEXT NOT NULL) WITHOUT ROWID"
+        )
+    
+    def _execute(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    async def save(self, record: Dict[str, Any]):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)",
+            (record["analysis_id"], record["status"], json.dumps(record, default=str))
+        )
+    
+    async def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT record FROM analyses WHERE analysis_id = ?", (analysis_id,)
+        )
+        return json.loads(rows[0][0]) if rows else None
+    
+    async def list(
+        self,
+        status: Optional[str] = None,
+        limit: int = 50,
+        before: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if before:
+            clauses.append("analysis_id < ?")
+            params.append(before)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT record FROM analyses{where} ORDER BY analysis_id DESC LIMIT ?",
+            (*params, limit)
+        )
+        return [json.loads(record) for (record,) in rows]
+    
+    async def save_batch(self, batch: Dict[str, Any]):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO batches VALUES (?, ?)",
+            (batch["batch_id"], json.dumps(batch, default=str))
+        )
+    
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        rows = await asyncio.to_thread(self._execute, "SELECT record FROM batches WHERE batch_id = ?", (batch_id,))
+        return json.loads(rows[0][0]) if rows else None
+    
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_job_store(
+    backend: str = "memory",
+    mongodb_uri: Optional[str] = None,
+    mongodb_database: str = "pharmaintel",
+    max_records: int = 10000,
+    path: str = "data/jobs.db"
+) -> JobStore:
+    """Build the configured job store"""
+    if backend == "memory":
+        return InMemoryJobStore(max_records=max_records)
+    if backend == "sqlite":
+        return SQLiteJobStore(path)
+    if backend == "mongodb":
+        if not mongodb_uri:
+            raise ValueError("MONGODB_URI is required for the mongodb job store")
+        return MongoJobStore(mongodb_uri, mongodb_database)
+    raise ValueError(f"Unknown job store backend: {backend}")
+''')
+
+    create_file("src/jobs/events.py", '''"""Analysis Progress Events"""
+import asyncio
+import contextvars
+import itertools
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_BUFFER_SIZE = 256
+DEFAULT_HISTORY_SIZE = 64
+DEFAULT_HEARTBEAT_INTERVAL = 15.0
+
+END = "end"
+HEARTBEAT = "heartbeat"
+
+current_analysis_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_analysis_id", default=None
+)
+
+class Subscription:
+    """One subscriber's bounded view of an analysis event stream
+    
+    When the consumer falls behind, the oldest buffered events are dropped
+    and counted in ``dropped``; publishers never block. Iteration yields a
+    heartbeat event whenever nothing arrives for ``heartbeat_interval``.
+    """
+    
+    def __init__(self, broker: "EventBroker", analysis_id: str, buffer_size: int, heartbeat_interval: float):
+        self.broker = broker
+        self.analysis_id = analysis_id
+        self.heartbeat_interval = heartbeat_interval
+        self.dropped = 0
+        self._buffer: deque = deque()
+        self._buffer_size = buffer_size
+        self._ready = asyncio.Event()
+        self._closed = False
+    
+    def push(self, event: Dict[str, Any]):
+        if len(self._buffer) >= self._buffer_size:
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(event)
+        self._ready.set()
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._closed:
+            raise StopAsyncIteration
+        if not self._buffer:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                return {
+                    "type": HEARTBEAT,
+                    "analysis_id": self.analysis_id,
+                    "timestamp": datetime.now().isoformat()
+                }
+        
+        event = self._buffer.popleft()
+        if event["type"] == END:
+            self.close()
+        return event
+    
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.broker._unsubscribe(self)
+
+class EventBroker:
+    """In-process pub/sub of progress events, keyed by analysis ID
+    
+    A short history per analysis is replayed to late subscribers so they see
+    the node transitions that already happened. In a graph worker process,
+    ``forward`` also hands every event to the API processes.
+    """
+    
+    def __init__(
+        self,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        history_size: int = DEFAULT_HISTORY_SIZE,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        forward: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        self.buffer_size = buffer_size
+        self.history_size = history_size
+        self.heartbeat_interval = heartbeat_interval
+        self.forward = forward
+        self._subscribers: Dict[str, List[Subscription]] = {}
+        self._history: Dict[str, deque] = {}
+        self._sequence = itertools.count(1)
+    
+    def open(self, analysis_id: str):
+        """Start recording history for an analysis"""
+        self._history.setdefault(analysis_id, deque(maxlen=self.history_size))
+    
+    def is_open(self, analysis_id: str) -> bool:
+        return analysis_id in self._history
+    
+    def publish(self, analysis_id: str, event_type: str, data: Optional[Dict[str, Any]] = None):
+        """Fan an event out to every subscriber without blocking"""
+        history = self._history.get(analysis_id)
+        subscribers = self._subscribers.get(analysis_id)
+        if history is None and not subscribers:
+            return
+        
+        event = {
+            "id": next(self._sequence),
+            "type": event_type,
+            "analysis_id": analysis_id,
+            "timestamp": datetime.now().isoformat(),
+            "data": data or {}
+        }
+        if self.forward is not None:
+            self.forward(event)
+        self.deliver(event)
+    
+    def deliver(self, event: Dict[str, Any]):
+        """Fan out an event built elsewhere, such as one relayed from a worker process"""
+        analysis_id = event["analysis_id"]
+        history = self._history.get(analysis_id)
+        if history is not None and event["type"] != "token":
+            history.append(event)
+        for subscriber in self._subscribers.get(analysis_id) or ():
+            subscriber.push(event)
+        if event["type"] == END:
+            self._history.pop(analysis_id, None)
+    
+    def close(self, analysis_id: str, data: Optional[Dict[str, Any]] = None):
+        """Send the end event and forget the analysis"""
+        self.publish(analysis_id, END, data)
+    
+    def subscribe(self, analysis_id: str) -> Subscription:
+        """Subscribe to an analysis, replaying recent history"""
+        subscription = Subscription(self, analysis_id, self.buffer_size, self.heartbeat_interval)
+        for event in self._history.get(analysis_id, ()):
+            subscription.push(event)
+        self._subscribers.setdefault(analysis_id, []).append(subscription)
+        return subscription
+    
+    def subscriber_count(self, analysis_id: str) -> int:
+        return len(self._subscribers.get(analysis_id, []))
+    
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.analysis_id, [])
+        if subscription in subscribers:
+            subscribers.remove(subscription)
+        if not subscribers:
+            self._subscribers.pop(subscription.analysis_id, None)
+
+_broker = EventBroker()
+
+def get_event_broker() -> EventBroker:
+    """Process-wide event broker"""
+    return _broker
+
+def configure_event_broker(broker: EventBroker):
+    """Replace the process-wide broker, typically once at startup"""
+    global _broker
+    _broker = broker
+
+def emit(event_type: str, data: Optional[Dict[str, Any]] = None):
+    """Publish an event for the analysis running in the current context"""
+    analysis_id = current_analysis_id.get()
+    if analysis_id is not None:
+        _broker.publish(analysis_id, event_type, data)
+''')
+
+    create_file("src/jobs/queue.py", '''"""Fair Admission Queue"""
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Iterable
+
+DEFAULT_GROUP = "interactive"
+
+class FairQueue:
+    """Bounded queue that round-robins between groups
+    
+    Each batch is its own group and single requests share one, so a large
+    portfolio run interleaves with interactive traffic instead of queueing
+    ahead of it.
+    """
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._groups: "OrderedDict[str, deque]" = OrderedDict()
+        self._size = 0
+        self._available = asyncio.Semaphore(0)
+    
+    def qsize(self) -> int:
+        return self._size
+    
+    def free(self) -> int:
+        return self.maxsize - self._size
+    
+    def put_nowait(self, item: Any, group: str = DEFAULT_GROUP):
+        self.put_many_nowait([item], group)
+    
+    def put_many_nowait(self, items: Iterable[Any], group: str = DEFAULT_GROUP):
+        """Enqueue all items or none; raises asyncio.QueueFull"""
+        items = list(items)
+        if len(items) > self.free():
+            raise asyncio.QueueFull
+        self._groups.setdefault(group, deque()).extend(items)
+        self._size += len(items)
+        for _ in items:
+            self._available.release()
+    
+    async def get(self) -> Any:
+        """Next item from the group whose turn it is"""
+        await self._available.acquire()
+        group, items = next(iter(self._groups.items()))
+        item = items.popleft()
+        if items:
+            self._groups.move_to_end(group)
+        else:
+            del self._groups[group]
+        self._size -= 1
+        return item
+''')
+
+    create_file("src/jobs/semantic_cache.py", '''"""Semantic Result Cache"""
+import asyncio
+import difflib
+import json
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+from src.utils.lazy import lazy_import
+from src.utils.query_terms import GENERIC_TERMS, normalise_query
+
+np = lazy_import("numpy")
+
+DEFAULT_DIM = 1024
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_TTL = 24 * 3600.0
+REDIS_PREFIX = "pharmaintel:semantic:"
+
+# Request option that skips the cache; it never affects the match itself
+BYPASS_OPTION = "cache"
+
+class NgramEmbedder:
+    """CPU-only query embedding: hashed words plus character trigrams
+    
+    Trigrams make morphological variants and typos land close together; the
+    whole-word features keep different drugs apart. Vectors are unit length,
+    so a dot product is the cosine similarity.
+    """
+    
+    def __init__(self, dim: int = DEFAULT_DIM, trigram_weight: float = 0.5):
+        self.dim = dim
+        self.trigram_weight = trigram_weight
+    
+    def _slot(self, feature: str) -> int:
+        # crc32 rather than hash(), which is salted per process
+        return zlib.crc32(feature.encode("utf-8")) % self.dim
+    
+    def embed_terms(self, terms: List[str]) -> "np.ndarray":
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term in terms:
+            # Generic question words barely move the vector
+            weight = 0.25 if term in GENERIC_TERMS else 1.0
+            vector[self._slot("w:" + term)] += weight
+            padded = f"<{term}>"
+            grams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+            gram_weight = weight * self.trigram_weight * 3 / max(1, len(grams))
+            for gram in grams:
+                vector[self._slot(gram)] += gram_weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def embed(self, query: str) -> "np.ndarray":
+        return self.embed_terms(normalise_query(query))
+
+def _same_term(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    # Tolerate a typo in long words, but not ketamine vs esketamine
+    return min(len(a), len(b)) >= 6 and difflib.SequenceMatcher(None, a, b).ratio() >= 0.9
+
+def terms_agree(left: List[str], right: List[str]) -> bool:
+    """Every specific term on either side has a counterpart on the other
+    
+    Embeddings of "sildenafil in PAH" and "tadalafil in PAH" are close; this
+    check is what keeps one drug's report from answering the other.
+    """
+    for terms, others in ((left, right), (right, left)):
+        for term in terms:
+            if term in GENERIC_TERMS:
+                continue
+            if not any(_same_term(term, other) for other in others):
+                return False
+    return True
+
+def options_key(options: Optional[Dict[str, Any]]) -> str:
+    scoped = {key: value for key, value in (options or {}).items() if key != BYPASS_OPTION}
+    return json.dumps(scoped, sort_keys=True, default=str)
+
+class SemanticCache:
+    """Finished analyses looked up by query similarity
+    
+    Vectors live in one NumPy matrix, allocated in full on the first store
+    or ``reserve``, so a lookup is a single matrix-vector product over every
+    entry. A hit needs a similarity of at
+    least ``threshold``, identical options and agreeing terms. When full,
+    expired entries are reused first, then the least recently used.
+    
+    With Redis, finished analyses are also written once to a shared tier
+    that a newly started process loads on warm-up. The vectors stay in each
+    process, since a lookup must not wait on the network.
+    """
+    
+    def __init__(
+        self,
+        embedder: Optional[NgramEmbedder] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        clock: Callable[[], float] = time.monotonic,
+        redis=None,
+        prefix: str = REDIS_PREFIX
+    ):
+        self.embedder = embedder or NgramEmbedder()
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.clock = clock
+        self.redis = redis
+        self.prefix = prefix
+        self._order = prefix + "order"
+        self._vectors = None
+        self._expires = None
+        self._last_used = None
+        self._entries: List[Optional[Dict[str, Any]]] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.redis_errors = 0
+    
+    def reserve(self):
+        """Allocate the vector matrix now rather than on the first store"""
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, self.embedder.dim), dtype=np.float32)
+            self._expires = np.zeros(self.max_entries, dtype=np.float64)
+            self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+    
+    def lookup(self, query: str, options: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Closest cached analysis, as ``{"result", "analysis_id", "query", "similarity"}``"""
+        match = self._match(normalise_query(query), options_key(options))
+        if match is None:
+            self.misses += 1
+            return None
+        slot, similarity = match
+        self.hits += 1
+        self._last_used[slot] = self.clock()
+        entry = self._entries[slot]
+        return {
+            "result": entry["result"],
+            "analysis_id": entry["analysis_id"],
+            "query": entry["query"],
+            "similarity": round(similarity, 4)
+        }
+    
+    def _match(self, terms: List[str], scope: str, threshold: Optional[float] = None):
+        size = len(self._entries)
+        if not size or not terms:
+            return None
+        scores = self._vectors[:size] @ self.embedder.embed_terms(terms)
+        scores[self._expires[:size] <= self.clock()] = -1.0
+        threshold = self.threshold if threshold is None else threshold
+        candidates = np.flatnonzero(scores >= threshold)
+        for slot in candidates[np.argsort(-scores[candidates])]:
+            entry = self._entries[slot]
+            if entry is not None and entry["scope"] == scope and terms_agree(terms, entry["terms"]):
+                return int(slot), float(scores[slot])
+        return None
+    
+    def store(
+        self,
+        query: str,
+        options: Optional[Dict[str, Any]],
+        analysis_id: str,
+        result: Dict[str, Any],
+        ttl: Optional[float] = None
+    ):
+        """Remember a finished analysis, replacing a near-identical earlier one"""
+        terms = normalise_query(query)
+        if not terms:
+            return
+        self.reserve()
+        scope = options_key(options)
+        match = self._match(terms, scope, threshold=0.99)
+        slot = match[0] if match is not None else self._free_slot()
+        now = self.clock()
+        entry = {"query": query, "terms": terms, "scope": scope, "analysis_id": analysis_id, "result": result}
+        if slot == len(self._entries):
+            self._entries.append(entry)
+        else:
+            self._entries[slot] = entry
+        self._vectors[slot] = self.embedder.embed_terms(terms)
+        self._expires[slot] = now + (self.ttl if ttl is None else ttl)
+        self._last_used[slot] = now
+    
+    def _entry_key(self, analysis_id: str) -> str:
+        return f"{self.prefix}entry:{analysis_id}"
+    
+    async def share(self, query: str, options: Optional[Dict[str, Any]], analysis_id: str, result: Dict[str, Any]):
+        """``store``, then publish the analysis to the Redis tier unless another process has"""
+        self.store(query, options, analysis_id, result)
+        if self.redis is None or not normalise_query(query):
+            return
+        entry = json.dumps(
+            {"query": query, "options": options, "analysis_id": analysis_id, "result": result}, default=str
+        )
+        now = time.time()
+        try:
+            # Every API process relays the same result; only the first write lands
+            if await self.redis.set(self._entry_key(analysis_id), entry, ex=max(1, int(self.ttl)), nx=True):
+                await self.redis.zadd(self._order, {analysis_id: now})
+                await self.redis.zremrangebyscore(self._order, "-inf", now - self.ttl)
+                await self.redis.zremrangebyrank(self._order, 0, -self.max_entries - 1)
+        except Exception:
+            self.redis_errors += 1
+    
+    async def load(self) -> int:
+        """Fill the local tier with the newest shared analyses; the number loaded"""
+        if self.redis is None:
+            return 0
+        now = time.time()
+        try:
+            newest = await self.redis.zrevrangebyscore(
+                self._order, now, now - self.ttl, start=0, num=self.max_entries, withscores=True
+            )
+            ids = [key.decode("utf-8") if isinstance(key, bytes) else key for key, _ in newest]
+            payloads = await self.redis.mget([self._entry_key(analysis_id) for analysis_id in ids]) if ids else []
+        except Exception:
+            self.redis_errors += 1
+            return 0
+        
+        loaded = 0
+        # Oldest first, so the newest end up the most recently used
+        for (_, stored), payload in reversed(list(zip(newest, payloads))):
+            if payload is None:
+                continue
+            entry = json.loads(payload)
+            self.store(entry["query"], entry["options"], entry["analysis_id"], entry["result"], ttl=stored + self.ttl - now)
+            loaded += 1
+            if not loaded % 100:
+                await asyncio.sleep(0)
+        return loaded
+    
+    def _free_slot(self) -> int:
+        size = len(self._entries)
+        if size < self.max_entries:
+            return size
+        expired = np.flatnonzero(self._expires[:size] <= self.clock())
+        if expired.size:
+            return int(expired[0])
+        self.evictions += 1
+        return int(np.argmin(self._last_used[:size]))
+    
+    def clear(self):
+        self._entries = []
+        if self._expires is not None:
+            self._expires[:] = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "redis_errors": self.redis_errors
+        }
+''')
+
+    create_file("src/jobs/dispatch.py", '''"""Cross-Process Job Dispatch
+
+In dispatch mode API processes only admit analyses; a separate pool of
+graph worker processes claims and runs them. Work, progress events and
+cancellations travel through a ``WorkQueue``: Redis when configured, or a
+SQLite file standing in for it on a single host.
+
+Claims are leases. A worker renews the leases of the analyses it is running;
+if it dies, its analyses become claimable again once their lease lapses and
+resume from their checkpoints on another worker.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set, Tuple
+from src.utils.logger import get_logger
+
+logger = get_logger("dispatch")
+
+DEFAULT_LEASE = 60.0
+DEFAULT_EVENT_RETENTION = 3600.0
+FLUSH_INTERVAL = 0.05
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class WorkQueue(ABC):
+    """Analyses waiting for a graph worker, plus the events flowing back
+    
+    Events are published without blocking: they are buffered and written by
+    a background task, so a busy analysis never waits on the queue backend.
+    """
+    
+    def __init__(self, lease: float = DEFAULT_LEASE):
+        self.lease = lease
+        self._pending: List[Dict[str, Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop(), name="dispatch-event-flush")
+    
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+    
+    def publish(self, event: Dict[str, Any]):
+        """Queue an event for every API process"""
+        self._pending.append(event)
+    
+    async def flush(self):
+        events, self._pending = self._pending, []
+        if events:
+            await self._write_events(events)
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logger.warning("Event flush failed", exc_info=True)
+    
+    @abstractmethod
+    async def put(self, items: List[Dict[str, Any]]):
+        """Enqueue analyses, each a dict with at least ``analysis_id``"""
+    
+    @abstractmethod
+    async def depth(self) -> int:
+        """Analyses waiting or running"""
+    
+    @abstractmethod
+    async def claim(self, worker_id: str, limit: int, timeout: float) -> List[Dict[str, Any]]:
+        """Lease up to ``limit`` analyses, waiting up to ``timeout`` for the first"""
+    
+    @abstractmethod
+    async def renew(self, worker_id: str, analysis_ids: List[str]):
+        """Extend the leases of analyses this worker is still running"""
+    
+    @abstractmethod
+    async def ack(self, analysis_id: str):
+        """Forget a finished analysis"""
+    
+    @abstractmethod
+    async def release(self, analysis_ids: List[str]):
+        """Make leased analyses claimable again straight away"""
+    
+    @abstractmethod
+    async def withdraw(self, analysis_id: str) -> bool:
+        """Remove an analysis no worker has claimed; False if one has"""
+    
+    @abstractmethod
+    async def request_cancel(self, analysis_id: str):
+        """Ask whichever worker runs the analysis to cancel it"""
+    
+    @abstractmethod
+    async def cancel_requested(self, analysis_ids: List[str]) -> Set[str]:
+        """The subset of ``analysis_ids`` with a pending cancel request"""
+    
+    @abstractmethod
+    async def event_cursor(self) -> Any:
+        """Position after the newest event, where a new reader starts"""
+    
+    @abstractmethod
+    async def read_events(self, cursor: Any, timeout: float) -> Tuple[Any, List[Dict[str, Any]]]:
+        """Events after ``cursor`` and the cursor to read from next"""
+    
+    @abstractmethod
+    async def _write_events(self, events: List[Dict[str, Any]]):
+        """Append buffered events"""
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue in a SQLite file shared by the processes of one host
+    
+    Stands in for Redis on a single machine. Claims are a single UPDATE, so
+    two workers never lease the same analysis; empty reads poll.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        lease: float = DEFAULT_LEASE,
+        poll_interval: float = 0.05,
+        event_retention: float = DEFAULT_EVENT_RETENTION
+    ):
+        super().__init__(lease)
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.poll_interval = poll_interval
+        self.event_retention = event_retention
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS work ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, analysis_id TEXT NOT NULL UNIQUE, payload TEXT NOT NULL, "
+            "worker TEXT, lease_until REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cancels (analysis_id TEXT PRIMARY KEY, created REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._pruned = time.time()
+    
+    def _execute(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    def _changes(self, sql: str, params=()) -> int:
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+    
+    async def put(self, items: List[Dict[str, Any]]):
+        rows = [(item["analysis_id"], json.dumps(item, default=str)) for item in items]
+        
+        def insert():
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany("INSERT OR IGNORE INTO work (analysis_id, payload) VALUES (?, ?)", rows)
+                self._conn.execute("COMMIT")
+        
+        await asyncio.to_thread(insert)
+    
+    async def depth(self) -> int:
+        return (await asyncio.to_thread(self._execute, "SELECT COUNT(*) FROM work"))[0][0]
+    
+    async def claim(self, worker_id: str, limit: int, timeout: float) -> List[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            rows = await asyncio.to_thread(
+                self._execute,
+                "UPDATE work SET worker = ?, lease_until = ? WHERE id IN ("
+                "SELECT id FROM work WHERE lease_until IS NULL OR lease_until < ? ORDER BY id LIMIT ?) "
+                "RETURNING id, payload",
+                (worker_id, now + self.lease, now, limit)
+            )
+            if rows or time.monotonic() >= deadline:
+                return [json.loads(payload) for _, payload in sorted(rows)]
+            await asyncio.sleep(self.poll_interval)
+    
+    async def renew(self, worker_id: str, analysis_ids: List[str]):
+        if analysis_ids:
+            marks = ", ".join("?" for _ in analysis_ids)
+            await asyncio.to_thread(
+                self._execute,
+                f"UPDATE work SET lease_until = ? WHERE worker = ? AND analysis_id IN ({marks})",
+                (time.time() + self.lease, worker_id, *analysis_ids)
+            )
+    
+    async def ack(self, analysis_id: str):
+        await asyncio.to_thread(self._execute, "DELETE FROM work WHERE analysis_id = ?", (analysis_id,))
+        await asyncio.to_thread(self._execute, "DELETE FROM cancels WHERE analysis_id = ?", (analysis_id,))
+    
+    async def release(self, analysis_ids: List[str]):
+        if analysis_ids:
+            marks = ", ".join("?" for _ in analysis_ids)
+            await asyncio.to_thread(
+                self._execute,
+                f"UPDATE work SET worker = NULL, lease_until = NULL WHERE analysis_id IN ({marks})",
+                tuple(analysis_ids)
+            )
+    
+    async def withdraw(self, analysis_id: str) -> bool:
+        removed = await asyncio.to_thread(
+            self._changes, "DELETE FROM work WHERE analysis_id = ? AND worker IS NULL", (analysis_id,)
+        )
+        return removed > 0
+    
+    async def request_cancel(self, analysis_id: str):
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO cancels VALUES (?, ?)", (analysis_id, time.time())
+        )
+    
+    async def cancel_requested(self, analysis_ids: List[str]) -> Set[str]:
+        if not analysis_ids:
+            return set()
+        marks = ", ".join("?" for _ in analysis_ids)
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT analysis_id FROM cancels WHERE analysis_id IN ({marks})", tuple(analysis_ids)
+        )
+        return {analysis_id for (analysis_id,) in rows}
+    
+    async def event_cursor(self) -> int:
+        return (await asyncio.to_thread(self._execute, "SELECT COALESCE(MAX(id), 0) FROM events"))[0][0]
+    
+    async def read_events(self, cursor: int, timeout: float) -> Tuple[int, List[Dict[str, Any]]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            rows = await asyncio.to_thread(
+                self._execute, "SELECT id, payload FROM events WHERE id > ? ORDER BY id LIMIT 1000", (cursor,)
+            )
+            if rows:
+                return rows[-1][0], [json.loads(payload) for _, payload in rows]
+            if time.monotonic() >= deadline:
+                return cursor, []
+            await asyncio.sleep(self.poll_interval)
+    
+    async def _write_events(self, events: List[Dict[str, Any]]):
+        now = time.time()
+        rows = [(json.dumps(event, default=str), now) for event in events]
+        prune = now - self._pruned > 60
+        if prune:
+            self._pruned = now
+        
+        def insert():
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany("INSERT INTO events (payload, created) VALUES (?, ?)", rows)
+                if prune:
+                    self._conn.execute("DELETE FROM events WHERE created < ?", (now - self.event_retention,))
+                self._conn.execute("COMMIT")
+        
+        await asyncio.to_thread(insert)
+    
+    async def close(self):
+        await super().close()
+        with self._lock:
+            self._conn.close()
+
+# Requeue lapsed leases, then pop and lease up to ARGV[3] ids in one step, so
+# no id is ever off the list without a lease
+CLAIM_SCRIPT = """
+for _, id in ipairs(redis.call("ZRANGEBYSCORE", KEYS[2], "-inf", ARGV[1])) do
+    redis.call("ZREM", KEYS[2], id)
+    redis.call("RPUSH", KEYS[1], id)
+end
+local claimed = {}
+while #claimed < tonumber(ARGV[3]) do
+    local id = redis.call("RPOP", KEYS[1])
+    if not id then
+        break
+    end
+    local payload = redis.call("HGET", KEYS[3], id)
+    if payload then
+        redis.call("ZADD", KEYS[2], ARGV[2], id)
+        table.insert(claimed, payload)
+    end
+end
+return claimed
+"""
+
+# Requeue only ids that still hold a lease, all in one step
+RELEASE_SCRIPT = """
+local released = 0
+for _, id in ipairs(ARGV) do
+    if redis.call("ZREM", KEYS[1], id) == 1 then
+        redis.call("RPUSH", KEYS[2], id)
+        released = released + 1
+    end
+end
+return released
+"""
+
+class RedisWorkQueue(WorkQueue):
+    """Work queue in Redis, shared by every host
+    
+    Analysis ids wait in a list with their payloads in a hash; leases live in
+    a sorted set scored by expiry. Claims are a Lua script that requeues
+    lapsed leases and moves ids from the list into the lease set atomically,
+    so a worker dying mid-claim loses nothing. Idle workers block on a small
+    notification stream that every put appends to. Events go to one capped
+    stream.
+    """
+    
+    def __init__(
+        self,
+        redis,
+        prefix: str = "pharmaintel:dispatch:",
+        lease: float = DEFAULT_LEASE,
+        max_events: int = 100_000
+    ):
+        super().__init__(lease)
+        self.redis = redis
+        self.prefix = prefix
+        self.max_events = max_events
+        self._work = prefix + "work"
+        self._items = prefix + "items"
+        self._leases = prefix + "leases"
+        self._events = prefix + "events"
+        self._ready = prefix + "ready"
+        self._claim_script = redis.register_script(CLAIM_SCRIPT)
+        self._release_script = redis.register_script(RELEASE_SCRIPT)
+    
+    def _cancel_key(self, analysis_id: str) -> str:
+        return f"{self.prefix}cancel:{analysis_id}"
+    
+    async def put(self, items: List[Dict[str, Any]]):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._items, mapping={item["analysis_id"]: json.dumps(item, default=str) for item in items})
+            pipe.lpush(self._work, *[item["analysis_id"] for item in items])
+            pipe.xadd(self._ready, {"n": len(items)}, maxlen=1000, approximate=True)
+            await pipe.execute()
+    
+    async def depth(self) -> int:
+        return await self.redis.hlen(self._items)
+    
+    async def _claim_now(self, limit: int) -> List[Dict[str, Any]]:
+        now = time.time()
+        payloads = await self._claim_script(
+            keys=[self._work, self._leases, self._items], args=[now, now + self.lease, limit]
+        )
+        return [json.loads(payload) for payload in payloads]
+    
+    async def claim(self, worker_id: str, limit: int, timeout: float) -> List[Dict[str, Any]]:
+        # Take the cursor first, so a put landing after an empty claim still wakes us
+        latest = await self.redis.xrevrange(self._ready, count=1)
+        claimed = await self._claim_now(limit)
+        if claimed:
+            return claimed
+        cursor = latest[0][0] if latest else "0-0"
+        if not await self.redis.xread({self._ready: cursor}, count=1, block=max(1, int(timeout * 1000))):
+            return []
+        return await self._claim_now(limit)
+    
+    async def renew(self, worker_id: str, analysis_ids: List[str]):
+        if analysis_ids:
+            deadline = time.time() + self.lease
+            await self.redis.zadd(self._leases, {analysis_id: deadline for analysis_id in analysis_ids}, xx=True)
+    
+    async def ack(self, analysis_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._leases, analysis_id)
+            pipe.hdel(self._items, analysis_id)
+            pipe.delete(self._cancel_key(analysis_id))
+            await pipe.execute()
+    
+    async def release(self, analysis_ids: List[str]):
+        if analysis_ids and await self._release_script(keys=[self._leases, self._work], args=analysis_ids):
+            await self.redis.xadd(self._ready, {"n": len(analysis_ids)}, maxlen=1000, approximate=True)
+    
+    async def withdraw(self, analysis_id: str) -> bool:
+        if not await self.redis.lrem(self._work, 1, analysis_id):
+            return False
+        await self.redis.hdel(self._items, analysis_id)
+        return True
+    
+    async def request_cancel(self, analysis_id: str):
+        await self.redis.set(self._cancel_key(analysis_id), 1, ex=int(DEFAULT_EVENT_RETENTION))
+    
+    async def cancel_requested(self, analysis_ids: List[str]) -> Set[str]:
+        if not analysis_ids:
+            return set()
+        flags = await self.redis.mget([self._cancel_key(analysis_id) for analysis_id in analysis_ids])
+        return {analysis_id for analysis_id, flag in zip(analysis_ids, flags) if flag is not None}
+    
+    async def event_cursor(self) -> str:
+        latest = await self.redis.xrevrange(self._events, count=1)
+        return latest[0][0] if latest else "0-0"
+    
+    async def read_events(self, cursor: str, timeout: float) -> Tuple[str, List[Dict[str, Any]]]:
+        response = await self.redis.xread({self._events: cursor}, count=1000, block=int(timeout * 1000))
+        if not response:
+            return cursor, []
+        entries = response[0][1]
+        return entries[-1][0], [json.loads(fields[b"event"]) for _, fields in entries]
+    
+    async def _write_events(self, events: List[Dict[str, Any]]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(
+                    self._events,
+                    {"event": json.dumps(event, default=str)},
+                    maxlen=self.max_events,
+                    approximate=True
+                )
+            await pipe.execute()
+
+def create_work_queue(
+    backend: str = "sqlite",
+    path: str = "data/dispatch.db",
+    redis=None,
+    lease: float = DEFAULT_LEASE
+) -> WorkQueue:
+    """Build the configured work queue"""
+    if backend == "sqlite":
+        return SQLiteWorkQueue(path, lease=lease)
+    if backend == "redis":
+        if redis is None:
+            raise ValueError("REDIS_HOST is required for the redis work queue")
+        return RedisWorkQueue(redis, lease=lease)
+    raise ValueError(f"Unknown work queue backend: {backend}")
+''')
+
+    create_file("src/jobs/worker.py", '''"""Graph Worker Processes
+
+Each worker claims analyses from the shared work queue, runs the graph and
+publishes its progress events back to the API processes. Workers share the
+job store, checkpoints, the Redis cache tier and the memory-mapped indexes
+with every other process on the host instead of keeping private copies.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+from typing import List, Optional
+from src.runtime import close_runtime, open_runtime, warm_up
+from src.utils.logger import get_logger
+from src.utils.metrics import mark_process_dead
+
+logger = get_logger("jobs.worker")
+
+async def serve_worker():
+    """Run one graph worker until SIGTERM or SIGINT"""
+    runtime = await open_runtime("worker")
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    logger.info("Graph worker %s started (pid %d)", runtime.job_manager.worker_id, os.getpid())
+    await warm_up(runtime)
+    
+    try:
+        await stopped.wait()
+    finally:
+        # Unfinished analyses are released back to the queue for another worker
+        await close_runtime(runtime)
+        mark_process_dead()
+
+def run_worker():
+    """Process target for one graph worker"""
+    asyncio.run(serve_worker())
+
+def start_workers(count: int) -> List[multiprocessing.Process]:
+    """Spawn ``count`` graph worker processes"""
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for number in range(count):
+        process = context.Process(target=run_worker, name=f"pharmaintel-graph-{number}", daemon=False)
+        process.start()
+        processes.append(process)
+    return processes
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = 30.0):
+    """Ask workers to finish and wait for them, killing stragglers"""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        mark_process_dead(process.pid)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m src.jobs.worker", description="Run graph worker processes")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to run (0 for one per CPU)")
+    args = parser.parse_args(argv)
+    
+    count = args.processes or os.cpu_count() or 1
+    if count == 1:
+        run_worker()
+        return
+    processes = start_workers(count)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(processes)
+
+if __name__ == "__main__":
+    main()
+''')
+    
+    # ========================================================================
+    # API
+    # ========================================================================
+    
+    create_file("src/api/__init__.py", "")
+    
+    create_file("src/api/server.py", '''"""FastAPI Server"""
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from src.config.settings import settings
+from src.jobs.manager import JobManager, QueueFullError, ManagerUnavailableError
+from src.jobs.events import get_event_broker
+from src.runtime import close_runtime, open_runtime, warm_up
+from src.utils.metrics import mark_process_dead, render_metrics, update_job_gauges
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Configure process-wide resources"""
+    runtime = await open_runtime("api" if settings.execution_mode == "dispatch" else "local")
+    app.state.runtime = runtime
+    app.state.job_manager = runtime.job_manager
+    # Serve /health straight away; /ready turns 200 once this finishes
+    warming = asyncio.create_task(warm_up(runtime))
+    
+    yield
+    
+    warming.cancel()
+    await close_runtime(runtime)
+    mark_process_dead()
+
+app = FastAPI(
+    title="PharmaIntel API",
+    description="Agentic AI for Pharmaceutical Innovation",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+class AnalysisRequest(BaseModel):
+    query: str
+    options: Optional[Dict[str, Any]] = {}
+
+class AnalysisResponse(BaseModel):
+    analysis_id: str
+    status: str
+    timestamp: str
+
+class BatchAnalysisRequest(BaseModel):
+    items: List[AnalysisRequest] = Field(..., min_length=1, max_length=settings.batch_max_items)
+
+@app.get("/")
+async def root():
+    return {
+        "service": "PharmaIntel API",
+        "version": "1.0.0",
+        "status": "operational"
+    }
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/ready")
+async def readiness_check(request: Request):
+    """Ready for traffic: warmed up and accepting analyses; /health only reports liveness"""
+    runtime = request.app.state.runtime
+    checks = {"warmed_up": runtime.ready, "accepting": runtime.job_manager.accepting}
+    body = {
+        "status": "ready" if all(checks.values()) else "starting",
+        "role": runtime.role,
+        "checks": checks,
+        "warm_up_s": runtime.warm_up_s,
+        "timestamp": datetime.now().isoformat()
+    }
+    if runtime.warm_up_error:
+        body["error"] = runtime.warm_up_error
+    return JSONResponse(body, status_code=200 if all(checks.values()) else 503)
+
+@app.get("/metrics")
+async def metrics(http_request: Request):
+    """Prometheus scrape endpoint"""
+    jobs: JobManager = http_request.app.state.job_manager
+    await jobs.refresh_queue_depth()
+    update_job_gauges(jobs)
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+@app.post("/analyze", response_model=AnalysisResponse)
+async def start_analysis(request: AnalysisRequest, http_request: Request):
+    """Start new analysis"""
+    jobs: JobManager = http_request.app.state.job_manager
+    try:
+        job = await jobs.submit(request.query, request.options)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except ManagerUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return AnalysisResponse(
+        analysis_id=job.analysis_id,
+        status=job.status,
+        timestamp=job.created_at
+    )
+
+@app.post("/analyze/batch")
+async def start_batch_analysis(request: BatchAnalysisRequest, http_request: Request):
+    """Start a portfolio screen: one handle, identical queries deduplicated"""
+    jobs: JobManager = http_request.app.state.job_manager
+    try:
+        batch = await jobs.submit_batch([item.model_dump() for item in request.items])
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except ManagerUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return await jobs.get_batch(batch["batch_id"])
+
+@app.get("/analyze/batch/{batch_id}")
+async def get_batch_analysis(batch_id: str, http_request: Request):
+    """Aggregate status of a batch with per-item status"""
+    batch = await http_request.app.state.job_manager.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@app.get("/analyze/{analysis_id}")
+async def get_analysis(analysis_id: str, http_request: Request):
+    """Get analysis results"""
+    job = await http_request.app.state.job_manager.get(analysis_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return job
+
+@app.delete("/analyze/{analysis_id}")
+async def cancel_analysis(analysis_id: str, http_request: Request):
+    """Cancel a queued or running analysis"""
+    jobs: JobManager = http_request.app.state.job_manager
+    if await jobs.cancel(analysis_id):
+        return {"analysis_id": analysis_id, "status": "cancelling"}
+    
+    job = await jobs.get(analysis_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    raise HTTPException(status_code=409, detail=f"Analysis already {job['status']}")
+
+async def analysis_events(jobs: JobManager, analysis_id: str):
+    """Progress events for one analysis, ending with the final record"""
+    broker = get_event_broker()
+    await jobs.watch(analysis_id)
+    if broker.is_open(analysis_id):
+        subscription = broker.subscribe(analysis_id)
+        try:
+            async for event in subscription:
+                yield event
+        finally:
+            subscription.close()
+        return
+    
+    record = await jobs.get(analysis_id)
+    yield {"type": "end", "analysis_id": analysis_id, "data": record}
+
+@app.get("/analyze/{analysis_id}/events")
+async def stream_analysis(analysis_id: str, http_request: Request):
+    """Server-Sent Events stream of node transitions, agent actions, tokens and report fields"""
+    jobs: JobManager = http_request.app.state.job_manager
+    if await jobs.get(analysis_id) is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    async def sse():
+        async for event in analysis_events(jobs, analysis_id):
+            if event["type"] == "heartbeat":
+                yield ": heartbeat\\n\\n"
+                continue
+            payload = json.dumps(event, separators=(",", ":"), default=str)
+            yield f"id: {event.get('id', 0)}\\nevent: {event['type']}\\ndata: {payload}\\n\\n"
+    
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/analyze/{analysis_id}")
+async def analysis_websocket(websocket: WebSocket, analysis_id: str):
+    """WebSocket stream of the same events as the SSE endpoint"""
+    jobs: JobManager = websocket.app.state.job_manager
+    await websocket.accept()
+    if await jobs.get(analysis_id) is None:
+        await websocket.close(code=4404, reason="Analysis not found")
+        return
+    
+    try:
+        async for event in analysis_events(jobs, analysis_id):
+            await websocket.send_text(json.dumps(event, separators=(",", ":"), default=str))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/analyses")
+async def list_analyses(
+    http_request: Request,
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None
+) -> Dict[str, Any]:
+    """List analyses newest first; pass the last ID as ``before`` to page"""
+    items: List[Dict[str, Any]] = await http_request.app.state.job_manager.list(
+        status=status, limit=limit, before=before
+    )
+    return {
+        "items": items,
+        "next_before": items[-1]["analysis_id"] if len(items) == limit else None
+    }
+''')
+
+    # ========================================================================
+    # GRAPH
+    # ========================================================================
+    
+    create_file("src/graph/__init__.py", "")
+    
+    create_file("src/graph/state.py", '''"""State Definition"""
+from typing import TypedDict, Annotated
+from src.graph.messages import MessageLog, append_messages
+
+def merge_dicts(left: dict, right: dict) -> dict:
+    """Merge per-agent entries written by parallel branches"""
+    merged = dict(left or {})
+    merged.update(right or {})
+    return merged
+
+class PharmaIntelState(TypedDict):
+    """State object for PharmaIntel"""
+    query: str
+    messages: Annotated[MessageLog, append_messages]
+    clinical_findings: dict
+    patent_findings: dict
+    iqvia_findings: dict
+    hypothesis: str
+    innovation_report: dict
+    next_agent: str
+    iteration_count: int
+    confidence_score: float
+    agent_status: Annotated[dict, merge_dicts]
+''')
+
+    create_file("src/graph/workflow.py", '''"""LangGraph Workflow"""
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+from langgraph.graph import StateGraph, END
+from src.graph.checkpoints import resumable
+from src.graph.state import PharmaIntelState
+from src.agents.master_agent import MasterOrchestratorAgent
+from src.agents.clinical_agent import ClinicalTrialsAgent
+from src.agents.patent_agent import PatentLandscapeAgent
+from src.agents.iqvia_agent import IQVIAInsightsAgent
+from src.utils.metrics import instrument_node
+
+DEFAULT_AGENT_TIMEOUT = 120.0
+
+SYNTHESIS_KEYS = ("innovation_report", "hypothesis", "confidence_score")
+
+# Compiled graphs of this process, keyed by build options
+_compiled: Dict[tuple, object] = {}
+_compiled_lock = threading.Lock()
+
+def specialist_node(name: str, handler, output_key: str, timeout: float):
+    """Wrap a specialist so it returns only its own findings, with a timeout"""
+    
+    async def run(state: dict) -> dict:
+        started = time.perf_counter()
+        local = dict(state)
+        try:
+            result = await asyncio.wait_for(handler(local), timeout)
+        except asyncio.TimeoutError:
+            status = {"status": "timeout", "timeout_s": timeout}
+            findings = {}
+        except Exception as e:
+            status = {"status": "failed", "error": str(e)}
+            findings = {}
+        else:
+            status = {"status": "completed"}
+            findings = result.get(output_key, {})
+        
+        status["duration_s"] = round(time.perf_counter() - started, 3)
+        update = {output_key: findings, "agent_status": {name: status}}
+        # Messages the agent logged before it finished, failed or timed out
+        if isinstance(local.get("messages"), list):
+            update["messages"] = local["messages"]
+        return update
+    
+    return run
+
+def state_delta(handler):
+    """Adapt a node that returns the whole state so it returns only what it changed"""
+    
+    async def run(state: dict) -> dict:
+        result = await handler(dict(state))
+        return {key: value for key, value in result.items() if key not in state or state[key] is not value}
+    
+    return run
+
+def _node(name: str, handler):
+    return resumable(name, instrument_node(name, handler))
+
+def create_pharmaintel_graph(
+    parallel: bool = True,
+    agent_timeout: float = DEFAULT_AGENT_TIMEOUT,
+    agent_timeouts: Optional[Dict[str, float]] = None,
+    stream_synthesis: bool = False
+):
+    """Create the PharmaIntel graph
+    
+    In parallel mode the router fans out to every specialist at once and
+    ``synthesize`` joins their findings, so latency tracks the slowest agent.
+    Sequential mode keeps the original router loop. Every node is
+    resumable: a run restored from checkpoints replays the recorded node
+    updates instead of calling the agents again. With ``stream_synthesis``
+    the final report is generated by the model and streamed field by field.
+    """
+    
+    master = MasterOrchestratorAgent(stream_synthesis=stream_synthesis)
+    clinical = ClinicalTrialsAgent()
+    patent = PatentLandscapeAgent()
+    iqvia = IQVIAInsightsAgent()
+    
+    specialists = {
+        "clinical_trials": (clinical.analyze_trials, "clinical_findings"),
+        "patent_landscape": (patent.analyze_patents, "patent_findings"),
+        "iqvia_insights": (iqvia.analyze_market, "iqvia_findings"),
+    }
+    
+    workflow = StateGraph(PharmaIntelState)
+    
+    if parallel:
+        return _build_parallel(workflow, master, specialists, agent_timeout, agent_timeouts or {})
+    
+    workflow.add_node("router", _node("router", state_delta(master.route_query)))
+    for name, (handler, _) in specialists.items():
+        workflow.add_node(name, _node(name, state_delta(handler)))
+    workflow.add_node("synthesize", _node("synthesize", state_delta(master.synthesize_findings)))
+    
+    workflow.set_entry_point("router")
+    
+    def route_next(state):
+        next_agent = state.get("next_agent", "END")
+        return next_agent if next_agent != "synthesize" else "synthesize"
+    
+    workflow.add_conditional_edges(
+        "router",
+        route_next,
+        {
+            "clinical_trials": "clinical_trials",
+            "patent_landscape": "patent_landscape",
+            "iqvia_insights": "iqvia_insights",
+            "synthesize": "synthesize"
+        }
+    )
+    
+    workflow.add_edge("clinical_trials", "router")
+    workflow.add_edge("patent_landscape", "router")
+    workflow.add_edge("iqvia_insights", "router")
+    workflow.add_edge("synthesize", END)
+    
+    return workflow.compile()
+
+def get_compiled_graph(
+    parallel: bool = True,
+    agent_timeout: float = DEFAULT_AGENT_TIMEOUT,
+    agent_timeouts: Optional[Dict[str, float]] = None,
+    stream_synthesis: bool = False
+):
+    """The graph for these options, compiled once per process and reused
+    
+    Agents hold no per-request state and their model clients come from the
+    shared pool, so one compiled graph serves every request a worker runs.
+    """
+    key = (parallel, agent_timeout, tuple(sorted((agent_timeouts or {}).items())), stream_synthesis)
+    graph = _compiled.get(key)
+    if graph is None:
+        with _compiled_lock:
+            graph = _compiled.get(key)
+            if graph is None:
+                graph = _compiled[key] = create_pharmaintel_graph(
+                    parallel, agent_timeout, agent_timeouts, stream_synthesis
+                )
+    return graph
+
+def clear_compiled_graphs():
+    """Drop cached graphs so the next request rebuilds them, e.g. after patching agents"""
+    with _compiled_lock:
+        _compiled.clear()
+
+def _build_parallel(workflow, master, specialists, agent_timeout, agent_timeouts):
+    """Fan out from the router to every specialist and join at synthesize"""
+    
+    async def synthesize(state: dict) -> dict:
+        result = await master.synthesize_findings(dict(state))
+        update = {key: result[key] for key in SYNTHESIS_KEYS}
+        if isinstance(result.get("messages"), list):
+            update["messages"] = result["messages"]
+        return update
+    
+    workflow.add_node("router", _node("router", master.dispatch_agents))
+    for name, (handler, output_key) in specialists.items():
+        timeout = agent_timeouts.get(name, agent_timeout)
+        workflow.add_node(name, resumable(name, specialist_node(name, instrument_node(name, handler), output_key, timeout)))
+    workflow.add_node("synthesize", _node("synthesize", synthesize))
+    
+    workflow.set_entry_point("router")
+    
+    for name in specialists:
+        workflow.add_edge("router", name)
+    workflow.add_edge(list(specialists), "synthesize")
+    workflow.add_edge("synthesize", END)
+    
+    return workflow.compile()
+''')
+
+    create_file("src/graph/checkpoints.py", '''"""Workflow Checkpoints"""
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+# Marks an encoded value JSON has no type for; see encode_update
+TYPE_KEY = "__type__"
+
+def encode_update(update: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-safe copy of a node update, tagging datetimes so replay restores them
+    
+    Any other value JSON cannot hold raises TypeError, rather than being
+    checkpointed as a string that a resumed run would replay in its place.
+    """
+    return _encode(update)
+
+def _encode(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("Checkpointed mappings must have string keys")
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, datetime):
+        return {TYPE_KEY: "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {TYPE_KEY: "date", "value": value.isoformat()}
+    raise TypeError(f"Cannot checkpoint a {type(value).__name__} value")
+
+def decode_update(value: Any) -> Any:
+    """Inverse of ``encode_update``"""
+    if isinstance(value, dict):
+        kind = value.get(TYPE_KEY)
+        if kind == "datetime":
+            return datetime.fromisoformat(value["value"])
+        if kind == "date":
+            return date.fromisoformat(value["value"])
+        return {key: decode_update(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_update(item) for item in value]
+    return value
+
+class CheckpointStore(ABC):
+    """Append-only journal of node updates per analysis
+    
+    Each entry is the partial state one node returned, so a checkpoint write
+    carries only the fields that node changed, never the whole state. Stores
+    keep updates in ``encode_update`` form and load them decoded.
+    """
+    
+    @abstractmethod
+    async def append(self, analysis_id: str, seq: int, node: str, update: Dict[str, Any]):
+        """Record the update a node returned as entry ``seq``"""
+    
+    @abstractmethod
+    async def load(self, analysis_id: str) -> List[Dict[str, Any]]:
+        """Entries in write order, each ``{"seq", "node", "update"}``"""
+    
+    @abstractmethod
+    async def delete(self, analysis_id: str):
+        """Drop an analysis' checkpoints once it has finished"""
+    
+    async def ensure_indexes(self):
+        pass
+    
+    async def close(self):
+        pass
+
+class InMemoryCheckpointStore(CheckpointStore):
+    """Process-local store, for tests and single-run tooling"""
+    
+    def __init__(self):
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+    
+    async def append(self, analysis_id: str, seq: int, node: str, update: Dict[str, Any]):
+        entry = {"seq": seq, "node": node, "update": encode_update(update)}
+        self._entries.setdefault(analysis_id, []).append(entry)
+    
+    async def load(self, analysis_id: str) -> List[Dict[str, Any]]:
+        return [
+            {**entry, "update": decode_update(entry["update"])}
+            for entry in self._entries.get(analysis_id, [])
+        ]
+    
+    async def delete(self, analysis_id: str):
+        self._entries.pop(analysis_id, None)
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Single-file store for local runs
+    
+    Runs in WAL mode with one row per node update; calls go through a worker
+    thread so writes never block the event loop.
+    """
+    
+    def __init__(self, path: str):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Graph worker processes on one host may share the file
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "analysis_id TEXT NOT NULL, seq INTEGER NOT NULL, node TEXT NOT NULL, "
+            "update_json TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (analysis_id, seq)) WITHOUT ROWID"
+        )
+    
+    def _execute(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    async def append(self, analysis_id: str, seq: int, node: str, update: Dict[str, Any]):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+            (analysis_id, seq, node, json.dumps(encode_update(update)), time.time())
+        )
+    
+    async def load(self, analysis_id: str) -> List[Dict[str, Any]]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT seq, node, update_json FROM checkpoints WHERE analysis_id = ? ORDER BY seq",
+            (analysis_id,)
+        )
+        return [{"seq": seq, "node": node, "update": decode_update(json.loads(update))} for seq, node, update in rows]
+    
+    async def delete(self, analysis_id: str):
+        await asyncio.to_thread(self._execute, "DELETE FROM checkpoints WHERE analysis_id = ?", (analysis_id,))
+    
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+class MongoCheckpointStore(CheckpointStore):
+    """MongoDB-backed store; one small document per node update"""
+    
+    def __init__(self, uri: str, database: str = "pharmaintel", collection: str = "checkpoints"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        
+        self.client = AsyncIOMotorClient(uri)
+        self.collection = self.client[database][collection]
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index([("analysis_id", 1), ("seq", 1)], name="analysis_seq")
+    
+    async def append(self, analysis_id: str, seq: int, node: str, update: Dict[str, Any]):
+        document = {"analysis_id": analysis_id, "seq": seq, "node": node, "update": encode_update(update)}
+        await self.collection.replace_one({"_id": f"{analysis_id}:{seq}"}, document, upsert=True)
+    
+    async def load(self, analysis_id: str) -> List[Dict[str, Any]]:
+        cursor = self.collection.find(
+            {"analysis_id": analysis_id},
+            projection={"_id": False, "seq": True, "node": True, "update": True}
+        ).sort("seq", 1)
+        entries = await cursor.to_list(length=None)
+        return [{**entry, "update": decode_update(entry["update"])} for entry in entries]
+    
+    async def delete(self, analysis_id: str):
+        await self.collection.delete_many({"analysis_id": analysis_id})
+    
+    async def close(self):
+        self.client.close()
+
+def create_checkpoint_store(
+    backend: str = "sqlite",
+    path: str = "data/checkpoints.db",
+    mongodb_uri: Optional[str] = None,
+    mongodb_database: str = "pharmaintel"
+) -> Optional[CheckpointStore]:
+    """Build the configured checkpoint store, or None when disabled"""
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return InMemoryCheckpointStore()
+    if backend == "sqlite":
+        return SQLiteCheckpointStore(path)
+    if backend == "mongodb":
+        if not mongodb_uri:
+            raise ValueError("MONGODB_URI is required for the mongodb checkpoint store")
+        return MongoCheckpointStore(mongodb_uri, mongodb_database)
+    raise ValueError(f"Unknown checkpoint store backend: {backend}")
+
+class ReplayJournal:
+    """Checkpointed node updates handed back, in order, on a resumed run"""
+    
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.size = len(entries)
+        self._pending: Dict[str, deque] = defaultdict(deque)
+        self._replayed: Dict[str, int] = defaultdict(int)
+        for entry in entries:
+            self._pending[entry["node"]].append(entry["update"])
+    
+    def take(self, node: str) -> Optional[Dict[str, Any]]:
+        """Next recorded update for ``node``, or None once it must really run"""
+        pending = self._pending.get(node)
+        if not pending:
+            return None
+        self._replayed[node] += 1
+        return pending.popleft()
+    
+    def was_replayed(self, node: str) -> bool:
+        """Consume one replay of ``node``; used to avoid re-recording it"""
+        if self._replayed[node]:
+            self._replayed[node] -= 1
+            return True
+        return False
+
+# Journal of the analysis being resumed in this context, if any
+replay_journal: contextvars.ContextVar[Optional[ReplayJournal]] = contextvars.ContextVar(
+    "replay_journal", default=None
+)
+
+def resumable(name: str, handler):
+    """Wrap a node so a resumed run returns its checkpointed update instead of re-running it"""
+    
+    async def run(state):
+        journal = replay_journal.get()
+        if journal is not None:
+            update = journal.take(name)
+            if update is not None:
+                return update
+        return await handler(state)
+    
+    return run
+''')
+
+    create_file("src/graph/messages.py", '''"""Bounded Message Log"""
+import json
+import os
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+DEFAULT_MAX_ENTRIES = 200
+
+_defaults: Dict[str, Any] = {"max_entries": DEFAULT_MAX_ENTRIES, "spill_dir": None}
+
+def count_by_agent(summary: Dict[str, Any], message: dict) -> Dict[str, Any]:
+    """Default summariser: how many evicted messages each agent wrote"""
+    agent = message.get("agent") or message.get("role") or "unknown"
+    by_agent = summary.setdefault("by_agent", {})
+    by_agent[agent] = by_agent.get(agent, 0) + 1
+    return summary
+
+class _Node:
+    __slots__ = ("message", "prev", "index")
+    
+    def __init__(self, message: dict, prev: Optional["_Node"], index: int):
+        self.message = message
+        self.prev = prev
+        self.index = index
+
+class _History:
+    """Retention settings and evicted-message bookkeeping shared by one run's logs"""
+    
+    def __init__(self, max_entries: int, spill_dir: Optional[str], summarise):
+        self.max_entries = max(1, max_entries)
+        self.spill_dir = spill_dir
+        self.summarise = summarise
+        self.summary: Dict[str, Any] = {}
+        self.evicted = 0
+        self.spill_path: Optional[str] = None
+    
+    def evict(self, nodes: List[_Node]):
+        fresh = [node.message for node in nodes if node.index >= self.evicted]
+        if not fresh:
+            return
+        for message in fresh:
+            self.summary = self.summarise(self.summary, message)
+        self.evicted += len(fresh)
+        if self.spill_dir:
+            if self.spill_path is None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self.spill_path = os.path.join(self.spill_dir, f"messages-{uuid.uuid4().hex}.jsonl")
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(message, default=str) + "\\n" for message in fresh)
+
+class MessageLog:
+    """Persistent message history that keeps only a recent window in memory
+    
+    A log is an immutable view: ``appended`` returns a new log sharing every
+    earlier entry, so appends are O(1) and LangGraph can keep several views
+    of the same run. Once more than ``max_entries`` messages are held, the
+    oldest are cut off in chunks, folded into ``summary`` and, with
+    ``spill_dir`` set, written to a JSON-lines file. Retention defaults come
+    from ``configure_message_log``.
+    """
+    
+    __slots__ = ("_history", "_head", "_cut", "total")
+    
+    def __init__(
+        self,
+        messages: Iterable[dict] = (),
+        max_entries: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        summarise: Callable[[Dict[str, Any], dict], Dict[str, Any]] = count_by_agent
+    ):
+        self._history = _History(
+            max_entries if max_entries is not None else _defaults["max_entries"],
+            spill_dir if spill_dir is not None else _defaults["spill_dir"],
+            summarise
+        )
+        self._head: Optional[_Node] = None
+        self._cut = 0
+        self.total = 0
+        for message in messages:
+            self._push(message)
+    
+    def fresh(self) -> "MessageLog":
+        """An empty log with the same retention settings"""
+        history = self._history
+        return MessageLog(max_entries=history.max_entries, spill_dir=history.spill_dir, summarise=history.summarise)
+    
+    def appended(self, messages: Iterable[dict]) -> "MessageLog":
+        """A new log with ``messages`` added; this one is unchanged"""
+        log = object.__new__(MessageLog)
+        log._history = self._history
+        log._head = self._head
+        log._cut = self._cut
+        log.total = self.total
+        for message in messages:
+            log._push(message)
+        return log
+    
+    def _push(self, message: dict):
+        self._head = _Node(message, self._head, self.total)
+        self.total += 1
+        # Trim once twice the window is held, so each append pays O(1) on average
+        if self.total - self._cut > 2 * self._history.max_entries:
+            self._trim()
+    
+    def _trim(self):
+        kept = []
+        node = self._head
+        while len(kept) < self._history.max_entries:
+            kept.append(node)
+            node = node.prev
+        dropped = []
+        while node is not None:
+            dropped.append(node)
+            node = node.prev
+        # Nodes are shared with earlier views, so the kept window is copied, not cut
+        head = None
+        for node in reversed(kept):
+            head = _Node(node.message, head, node.index)
+        self._head = head
+        self._cut = kept[-1].index
+        self._history.evict(dropped[::-1])
+    
+    @property
+    def summary(self) -> Dict[str, Any]:
+        return self._history.summary
+    
+    @property
+    def evicted(self) -> int:
+        return self._history.evicted
+    
+    def spilled(self) -> Iterator[dict]:
+        """Evicted messages, oldest first, read back from disk"""
+        if self._history.spill_path is None:
+            return
+        with open(self._history.spill_path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+    
+    def to_list(self) -> List[dict]:
+        """The last ``max_entries`` messages, oldest first"""
+        messages = []
+        node = self._head
+        while node is not None and len(messages) < self._history.max_entries:
+            messages.append(node.message)
+            node = node.prev
+        return messages[::-1]
+    
+    def __len__(self) -> int:
+        return min(self.total, self._history.max_entries)
+    
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.to_list())
+    
+    def __getitem__(self, index):
+        return self.to_list()[index]
+    
+    def __bool__(self) -> bool:
+        return self.total > 0
+    
+    def __repr__(self) -> str:
+        return f"MessageLog(held={len(self)}, total={self.total}, evicted={self.evicted})"
+
+def configure_message_log(max_entries: int = DEFAULT_MAX_ENTRIES, spill_dir: Optional[str] = None):
+    """Set the retention window and spill directory for new analyses"""
+    _defaults.update(max_entries=max_entries, spill_dir=spill_dir)
+
+def append_messages(left: Optional[Any], right: Optional[Any]) -> MessageLog:
+    """State reducer: the run's log with new messages appended
+    
+    Unlike ``operator.add`` this never copies the history, so a step's cost
+    stays constant however long the router loop goes on. A node that hands
+    back a view of the run's own log has already appended to it, so that
+    view replaces the log instead of being appended to it.
+    """
+    if isinstance(left, MessageLog):
+        # An empty log may be the graph's shared initial value; each run gets its own history
+        log = left if left.total else left.fresh()
+    else:
+        log = MessageLog(left or ())
+    if right is None:
+        return log
+    if isinstance(right, MessageLog):
+        if right._history is log._history:
+            return right if right.total >= log.total else log
+        right = right.to_list()
+    return log.appended([right] if isinstance(right, dict) else right)
+''')
+
+    # ========================================================================
+    # UTILS
+    # ========================================================================
+    
+    create_file("src/utils/__init__.py", "")
+    
+    create_file("src/utils/logger.py", '''"""Logging Configuration"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime
+from typing import Dict, Optional
+
+ROOT_LOGGER = "pharmaintel"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with structured fields appended"""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + json.dumps(fields, separators=(",", ":"), default=str)
+        return line
+
+class SamplingFilter(logging.Filter):
+    """Keep 1 in N records of high-volume events
+    
+    Records opt in by carrying ``extra={"event": name}``; a rate of 0.1 keeps
+    every tenth record of that event and a rate of 0 drops them all.
+    """
+    
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {event: max(1, round(1 / rate)) for event, rate in rates.items() if rate > 0}
+        self.muted = {event for event, rate in rates.items() if rate <= 0}
+        self.counters: Dict[str, int] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is None or event not in self.every:
+            return event not in self.muted
+        count = self.counters.get(event, 0)
+        self.counters[event] = count + 1
+        return count % self.every[event] == 0
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records as-is so formatting happens on the listener thread"""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def parse_sample_rates(value: Optional[str]) -> Dict[str, float]:
+    """Parse ``event=rate,event=rate`` as used by LOG_SAMPLE_RATES"""
+    rates = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            event, rate = item.split("=", 1)
+            rates[event.strip()] = float(rate)
+    return rates
+
+def setup_logger(
+    name: str = ROOT_LOGGER,
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    stream=None,
+    sample_rates: Optional[Dict[str, float]] = None,
+    force: bool = False
+) -> logging.Logger:
+    """Setup logger
+    
+    Configures the ``pharmaintel`` logger tree once per process: records go
+    through a non-blocking queue handler and are written by a background
+    listener thread. Later calls return the logger without adding handlers.
+    Level, format and sampling default to LOG_LEVEL, LOG_FORMAT and
+    LOG_SAMPLE_RATES.
+    """
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    
+    if _listener is None or force:
+        shutdown_logging()
+        
+        fmt = fmt or os.getenv("LOG_FORMAT", "text")
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        
+        records = queue.SimpleQueue()
+        handler = DeferredQueueHandler(records)
+        if sample_rates is None:
+            sample_rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))
+        if sample_rates:
+            handler.addFilter(SamplingFilter(sample_rates))
+        
+        root.handlers = [handler]
+        root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+        root.propagate = False
+        
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+    
+    return logging.getLogger(name)
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the ``pharmaintel`` tree, configuring it on first use"""
+    if _listener is None:
+        setup_logger()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown_logging)
+''')
+
+    create_file("src/utils/metrics.py", '''"""Prometheus Metrics
+
+With ``PROMETHEUS_MULTIPROC_DIR`` set, as ``python -m src.main serve`` does,
+every API and graph worker process writes its samples to files there and a
+scrape of any API worker aggregates all of them. The variable has to be set
+before this module is first imported.
+"""
+import functools
+import os
+import time
+from typing import Optional
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+NODE_LATENCY = Histogram(
+    "pharmaintel_graph_node_seconds",
+    "Latency of each LangGraph node",
+    ["node", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+ANALYSIS_LATENCY = Histogram(
+    "pharmaintel_analysis_seconds",
+    "End-to-end latency of an analysis job",
+    ["status"],
+    buckets=LATENCY_BUCKETS + (600, 900)
+)
+LLM_LATENCY = Histogram(
+    "pharmaintel_llm_call_seconds",
+    "Latency of LLM calls per agent and model",
+    ["agent", "model"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_CALLS = Counter(
+    "pharmaintel_llm_calls_total",
+    "LLM calls per agent, model and outcome",
+    ["agent", "model", "outcome"]
+)
+LLM_TOKENS = Counter(
+    "pharmaintel_llm_tokens_total",
+    "LLM tokens per agent, model and direction",
+    ["agent", "model", "kind"]
+)
+LLM_COST = Counter(
+    "pharmaintel_llm_cost_usd_total",
+    "Estimated LLM spend in USD per agent and model tier",
+    ["agent", "tier"]
+)
+LLM_ESCALATIONS = Counter(
+    "pharmaintel_llm_escalations_total",
+    "Responses rejected by a validator and retried on a larger tier",
+    ["agent", "from_tier"]
+)
+PROMPT_CONTEXT_TOKENS = Histogram(
+    "pharmaintel_prompt_context_tokens",
+    "Estimated context tokens per prompt after packing",
+    ["agent"],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+)
+PROMPT_TOKENS_SAVED = Counter(
+    "pharmaintel_prompt_tokens_saved_total",
+    "Estimated context tokens removed by compaction, summarising and dropping",
+    ["agent"]
+)
+CACHE_LOOKUPS = Counter(
+    "pharmaintel_cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"]
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "pharmaintel_job_queue_depth",
+    "Analyses waiting for a worker",
+    multiprocess_mode="livemax"
+)
+JOBS_RUNNING = Gauge(
+    "pharmaintel_jobs_running",
+    "Analyses currently executing",
+    multiprocess_mode="livesum"
+)
+JOBS_FINISHED = Counter(
+    "pharmaintel_jobs_finished_total",
+    "Finished analyses by status",
+    ["status"]
+)
+JOBS_REJECTED = Counter(
+    "pharmaintel_jobs_rejected_total",
+    "Analyses refused at admission",
+    ["reason"]
+)
+
+def instrument_node(name: str, handler):
+    """Wrap a graph node so its latency lands in the node histogram"""
+    
+    @functools.wraps(handler)
+    async def run(state):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await handler(state)
+            outcome = "ok"
+            return result
+        finally:
+            NODE_LATENCY.labels(name, outcome).observe(time.perf_counter() - started)
+    
+    return run
+
+def record_llm_call(agent: str, model: str, seconds: float, response=None, outcome: str = "ok"):
+    """Record latency, outcome and token usage of one LLM call"""
+    LLM_CALLS.labels(agent, model, outcome).inc()
+    if outcome != "ok":
+        return
+    LLM_LATENCY.labels(agent, model).observe(seconds)
+    
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        LLM_TOKENS.labels(agent, model, "prompt").inc(getattr(usage, "prompt_token_count", 0) or 0)
+        LLM_TOKENS.labels(agent, model, "completion").inc(getattr(usage, "candidates_token_count", 0) or 0)
+
+def record_llm_cost(agent: str, tier: str, cost: float):
+    LLM_COST.labels(agent, tier).inc(cost)
+
+def record_llm_escalation(agent: str, from_tier: str):
+    LLM_ESCALATIONS.labels(agent, from_tier).inc()
+
+def record_context_packing(agent: str, packed):
+    """Record prompt context size and how much packing saved"""
+    PROMPT_CONTEXT_TOKENS.labels(agent).observe(packed.packed_tokens)
+    PROMPT_TOKENS_SAVED.labels(agent).inc(max(0, packed.saved_tokens))
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+def update_job_gauges(manager):
+    """Record queue depth and running jobs of a job manager
+    
+    Set rather than read on scrape, so graph worker processes, which have no
+    endpoint of their own, still land in the multiprocess files.
+    """
+    JOB_QUEUE_DEPTH.set(manager.queue_depth)
+    JOBS_RUNNING.set(manager.running)
+
+def mark_process_dead(pid: Optional[int] = None):
+    """Drop the live gauges of an exiting process from the multiprocess files"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+def render_metrics():
+    """Exposition payload and content type for the /metrics endpoint"""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=directory)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+''')
+
+    create_file("src/utils/lazy.py", '''"""Deferred Imports
+
+Heavy dependencies (numpy, langgraph, pandas, the Gemini SDK) are only
+needed once a process does real work, not to answer ``/health``. Modules
+bind them with ``lazy_import`` so importing the API costs what it uses.
+"""
+import importlib
+import sys
+import threading
+from types import ModuleType
+
+class LazyModule(ModuleType):
+    """Stand-in that imports the real module on first attribute access
+    
+    After the import its namespace is copied in, so later lookups are plain
+    attribute reads rather than another trip through ``__getattr__``.
+    """
+    
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lock = threading.Lock()
+    
+    def __getattr__(self, attr: str):
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
+        with self._lock:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+    
+    def __repr__(self) -> str:
+        return f"<lazy module {self.__name__!r}>"
+
+def lazy_import(name: str) -> ModuleType:
+    """The module itself when already imported, otherwise a ``LazyModule``"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+''')
+
+    create_file("src/utils/query_terms.py", '''"""Query Vocabulary
+
+Stopwords, question words and abbreviations shared by everything that reads
+meaning out of a free-text query: the semantic cache and the local indexes.
+"""
+import re
+from typing import List
+
+STOPWORDS = frozenset(
+    "a an and are as at be been by did do does for from how in into is it its of on or than that the "
+    "this to vs versus was were what when which why with about".split()
+)
+
+# Question words that do not change which analysis is being asked for
+GENERIC_TERMS = frozenset(
+    "analysis analyse analyze disease disorder effect efficacy evidence fail failure happen "
+    "landscape opportunity outcome potential reason repurpose repurposing result study trial "
+    "clinical explain".split()
+)
+
+ABBREVIATIONS = {
+    "pah": "pulmonary hypertension",
+    "ph": "pulmonary hypertension",
+    "ad": "alzheimer",
+    "ms": "multiple sclerosis",
+    "ipf": "idiopathic pulmonary fibrosis",
+    "nsclc": "lung cancer",
+    "t2d": "type 2 diabetes",
+    "sle": "lupus",
+}
+
+# Qualifiers the canonical phrases above leave out
+QUALIFIERS = frozenset(["arterial", "systemic", "erythematosus"])
+
+SUFFIXES = ("ations", "ation", "ures", "ure", "ings", "ing", "ies", "ed", "es", "s")
+
+def stem(token: str) -> str:
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+# Dose, salt and formulation words that do not change which drug a phrase names
+PHRASE_QUALIFIERS = frozenset(stem(word) for word in (
+    "mg mcg ug ml kg dose oral tablet capsule injection infusion inhaled intravenous "
+    "citrate hydrochloride hcl mesylate sodium potassium"
+).split())
+
+# Words of the conditions abbreviations stand for
+CONDITION_WORDS = frozenset(word for phrase in ABBREVIATIONS.values() for word in phrase.split())
+
+def query_words(query: str) -> List[str]:
+    """Lower-cased words with abbreviations expanded and stopwords and qualifiers dropped"""
+    words = []
+    for token in re.findall(r"[a-z0-9]+", query.lower().replace("'", "")):
+        for word in ABBREVIATIONS.get(token, token).split():
+            if word not in STOPWORDS and word not in QUALIFIERS:
+                words.append(word)
+    return words
+
+def normalise_query(query: str) -> List[str]:
+    """Lower-cased, stemmed content terms with abbreviations expanded"""
+    return [stem(word) for word in query_words(query)]
+''')
+
+    # ========================================================================
+    # CONFIG
+    # ========================================================================
+    
+    create_file("src/config/__init__.py", "")
+    
+    create_file("src/config/settings.py", '''"""Settings Configuration"""
+from typing import Dict, Optional
+from pydantic_settings import BaseSettings
+
+class Settings(BaseSettings):
+    """Application settings"""
+    google_api_key: str
+    model_name: str = "gemini-1.5-pro"
+    api_host: str = "0.0.0.0"
+    api_port: int = 8000
+    # "local" runs analyses in the API process; "dispatch" hands them to graph workers
+    execution_mode: str = "local"
+    api_workers: int = 1
+    graph_workers: int = 0
+    dispatch_backend: str = "sqlite"
+    dispatch_path: str = "data/dispatch.db"
+    dispatch_lease: float = 60.0
+    llm_max_concurrency: int = 64
+    llm_model_concurrency: int = 16
+    llm_thread_workers: int = 32
+    llm_routing_enabled: bool = True
+    llm_fast_model: str = "gemini-1.5-flash-8b"
+    llm_standard_model: str = "gemini-1.5-flash"
+    llm_task_tiers: Dict[str, str] = {}
+    llm_agent_tiers: Dict[str, str] = {}
+    llm_cache_enabled: bool = True
+    llm_cache_ttl: float = 3600.0
+    llm_cache_max_entries: int = 2048
+    llm_cache_max_bytes: int = 64 * 1024 * 1024
+    tool_cache_enabled: bool = True
+    tool_cache_ttls: Dict[str, float] = {}
+    tool_cache_default_ttl: float = 3600.0
+    tool_cache_stale_ttl: float = 0.0
+    tool_cache_max_entries: int = 10000
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.7
+    semantic_cache_max_entries: int = 2000
+    semantic_cache_ttl: float = 86400.0
+    graph_parallel: bool = True
+    synthesis_streaming: bool = True
+    agent_timeout: float = 120.0
+    message_log_max_entries: int = 200
+    message_log_spill_dir: Optional[str] = None
+    job_workers: int = 8
+    job_queue_size: int = 1000
+    batch_max_items: int = 500
+    job_timeout: float = 900.0
+    job_max_retained: int = 5000
+    job_store: str = "memory"
+    job_store_path: str = "data/jobs.db"
+    checkpoint_store: str = "sqlite"
+    checkpoint_path: str = "data/checkpoints.db"
+    job_resume_on_start: bool = True
+    trials_index_path: str = "data/clinical_trials.db"
+    market_data_path: str = "data/market.csv"
+    patent_index_path: str = "data/patents"
+    event_buffer_size: int = 256
+    event_heartbeat_interval: float = 15.0
+    mongodb_uri: Optional[str] = None
+    mongodb_database: str = "pharmaintel"
+    redis_host: Optional[str] = None
+    redis_port: int = 6379
+    redis_db: int = 0
+    
+    class Config:
+        env_file = ".env"
+
+settings = Settings()
+''')
+
+    # ========================================================================
+    # TESTS
+    # ========================================================================
+    
+    create_file("tests/__init__.py", "")
+    
+    create_file("tests/test_agents.py", '''"""Test Agents"""
+import pytest
+from src.agents.master_agent import MasterOrchestratorAgent
+
+@pytest.mark.asyncio
+async def test_master_agent():
+    """Test master agent"""
+    agent = MasterOrchestratorAgent()
+    state = {"query": "test", "iteration_count": 0}
+    result = await agent.route_query(state)
+    assert "next_agent" in result
+''')
+
+    create_file("tests/test_workflow.py", '''"""Test Workflow"""
+import asyncio
+import time
+import pytest
+from src.agents.clinical_agent import ClinicalTrialsAgent
+from src.agents.patent_agent import PatentLandscapeAgent
+from src.agents.iqvia_agent import IQVIAInsightsAgent
+from langgraph.graph import StateGraph, END
+from src.graph.messages import MessageLog, append_messages, configure_message_log
+from src.graph.state import PharmaIntelState
+from src.graph.workflow import create_pharmaintel_graph
+from src.tools.mcp_server import PharmaIntelMCPServer
+
+def slow(method, delay):
+    """Delay an agent method without changing its result"""
+    async def wrapper(self, state):
+        await asyncio.sleep(delay)
+        return await method(self, state)
+    return wrapper
+
+@pytest.fixture
+def slow_agents(monkeypatch):
+    monkeypatch.setattr(ClinicalTrialsAgent, "analyze_trials", slow(ClinicalTrialsAgent.analyze_trials, 0.3))
+    monkeypatch.setattr(PatentLandscapeAgent, "analyze_patents", slow(PatentLandscapeAgent.analyze_patents, 0.3))
+    monkeypatch.setattr(IQVIAInsightsAgent, "analyze_market", slow(IQVIAInsightsAgent.analyze_market, 0.3))
+
+@pytest.mark.asyncio
+async def test_parallel_tracks_slowest_agent(slow_agents):
+    """Specialists run concurrently and join at synthesize"""
+    graph = create_pharmaintel_graph(parallel=True)
+    
+    started = time.perf_counter()
+    result = await graph.ainvoke({"query": "sildenafil"})
+    elapsed = time.perf_counter() - started
+    
+    assert elapsed < 0.8
+    assert result["clinical_findings"]["trials_analyzed"] == 15
+    assert result["patent_findings"]["freedom_to_operate"] == "High"
+    assert result["iqvia_findings"]["tam"] == 2.3e9
+    assert set(result["agent_status"]) == {"clinical_trials", "patent_landscape", "iqvia_insights"}
+    assert "partial" not in result["innovation_report"]
+
+@pytest.mark.asyncio
+async def test_parallel_timeout_returns_partial_report(slow_agents):
+    """A timed-out agent is reported without failing the analysis"""
+    graph = create_pharmaintel_graph(parallel=True, agent_timeouts={"patent_landscape": 0.05})
+    
+    result = await graph.ainvoke({"query": "sildenafil"})
+    
+    assert result["agent_status"]["patent_landscape"]["status"] == "timeout"
+    assert result["patent_findings"] == {}
+    assert result["clinical_findings"]["failure_rate"] == 0.67
+    assert result["innovation_report"]["incomplete_agents"] == ["patent_landscape"]
+
+@pytest.mark.asyncio
+async def test_failed_tool_marks_agent_failed(monkeypatch):
+    """A tool error fails its agent, not the analysis"""
+    async def call_tool(self, tool_name, args):
+        return {"success": False, "error": f"{tool_name} failed: index missing"}
+    
+    monkeypatch.setattr(PharmaIntelMCPServer, "call_tool", call_tool)
+    monkeypatch.setattr("src.agents.clinical_agent.get_trials_index", lambda: object())
+    monkeypatch.setattr("src.agents.iqvia_agent.get_market_data", lambda: object())
+    graph = create_pharmaintel_graph(parallel=True)
+    
+    result = await graph.ainvoke({"query": "sildenafil"})
+    
+    clinical = result["agent_status"]["clinical_trials"]
+    assert (clinical["status"], clinical["error"]) == ("failed", "trial_analytics failed: index missing")
+    assert result["agent_status"]["iqvia_insights"]["status"] == "failed"
+    assert result["agent_status"]["patent_landscape"]["status"] == "completed"
+    assert result["innovation_report"]
+
+@pytest.mark.asyncio
+async def test_sequential_mode():
+    """Sequential mode keeps the router loop"""
+    graph = create_pharmaintel_graph(parallel=False)
+    result = await graph.ainvoke({"query": "sildenafil", "iteration_count": 0})
+    assert result["iteration_count"] == 3
+    assert result["hypothesis"]
+    assert [message["action"] for message in result["messages"]] == [
+        "analyze_trials", "analyze_patents", "analyze_market", "synthesize"
+    ]
+
+@pytest.mark.asyncio
+async def test_agent_messages_are_trimmed_to_the_window(tmp_path):
+    """Every node logs to the run's messages, which keep only the configured window"""
+    configure_message_log(max_entries=2, spill_dir=str(tmp_path))
+    try:
+        result = await create_pharmaintel_graph(parallel=True).ainvoke({"query": "sildenafil"})
+    finally:
+        configure_message_log()
+    
+    log = result["messages"]
+    specialists = {"analyze_trials", "analyze_patents", "analyze_market"}
+    assert log.total == 5
+    assert len(log) == 2
+    assert log[-1]["action"] == "synthesize"
+    assert log.evicted == 3
+    assert [message["action"] for message in log.spilled()][0] == "dispatch"
+    assert {message["action"] for message in [*log.spilled(), log[0]]} == {"dispatch", *specialists}
+
+def test_message_log_keeps_a_bounded_window(tmp_path):
+    log = MessageLog(max_entries=10, spill_dir=str(tmp_path))
+    for i in range(1000):
+        log = append_messages(log, {"agent": "router", "step": i})
+    
+    assert log.total == 1000
+    assert [message["step"] for message in log] == list(range(990, 1000))
+    assert log.evicted >= 980
+    assert log.summary["by_agent"]["router"] == log.evicted
+    assert [message["step"] for message in log.spilled()] == list(range(log.evicted))
+
+def test_message_log_appends_do_not_change_earlier_views():
+    base = MessageLog([{"agent": "user"}], max_entries=5)
+    branch = base.appended([{"agent": "router"}])
+    
+    assert base.to_list() == [{"agent": "user"}]
+    assert branch.to_list() == [{"agent": "user"}, {"agent": "router"}]
+
+def test_message_log_trim_leaves_earlier_views_whole():
+    base = MessageLog([{"step": i} for i in range(8)], max_entries=4)
+    branch = base.appended([{"step": i} for i in range(8, 20)])
+    
+    assert [message["step"] for message in branch] == list(range(16, 20))
+    assert base.total == 8
+    assert [message["step"] for message in base.appended([{"step": 8}])] == list(range(5, 9))
+
+def test_node_returning_whole_state_does_not_duplicate_messages():
+    """Handing back the log a node was given must not append it onto itself"""
+    log = append_messages(None, {"agent": "user"})
+    for step in range(8):
+        log = append_messages(log, log)
+        log = append_messages(log, log.appended([{"agent": "router", "step": step}]))
+    
+    assert log.total == 9
+    assert [message.get("step") for message in log] == [None] + list(range(8))
+
+def test_router_loop_messages_through_graph():
+    """Conditional edges read state on copies; each message must land once"""
+    def router(state):
+        step = state["iteration_count"]
+        return {"messages": [{"agent": "router", "step": step}], "iteration_count": step + 1}
+    
+    workflow = StateGraph(PharmaIntelState)
+    workflow.add_node("router", router)
+    workflow.set_entry_point("router")
+    workflow.add_conditional_edges("router", lambda state: "router" if state["iteration_count"] < 50 else END)
+    graph = workflow.compile()
+    
+    for _ in range(2):
+        result = graph.invoke({"query": "sildenafil", "iteration_count": 0}, config={"recursion_limit": 60})
+        assert result["messages"].total == 50
+        assert result["messages"][-1] == {"agent": "router", "step": 49}
+
+def test_compiled_graph_is_built_once_per_options():
+    from src.graph.workflow import clear_compiled_graphs, get_compiled_graph
+    
+    graph = get_compiled_graph(parallel=True, agent_timeout=30.0)
+    
+    assert get_compiled_graph(parallel=True, agent_timeout=30.0) is graph
+    assert get_compiled_graph(parallel=False, agent_timeout=30.0) is not graph
+    clear_compiled_graphs()
+    assert get_compiled_graph(parallel=True, agent_timeout=30.0) is not graph
+''')
+
+    create_file("tests/test_llm.py", '''"""Test LLM Client"""
+import asyncio
+import time
+from contextlib import aclosing
+import pytest
+from src.agents.base_agent import BaseAgent
+from src.llm.cache import ResponseCache
+from src.llm.client import ConcurrencyLimiter, generate_async, stream_async
+from src.llm.fake import FakeBlockingModel, FakeGenerativeModel, FakeResponse
+
+@pytest.mark.asyncio
+async def test_calls_run_concurrently():
+    """Many in-flight calls cost about one model latency"""
+    model = FakeGenerativeModel(latency=0.2, text="ok")
+    agent = BaseAgent("Test Agent", model_name="fake-model", model=model)
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(agent.agenerate_response("q") for _ in range(30)))
+    
+    assert results == ["ok"] * 30
+    assert time.perf_counter() - started < 1.0
+    assert model.peak_active > 1
+
+@pytest.mark.asyncio
+async def test_model_limit_caps_in_flight_calls():
+    """Per-model cap bounds concurrency even with a larger process cap"""
+    model = FakeGenerativeModel(latency=0.05)
+    limiter = ConcurrencyLimiter(max_concurrency=10, model_limits={"fake-model": 2})
+    
+    await asyncio.gather(*(generate_async(model, "q", "fake-model", limiter=limiter) for _ in range(8)))
+    
+    assert model.peak_active == 2
+
+@pytest.mark.asyncio
+async def test_blocking_client_does_not_stall_loop():
+    """Blocking SDKs run on the thread pool while the loop keeps ticking"""
+    model = FakeBlockingModel(latency=0.3, text="done")
+    ticks = 0
+    
+    async def heartbeat():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+    
+    beat = asyncio.create_task(heartbeat())
+    response = await generate_async(model, "q", "fake-model")
+    beat.cancel()
+    
+    assert response.text == "done"
+    assert ticks > 10
+
+@pytest.mark.asyncio
+async def test_repeat_prompt_served_from_cache(fresh_response_cache):
+    """Identical prompts skip the model on repeat"""
+    model = FakeGenerativeModel(latency=0.2, text="cached answer")
+    agent = BaseAgent("Test Agent", model_name="fake-model", model=model)
+    
+    await agent.agenerate_response("sildenafil in PAH", {"drug": "sildenafil"})
+    started = time.perf_counter()
+    answer = await agent.agenerate_response("sildenafil in PAH", {"drug": "sildenafil"})
+    
+    assert answer == "cached answer"
+    assert time.perf_counter() - started < 0.05
+    assert model.calls == 1
+    assert fresh_response_cache.stats()["hits"] == 1
+
+def test_cache_key_includes_model_and_params():
+    """Different models or parameters never share an entry"""
+    key = ResponseCache.make_key("gemini-1.5-pro", {"temperature": 0.2}, "prompt")
+    assert key == ResponseCache.make_key("gemini-1.5-pro", {"temperature": 0.2}, "prompt")
+    assert key != ResponseCache.make_key("gemini-1.5-flash", {"temperature": 0.2}, "prompt")
+    assert key != ResponseCache.make_key("gemini-1.5-pro", {"temperature": 0.7}, "prompt")
+
+def test_cache_ttl_and_lru_eviction():
+    """Entries expire after their TTL and the least recently used go first"""
+    now = [0.0]
+    cache = ResponseCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    
+    cache.set_local("a", "1")
+    cache.set_local("b", "2")
+    cache.get_local("a")
+    cache.set_local("c", "3")
+    
+    assert cache.get_local("b") is None
+    assert cache.get_local("a") == "1"
+    assert cache.stats()["evictions"] == 1
+    
+    now[0] = 11
+    assert cache.get_local("a") is None
+
+@pytest.mark.asyncio
+async def test_cache_reads_through_to_redis_tier():
+    """A miss in the local tier is filled from the shared tier"""
+    class FakeRedis:
+        def __init__(self):
+            self.data = {}
+        async def get(self, key):
+            return self.data.get(key)
+        async def set(self, key, value, ex=None):
+            self.data[key] = value.encode("utf-8")
+    
+    redis = FakeRedis()
+    await ResponseCache(redis=redis).set("k", "shared")
+    
+    other_worker = ResponseCache(redis=redis)
+    assert await other_worker.get("k") == "shared"
+    assert other_worker.stats()["redis_hits"] == 1
+    assert other_worker.get_local("k") == "shared"
+
+@pytest.mark.asyncio
+async def test_stream_yields_chunks_and_token_events():
+    """Streaming yields chunks as generated and publishes token events"""
+    from src.jobs.events import current_analysis_id, get_event_broker
+    
+    model = FakeGenerativeModel(latency=0.05, text="inhaled sildenafil for PAH")
+    agent = BaseAgent("Test Agent", model_name="fake-model", model=model)
+    broker = get_event_broker()
+    broker.open("analysis_stream")
+    subscription = broker.subscribe("analysis_stream")
+    current_analysis_id.set("analysis_stream")
+    
+    chunks = [chunk async for chunk in agent.astream_response("hypothesis")]
+    broker.close("analysis_stream")
+    tokens = [event async for event in subscription if event["type"] == "token"]
+    
+    assert len(chunks) > 1
+    assert "".join(chunks) == "inhaled sildenafil for PAH"
+    assert [event["data"]["text"] for event in tokens] == chunks
+    assert await agent.agenerate_response("hypothesis") == "inhaled sildenafil for PAH"
+
+class NoTextChunk:
+    """A streamed chunk carrying no text part, e.g. only safety ratings"""
+    
+    @property
+    def text(self):
+        raise ValueError("The response has no text part")
+
+class GappyStreamModel:
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        async def chunks():
+            yield FakeResponse("inhaled ")
+            yield NoTextChunk()
+            yield FakeResponse("sildenafil")
+        return chunks()
+
+@pytest.mark.asyncio
+async def test_stream_skips_textless_chunks_and_frees_its_slot_when_closed():
+    limiter = ConcurrencyLimiter(max_concurrency=1)
+    model = GappyStreamModel()
+    
+    chunks = [chunk async for chunk in stream_async(model, "q", "fake-model", limiter=limiter)]
+    async with aclosing(stream_async(model, "q", "fake-model", limiter=limiter)) as stream:
+        async for chunk in stream:
+            assert limiter.in_flight["fake-model"] == 1
+            break
+    
+    assert chunks == ["inhaled ", "sildenafil"]
+    assert limiter.in_flight["fake-model"] == 0
+
+def test_context_packing_respects_budget_and_relevance():
+    """Over-budget context keeps the findings the task is about"""
+    from src.llm.context import ContextPacker, count_tokens
+    
+    context = {
+        "clinical_findings": {"failure_rate": "67%", "trials": [{"id": i, "notes": "x" * 300} for i in range(40)]},
+        "patent_findings": {"claims": ["claim text " * 50 for _ in range(40)]},
+        "iqvia_findings": {"tam": "$2.3B", "regions": ["region " * 30 for _ in range(40)]}
+    }
+    packed = ContextPacker(budget_tokens=600).pack(context, "Why did clinical trials fail?")
+    
+    assert packed.packed_tokens <= 600
+    assert count_tokens(packed.text) == packed.packed_tokens
+    assert packed.saved_tokens > 0
+    assert "clinical_findings" in packed.text
+    assert "clinical_findings" not in packed.dropped
+
+def test_small_context_is_only_compacted():
+    from src.llm.context import ContextPacker
+    
+    packed = ContextPacker(budget_tokens=600).pack({"drug": "sildenafil", "phase": 3}, "q")
+    assert packed.text == '{"drug":"sildenafil","phase":3}'
+    assert not packed.dropped and not packed.summarised
+
+def test_router_picks_tier_by_task_agent_and_size():
+    """Cheap tasks go to the fast tier until the prompt outgrows it"""
+    from src.llm.router import ModelRouter
+    
+    router = ModelRouter(agent_tiers={"Patent Landscape Agent:extract": "standard"})
+    
+    assert router.select("Clinical Trials Agent", "extract", 500).name == "fast"
+    assert router.select("Clinical Trials Agent", "extract", 20_000).name == "standard"
+    assert router.select("Clinical Trials Agent", "extract", 200_000).name == "flagship"
+    assert router.select("Patent Landscape Agent", "extract", 500).name == "standard"
+    assert router.select("Master Orchestrator", "synthesize", 10).name == "flagship"
+    assert router.select("Master Orchestrator", "unknown task", 10).name == "standard"
+
+@pytest.mark.asyncio
+async def test_low_confidence_escalates_to_larger_tier():
+    """A rejected answer is retried one tier up, and each tier's spend is tracked"""
+    from src.llm.router import ModelRouter, configure_model_router, confidence_at_least
+    
+    answers = {
+        "gemini-1.5-flash-8b": '{"confidence_score": 0.4}',
+        "gemini-1.5-flash": '{"confidence_score": 0.9}',
+    }
+    models = {}
+    
+    def factory(model_name):
+        models[model_name] = FakeGenerativeModel(latency=0.01, text=answers.get(model_name, "{}"))
+        return models[model_name]
+    
+    router = ModelRouter(model_factory=factory)
+    configure_model_router(router)
+    agent = BaseAgent("Test Agent")
+    
+    answer = await agent.agenerate_response("classify", task="classify", validate=confidence_at_least(0.7))
+    stats = router.stats()
+    
+    assert answer == answers["gemini-1.5-flash"]
+    assert set(models) == {"gemini-1.5-flash-8b", "gemini-1.5-flash"}
+    assert stats["fast"]["calls"] == 1 and stats["fast"]["escalations"] == 1
+    assert stats["standard"]["calls"] == 1 and stats["standard"]["escalations"] == 0
+    assert stats["flagship"]["calls"] == 0
+    assert 0 < stats["fast"]["cost_usd"] < stats["standard"]["cost_usd"]
+
+def test_model_pool_shares_clients_across_agents():
+    """Agents and the router reuse one client per model and configuration"""
+    from src.llm.pool import ModelPool, configure_model_pool
+    from src.llm.router import ModelRouter
+    
+    built = []
+    pool = ModelPool(lambda name, **config: built.append((name, config)) or FakeGenerativeModel())
+    configure_model_pool(pool)
+    
+    first = BaseAgent("First Agent", model_name="gemini-1.5-pro")
+    second = BaseAgent("Second Agent", model_name="gemini-1.5-pro")
+    router = ModelRouter()
+    
+    assert first.model is second.model
+    assert router.model_for(router.tier("flagship")) is first.model
+    assert pool.get("gemini-1.5-pro", system_instruction="terse") is not first.model
+    assert built == [("gemini-1.5-pro", {}), ("gemini-1.5-pro", {"system_instruction": "terse"})]
+
+def test_streaming_parser_handles_any_chunking():
+    """Fields decode the same however the response is split"""
+    import json
+    from src.llm.streaming import StreamingJSONParser
+    
+    report = {"hypothesis": "Inhaled \\"sildenafil\\"\\nfor PAH ✓", "evidence": [{"id": "}]"}], "confidence_score": 87}
+    text = "```json\\n" + json.dumps(report, indent=2) + "\\n```"
+    for size in (1, 3, 7, len(text)):
+        parser = StreamingJSONParser()
+        deltas = []
+        for i in range(0, len(text), size):
+            deltas += [update.delta for update in parser.feed(text[i:i + size]) if update.field == "hypothesis" and not update.done]
+        assert parser.result == report
+        assert "".join(deltas) == report["hypothesis"]
+
+@pytest.mark.asyncio
+async def test_synthesis_streams_report_fields():
+    """The hypothesis reaches subscribers before the response is complete"""
+    from src.agents.master_agent import MasterOrchestratorAgent
+    from src.jobs.events import current_analysis_id, get_event_broker
+    from src.llm.pool import ModelPool, configure_model_pool
+    
+    text = '{"hypothesis": "Inhaled sildenafil for PAH", "rationale": "Local delivery", "confidence_score": 81}'
+    configure_model_pool(ModelPool(lambda name, **config: FakeGenerativeModel(latency=0.1, text=text)))
+    broker = get_event_broker()
+    broker.open("analysis_synthesis")
+    subscription = broker.subscribe("analysis_synthesis")
+    current_analysis_id.set("analysis_synthesis")
+    
+    agent = MasterOrchestratorAgent(stream_synthesis=True)
+    state = await agent.synthesize_findings({"query": "sildenafil", "iteration_count": 3})
+    broker.close("analysis_synthesis")
+    fields = [event["data"] async for event in subscription if event["type"] == "field"]
+    
+    assert state["innovation_report"] == {"hypothesis": "Inhaled sildenafil for PAH", "rationale": "Local delivery", "confidence_score": 81}
+    assert state["confidence_score"] == 81
+    hypothesis = [field for field in fields if field["field"] == "hypothesis"]
+    assert len(hypothesis) > 2 and hypothesis[-1] == {"agent": "Master Orchestrator", "field": "hypothesis", "value": "Inhaled sildenafil for PAH", "done": True}
+    assert fields.index(hypothesis[-1]) < fields.index(next(field for field in fields if field["field"] == "confidence_score"))
+
+@pytest.mark.asyncio
+async def test_unstreamed_synthesis_asks_the_model():
+    """Without streaming the report still comes from the model, in one response"""
+    from src.agents.master_agent import MasterOrchestratorAgent
+    from src.llm.pool import ModelPool, configure_model_pool
+    
+    text = '```json\\n{"hypothesis": "Metformin for glioblastoma", "rationale": "AMPK", "confidence_score": 64}\\n```'
+    model = FakeGenerativeModel(text=text)
+    configure_model_pool(ModelPool(lambda name, **config: model))
+    
+    state = await MasterOrchestratorAgent(stream_synthesis=False).synthesize_findings({"query": "metformin", "iteration_count": 3})
+    assert state["innovation_report"] == {"hypothesis": "Metformin for glioblastoma", "rationale": "AMPK", "confidence_score": 64}
+    assert model.calls == 1
+''')
+
+    create_file("tests/conftest.py", '''"""Shared Test Fixtures"""
+import json
+import os
+import pytest
+
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("CHECKPOINT_STORE", "memory")
+
+from src.graph.workflow import clear_compiled_graphs
+from src.llm.cache import ResponseCache, configure_response_cache
+from src.llm.fake import FakeGenerativeModel
+from src.llm.pool import ModelPool, configure_model_pool
+from src.llm.router import configure_model_router
+from src.tools.cache import ToolResultCache, configure_tool_cache
+
+@pytest.fixture(autouse=True)
+def fresh_response_cache():
+    """Give every test an empty LLM response cache"""
+    cache = ResponseCache()
+    configure_response_cache(cache)
+    yield cache
+    configure_response_cache(ResponseCache())
+
+@pytest.fixture(autouse=True)
+def fresh_tool_cache():
+    """Give every test an empty tool result cache"""
+    cache = ToolResultCache()
+    configure_tool_cache(cache)
+    yield cache
+    configure_tool_cache(ToolResultCache())
+
+@pytest.fixture(autouse=True)
+def no_model_router():
+    """Unrouted agents unless a test installs its own router"""
+    configure_model_router(None)
+    yield
+    configure_model_router(None)
+
+# What the synthesis model answers unless a test installs its own pool
+SYNTHESIS_REPORT = json.dumps({
+    "hypothesis": "Develop inhaled sildenafil for pulmonary hypertension",
+    "rationale": "Overcomes oral side effects via local delivery",
+    "confidence_score": 87
+})
+
+@pytest.fixture(autouse=True)
+def fresh_model_pool():
+    """Fake model clients; no clients or compiled graphs carried over between tests"""
+    configure_model_pool(ModelPool(lambda name, **config: FakeGenerativeModel(name, text=SYNTHESIS_REPORT)))
+    clear_compiled_graphs()
+    yield
+    configure_model_pool()
+    clear_compiled_graphs()
+''')
+
+    create_file("tests/test_api.py", '''"""Test API"""
+import os
+import subprocess
+import sys
+import time
+from fastapi.testclient import TestClient
+from src.api.server import app
+
+def test_analysis_lifecycle():
+    """POST /analyze runs the graph in the background"""
+    with TestClient(app) as client:
+        response = client.post("/analyze", json={"query": "oral sildenafil failures"})
+        assert response.status_code == 200
+        analysis_id = response.json()["analysis_id"]
+        
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            result = client.get(f"/analyze/{analysis_id}").json()
+            if result["status"] == "completed":
+                break
+            time.sleep(0.05)
+        
+        assert result["status"] == "completed"
+        assert result["hypothesis"]
+        assert result["confidence_score"] == 87
+        assert client.delete(f"/analyze/{analysis_id}").status_code == 409
+
+def test_event_stream_ends_with_result():
+    """The SSE stream pushes progress and closes with the final record"""
+    with TestClient(app) as client:
+        analysis_id = client.post("/analyze", json={"query": "sildenafil"}).json()["analysis_id"]
+        
+        with client.stream("GET", f"/analyze/{analysis_id}/events") as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = "".join(response.iter_text())
+        
+        assert "event: end" in body
+        assert '"status":"completed"' in body
+        # Synthesis streams by default, so the hypothesis arrives field by field
+        assert "event: field" in body
+        assert '"field":"hypothesis","delta"' in body
+
+def test_batch_endpoint():
+    with TestClient(app) as client:
+        response = client.post("/analyze/batch", json={"items": [
+            {"query": "sildenafil PAH"},
+            {"query": "tadalafil PAH"},
+            {"query": "sildenafil  pah"}
+        ]})
+        assert response.status_code == 200
+        batch = response.json()
+        assert batch["unique_items"] == 2
+        assert len(batch["items"]) == 3
+        
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            batch = client.get(f"/analyze/batch/{batch['batch_id']}").json()
+            if batch["status"] == "completed":
+                break
+            time.sleep(0.05)
+        assert [item["status"] for item in batch["items"]] == ["completed"] * 3
+
+def test_list_analyses():
+    with TestClient(app) as client:
+        first = client.post("/analyze", json={"query": "first"}).json()["analysis_id"]
+        second = client.post("/analyze", json={"query": "second"}).json()["analysis_id"]
+        
+        items = client.get("/analyses", params={"limit": 2}).json()["items"]
+        assert [item["analysis_id"] for item in items] == [second, first]
+
+def test_unknown_analysis_is_404():
+    with TestClient(app) as client:
+        assert client.get("/analyze/missing").status_code == 404
+
+def test_metrics_endpoint_reports_node_latency():
+    with TestClient(app) as client:
+        analysis_id = client.post("/analyze", json={"query": "sildenafil"}).json()["analysis_id"]
+        with client.stream("GET", f"/analyze/{analysis_id}/events") as response:
+            "".join(response.iter_text())
+        
+        body = client.get("/metrics").text
+        for node in ("router", "clinical_trials", "patent_landscape", "iqvia_insights", "synthesize"):
+            assert f'pharmaintel_graph_node_seconds_count{{node="{node}",outcome="ok"}}' in body
+        assert "pharmaintel_job_queue_depth" in body
+        assert 'pharmaintel_jobs_finished_total{status="completed"}' in body
+
+def test_metrics_aggregate_every_process(tmp_path):
+    """One scrape sees what graph workers recorded; exited processes' live gauges drop out"""
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    
+    def run(code: str) -> str:
+        return subprocess.run(
+            [sys.executable, "-c", "from src.utils import metrics; " + code],
+            cwd=root, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    
+    run("metrics.record_cache_lookup('tool', True); metrics.JOBS_RUNNING.set(2)")
+    run("metrics.record_cache_lookup('tool', True); metrics.JOBS_RUNNING.set(1); metrics.mark_process_dead()")
+    body = run("print(metrics.render_metrics()[0].decode())")
+    assert 'pharmaintel_cache_lookups_total{cache="tool",result="hit"} 2.0' in body
+    assert "pharmaintel_jobs_running 2.0" in body
+
+def test_ready_after_warm_up_while_health_is_immediate():
+    """/health is liveness only; /ready waits for the graph to be compiled"""
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+        
+        deadline = time.time() + 5
+        response = client.get("/ready")
+        while response.status_code != 200 and time.time() < deadline:
+            assert response.json()["status"] == "starting"
+            time.sleep(0.05)
+            response = client.get("/ready")
+        
+        body = response.json()
+        assert body["status"] == "ready"
+        assert body["checks"] == {"warmed_up": True, "accepting": True}
+        assert body["warm_up_s"] is not None
+
+''')
+
+    create_file("tests/test_jobs.py", '''"""Test Analysis Jobs"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import pytest
+from src.jobs.ids import new_analysis_id, ulid_timestamp
+from src.jobs.manager import JobManager, QueueFullError, ManagerUnavailableError
+from src.jobs.store import InMemoryJobStore
+from src.jobs.events import EventBroker, get_event_broker
+from src.graph.checkpoints import InMemoryCheckpointStore, SQLiteCheckpointStore
+
+class SlowGraph:
+    """Stand-in for the compiled graph"""
+    
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.started = []
+    
+    async def astream(self, state, stream_mode=("updates", "values")):
+        self.started.append(state["query"])
+        yield "values", state
+        await asyncio.sleep(self.delay)
+        update = {"hypothesis": f"Hypothesis for {state['query']}", "confidence_score": 80}
+        yield "updates", {"synthesize": update}
+        yield "values", {**state, **update}
+
+async def wait_finished(job, timeout=2.0):
+    async with asyncio.timeout(timeout):
+        while not job.finished:
+            await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_job_runs_to_completion():
+    manager = JobManager(lambda: SlowGraph(), max_workers=2)
+    await manager.start()
+    
+    job = await manager.submit("sildenafil")
+    await wait_finished(job)
+    
+    record = await manager.get(job.analysis_id)
+    assert record["status"] == "completed"
+    assert record["hypothesis"] == "Hypothesis for sildenafil"
+    assert job.analysis_id not in manager.active
+    await manager.stop()
+
+@pytest.mark.asyncio
+async def test_saturated_queue_rejects_work():
+    """Admission is bounded by workers plus queue size"""
+    manager = JobManager(lambda: SlowGraph(delay=1.0), max_workers=1, max_queue=1)
+    await manager.start()
+    
+    await manager.submit("first")
+    await asyncio.sleep(0.05)
+    await manager.submit("second")
+    with pytest.raises(QueueFullError):
+        await manager.submit("third")
+    
+    await manager.stop()
+    with pytest.raises(ManagerUnavailableError):
+        await manager.submit("fourth")
+
+@pytest.mark.asyncio
+async def test_cancel_running_and_queued_jobs():
+    manager = JobManager(lambda: SlowGraph(delay=1.0), max_workers=1, max_queue=5)
+    await manager.start()
+    
+    running = await manager.submit("running")
+    queued = await manager.submit("queued")
+    await asyncio.sleep(0.05)
+    
+    assert await manager.cancel(queued.analysis_id)
+    assert await manager.cancel(running.analysis_id)
+    await wait_finished(running)
+    
+    assert running.status == "cancelled"
+    assert queued.status == "cancelled"
+    assert not await manager.cancel(running.analysis_id)
+    await manager.stop()
+
+def test_analysis_ids_are_unique_and_sortable():
+    """IDs minted in a tight loop never collide and sort by creation"""
+    ids = [new_analysis_id() for _ in range(10000)]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert abs(ulid_timestamp(ids[0]) - time.time()) < 5
+
+@pytest.mark.asyncio
+async def test_store_lists_by_status_newest_first():
+    store = InMemoryJobStore()
+    ids = [new_analysis_id() for _ in range(6)]
+    for i, analysis_id in enumerate(ids):
+        await store.save({"analysis_id": analysis_id, "status": "queued"})
+        if i % 2:
+            await store.save({"analysis_id": analysis_id, "status": "completed"})
+    
+    completed = await store.list(status="completed")
+    assert [r["analysis_id"] for r in completed] == [ids[5], ids[3], ids[1]]
+    assert [r["analysis_id"] for r in await store.list(status="queued", limit=2)] == [ids[4], ids[2]]
+    
+    page = await store.list(limit=2, before=ids[4])
+    assert [r["analysis_id"] for r in page] == [ids[3], ids[2]]
+
+@pytest.mark.asyncio
+async def test_store_drops_oldest_beyond_cap():
+    store = InMemoryJobStore(max_records=10)
+    ids = [new_analysis_id() for _ in range(12)]
+    for analysis_id in ids:
+        await store.save({"analysis_id": analysis_id, "status": "completed"})
+    
+    assert await store.get(ids[0]) is None
+    assert await store.get(ids[-1]) is not None
+    assert len(await store.list(status="completed", limit=100)) == 10
+
+@pytest.mark.asyncio
+async def test_store_indexes_survive_churn_and_out_of_order_ids():
+    """Status moves tombstone old index entries; late IDs are sorted on read"""
+    store = InMemoryJobStore()
+    ids = [new_analysis_id() for _ in range(200)]
+    for analysis_id in ids[1:]:
+        for status in ("queued", "running", "completed"):
+            await store.save({"analysis_id": analysis_id, "status": status})
+    await store.save({"analysis_id": ids[0], "status": "queued"})
+    await store.save({"analysis_id": ids[1], "status": "queued"})
+    
+    assert [r["analysis_id"] for r in await store.list(status="queued")] == [ids[1], ids[0]]
+    assert await store.list(status="running") == []
+    completed = await store.list(status="completed", limit=3, before=ids[100])
+    assert [r["analysis_id"] for r in completed] == [ids[99], ids[98], ids[97]]
+    assert (await store.list(limit=200))[-1]["analysis_id"] == ids[0]
+
+@pytest.mark.asyncio
+async def test_progress_events_stream_until_end():
+    manager = JobManager(lambda: SlowGraph(delay=0.05), max_workers=1)
+    await manager.start()
+    
+    job = await manager.submit("sildenafil")
+    events = [event async for event in get_event_broker().subscribe(job.analysis_id)]
+    
+    assert [event["type"] for event in events] == ["status", "node", "end"]
+    assert events[1]["data"]["node"] == "synthesize"
+    assert events[-1]["data"]["status"] == "completed"
+    assert get_event_broker().subscriber_count(job.analysis_id) == 0
+    await manager.stop()
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_buffer_is_bounded():
+    broker = EventBroker(buffer_size=3, heartbeat_interval=0.01)
+    broker.open("a")
+    subscription = broker.subscribe("a")
+    for i in range(10):
+        broker.publish("a", "token", {"i": i})
+    
+    received = [await subscription.__anext__() for _ in range(3)]
+    assert [event["data"]["i"] for event in received] == [7, 8, 9]
+    assert subscription.dropped == 7
+    assert (await subscription.__anext__())["type"] == "heartbeat"
+
+@pytest.mark.asyncio
+async def test_batch_dedupes_and_shares_workers_fairly():
+    """Identical queries run once and single requests are not starved"""
+    graph = SlowGraph(delay=0.02)
+    manager = JobManager(lambda: graph, max_workers=1, max_queue=20)
+    await manager.start()
+    
+    batch = await manager.submit_batch(
+        [{"query": f"compound {i}"} for i in range(5)] + [{"query": "Compound  0"}]
+    )
+    single = await manager.submit("interactive question")
+    
+    assert batch["unique_items"] == 5
+    assert batch["items"][5]["duplicate"]
+    assert batch["items"][5]["analysis_id"] == batch["items"][0]["analysis_id"]
+    
+    await wait_finished(single)
+    assert graph.started.index("interactive question") <= 2
+    
+    async with asyncio.timeout(2):
+        while (await manager.get_batch(batch["batch_id"]))["status"] != "completed":
+            await asyncio.sleep(0.01)
+    result = await manager.get_batch(batch["batch_id"])
+    assert result["counts"] == {"completed": 5}
+    assert all(item["hypothesis"] for item in result["items"])
+    await manager.stop()
+
+@pytest.mark.asyncio
+async def test_batch_jobs_share_tool_results():
+    """Analyses in one batch reuse each other's tool calls"""
+    from src.tools.mcp_server import PharmaIntelMCPServer, shared_tool_results
+    
+    server = PharmaIntelMCPServer()
+    calls = []
+    
+    async def execute(tool_name, args):
+        calls.append(args)
+        await asyncio.sleep(0.01)
+        return {"drug": args["drug"]}
+    
+    server._execute = execute
+    shared_tool_results.set({})
+    results = await asyncio.gather(*(server.call_tool("drugbank", {"drug": "sildenafil"}) for _ in range(3)))
+    
+    assert results == [{"drug": "sildenafil"}] * 3
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_oversized_batch_is_rejected_whole():
+    manager = JobManager(lambda: SlowGraph(), max_workers=1, max_queue=3)
+    await manager.start()
+    with pytest.raises(QueueFullError):
+        await manager.submit_batch([{"query": f"compound {i}"} for i in range(5)])
+    assert manager.queue_depth == 0
+    await manager.stop()
+
+@pytest.mark.asyncio
+async def test_sqlite_checkpoints_hold_node_updates(tmp_path):
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+    await store.append("analysis_1", 0, "router", {"next_agent": "parallel"})
+    await store.append("analysis_1", 1, "clinical_trials", {"clinical_findings": {"trials": 15}})
+    await store.append("analysis_2", 0, "router", {"next_agent": "parallel"})
+    
+    entries = await store.load("analysis_1")
+    assert [entry["node"] for entry in entries] == ["router", "clinical_trials"]
+    assert entries[1]["update"] == {"clinical_findings": {"trials": 15}}
+    
+    await store.delete("analysis_1")
+    assert await store.load("analysis_1") == []
+    assert len(await store.load("analysis_2")) == 1
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_checkpoints_restore_datetimes_and_reject_other_objects(tmp_path):
+    from datetime import datetime
+    from src.graph.messages import MessageLog
+    
+    started = datetime(2024, 5, 1, 12, 30)
+    for store in (InMemoryCheckpointStore(), SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))):
+        await store.append("analysis_1", 0, "router", {"started": started, "steps": [{"at": started}]})
+        with pytest.raises(TypeError):
+            await store.append("analysis_1", 1, "router", {"messages": MessageLog([{"agent": "router"}])})
+        
+        [entry] = await store.load("analysis_1")
+        assert entry["update"] == {"started": started, "steps": [{"at": started}]}
+        await store.close()
+
+@pytest.mark.asyncio
+async def test_interrupted_job_resumes_from_checkpoints(monkeypatch):
+    """A restarted manager replays finished nodes and runs only the rest"""
+    from src.agents.clinical_agent import ClinicalTrialsAgent
+    from src.agents.patent_agent import PatentLandscapeAgent
+    from src.graph.workflow import create_pharmaintel_graph
+    
+    calls = {"clinical": 0, "patent": 0}
+    analyze_trials = ClinicalTrialsAgent.analyze_trials
+    analyze_patents = PatentLandscapeAgent.analyze_patents
+    
+    async def counted_trials(self, state):
+        calls["clinical"] += 1
+        return await analyze_trials(self, state)
+    
+    async def stalled_patents(self, state):
+        calls["patent"] += 1
+        await asyncio.sleep(10)
+    
+    monkeypatch.setattr(ClinicalTrialsAgent, "analyze_trials", counted_trials)
+    monkeypatch.setattr(PatentLandscapeAgent, "analyze_patents", stalled_patents)
+    store = InMemoryJobStore()
+    checkpoints = InMemoryCheckpointStore()
+    
+    manager = JobManager(create_pharmaintel_graph, max_workers=1, store=store, checkpoints=checkpoints)
+    await manager.start()
+    job = await manager.submit("sildenafil")
+    async with asyncio.timeout(2):
+        while len(await checkpoints.load(job.analysis_id)) < 3:
+            await asyncio.sleep(0.01)
+    await manager.stop()
+    assert (await store.get(job.analysis_id))["status"] == "interrupted"
+    
+    async def quick_patents(self, state):
+        calls["patent"] += 1
+        return await analyze_patents(self, state)
+    
+    monkeypatch.setattr(PatentLandscapeAgent, "analyze_patents", quick_patents)
+    resumed = JobManager(create_pharmaintel_graph, max_workers=1, store=store, checkpoints=checkpoints)
+    await resumed.start()
+    await wait_finished(resumed.active[job.analysis_id])
+    
+    record = await store.get(job.analysis_id)
+    assert record["status"] == "completed"
+    assert set(record["agent_status"]) == {"clinical_trials", "patent_landscape", "iqvia_insights"}
+    assert calls == {"clinical": 1, "patent": 2}
+    assert await checkpoints.load(job.analysis_id) == []
+    await resumed.stop()
+
+def test_semantic_cache_matches_paraphrases_not_other_drugs():
+    from src.jobs.semantic_cache import SemanticCache
+    
+    now = [0.0]
+    cache = SemanticCache(max_entries=2, ttl=60, clock=lambda: now[0])
+    cache.store("oral sildenafil failures in PAH", {}, "analysis_1", {"hypothesis": "sildenafil"})
+    
+    hit = cache.lookup("why did oral sildenafil fail for pulmonary hypertension")
+    assert hit["analysis_id"] == "analysis_1" and hit["similarity"] >= cache.threshold
+    assert cache.lookup("oral tadalafil failures in PAH") is None
+    assert cache.lookup("oral sildenafil failures in PAH", {"depth": "full"}) is None
+    
+    now[0] = 1.0
+    cache.store("metformin glioblastoma", {}, "analysis_2", {})
+    now[0] = 2.0
+    cache.lookup("metformin for glioblastoma")
+    cache.store("rapamycin lupus", {}, "analysis_3", {})
+    assert cache.lookup("oral sildenafil failures in PAH") is None
+    assert cache.lookup("metformin glioblastoma")["analysis_id"] == "analysis_2"
+    assert cache.stats()["evictions"] == 1
+    
+    now[0] = 100.0
+    assert cache.lookup("metformin glioblastoma") is None
+
+@pytest.mark.asyncio
+async def test_semantic_cache_shares_entries_through_redis():
+    """Relaying processes write an analysis once; a new process loads it on warm-up"""
+    from src.jobs.semantic_cache import SemanticCache
+    
+    class FakeRedis:
+        def __init__(self):
+            self.data, self.order = {}, {}
+        async def set(self, key, value, ex=None, nx=False):
+            if nx and key in self.data:
+                return None
+            self.data[key] = value.encode("utf-8")
+            return True
+        async def mget(self, keys):
+            return [self.data.get(key) for key in keys]
+        async def zadd(self, key, mapping):
+            self.order.update(mapping)
+        async def zremrangebyscore(self, key, low, high):
+            self.order = {member: score for member, score in self.order.items() if score > high}
+        async def zremrangebyrank(self, key, start, stop):
+            ranked = sorted(self.order, key=self.order.get)
+            for member in ranked[start:len(ranked) + stop + 1]:
+                del self.order[member]
+        async def zrevrangebyscore(self, key, high, low, start, num, withscores):
+            newest = sorted(self.order.items(), key=lambda item: -item[1])
+            return [(member.encode("utf-8"), score) for member, score in newest if low <= score <= high][start:start + num]
+    
+    redis = FakeRedis()
+    relays = [SemanticCache(redis=redis), SemanticCache(redis=redis)]
+    for relay in relays:
+        await relay.share("oral sildenafil failures in PAH", {}, "analysis_1", {"hypothesis": "sildenafil"})
+        await relay.share("metformin glioblastoma", {}, "analysis_2", {"hypothesis": "metformin"})
+    assert len(redis.data) == 2 and list(redis.order) == ["analysis_1", "analysis_2"]
+    
+    started = SemanticCache(redis=redis, max_entries=1)
+    assert await started.load() == 1
+    assert started.lookup("metformin for glioblastoma")["result"] == {"hypothesis": "metformin"}
+    assert started.lookup("oral sildenafil failures in PAH") is None
+    assert started.stats()["redis_errors"] == 0
+
+@pytest.mark.asyncio
+async def test_similar_query_served_from_semantic_cache():
+    """A paraphrase completes at submission without running the graph"""
+    from src.jobs.semantic_cache import SemanticCache
+    
+    graph = SlowGraph()
+    manager = JobManager(lambda: graph, max_workers=1, semantic_cache=SemanticCache())
+    await manager.start()
+    
+    first = await manager.submit("Sildenafil in pulmonary arterial hypertension")
+    await wait_finished(first)
+    second = await manager.submit("sildenafil PAH")
+    bypass = await manager.submit("sildenafil PAH", {"cache": False})
+    await wait_finished(bypass)
+    
+    record = await manager.get(second.analysis_id)
+    assert record["status"] == "completed"
+    assert record["hypothesis"] == "Hypothesis for Sildenafil in pulmonary arterial hypertension"
+    assert record["cached"]["analysis_id"] == first.analysis_id
+    assert graph.started == ["Sildenafil in pulmonary arterial hypertension", "sildenafil PAH"]
+    await manager.stop()
+
+@pytest.mark.asyncio
+async def test_worker_claims_no_more_than_its_queue_holds(tmp_path):
+    """A local queue smaller than the worker pool throttles claims instead of failing them"""
+    from src.jobs.dispatch import SQLiteWorkQueue
+    
+    queue = SQLiteWorkQueue(str(tmp_path / "dispatch.db"), lease=3.0)
+    await queue.start()
+    await queue.put([
+        {"analysis_id": new_analysis_id(), "query": f"drug {i}", "created_at": "2024-01-01T00:00:00"}
+        for i in range(6)
+    ])
+    store = InMemoryJobStore()
+    manager = JobManager(lambda: SlowGraph(delay=0.05), max_workers=4, max_queue=1, store=store, dispatcher=queue)
+    await manager.start()
+    try:
+        async with asyncio.timeout(10):
+            while await queue.depth():
+                await asyncio.sleep(0.05)
+        assert len(await store.list(status="completed")) == 6
+    finally:
+        await manager.stop()
+        await queue.close()
+
+async def serve_dispatch_worker(directory: str):
+    """Graph worker process for the dispatch test, stopped by closing stdin"""
+    from src.jobs.dispatch import SQLiteWorkQueue
+    from src.jobs.events import configure_event_broker
+    from src.jobs.store import SQLiteJobStore
+    
+    queue = SQLiteWorkQueue(os.path.join(directory, "dispatch.db"), lease=3.0)
+    await queue.start()
+    configure_event_broker(EventBroker(forward=queue.publish))
+    store = SQLiteJobStore(os.path.join(directory, "jobs.db"))
+    await store.ensure_indexes()
+    manager = JobManager(lambda: SlowGraph(delay=0.2), max_workers=2, store=store, dispatcher=queue)
+    await manager.start()
+    await asyncio.to_thread(sys.stdin.read)
+    await manager.stop()
+    await queue.close()
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_dispatched_jobs_run_in_graph_worker_process(tmp_path):
+    """API processes admit and stream; a separate process runs the graph"""
+    from src.jobs.dispatch import SQLiteWorkQueue
+    from src.jobs.events import configure_event_broker
+    from src.jobs.store import SQLiteJobStore
+    
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    queue = SQLiteWorkQueue(str(tmp_path / "dispatch.db"), lease=3.0)
+    await queue.start()
+    configure_event_broker(EventBroker())
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    await store.ensure_indexes()
+    manager = JobManager(lambda: SlowGraph(), max_queue=10, store=store, dispatcher=queue, execute=False)
+    await manager.start()
+    
+    # Admitted before any worker runs, then withdrawn from the queue
+    withdrawn = await manager.submit("withdrawn")
+    assert await manager.cancel(withdrawn.analysis_id)
+    assert (await manager.get(withdrawn.analysis_id))["status"] == "cancelled"
+    
+    worker = subprocess.Popen(
+        [sys.executable, "-c", f"import asyncio; from tests.test_jobs import serve_dispatch_worker; asyncio.run(serve_dispatch_worker({str(tmp_path)!r}))"],
+        cwd=root,
+        stdin=subprocess.PIPE
     )
+    try:
+        job = await manager.submit("sildenafil")
+        received = []
+        async with asyncio.timeout(30):
+            async for event in get_event_broker().subscribe(job.analysis_id):
+                received.append(event)
+        
+        assert received[-1]["type"] == "end"
+        assert received[-1]["data"]["status"] == "completed"
+        assert any(event["type"] == "node" for event in received)
+        record = await manager.get(job.analysis_id)
+        assert record["hypothesis"] == "Hypothesis for sildenafil"
+        assert await queue.depth() == 0
+    finally:
+        worker.communicate(timeout=30)
+        await manager.stop()
+        await queue.close()
+        await store.close()
+    assert worker.returncode == 0
+''')
+
+    create_file("tests/test_logger.py", '''"""Test Logger"""
+import io
+import json
+import logging
+from src.utils.logger import get_logger, setup_logger, shutdown_logging
+
+def configure(**kwargs) -> io.StringIO:
+    stream = io.StringIO()
+    setup_logger(stream=stream, force=True, **kwargs)
+    return stream
+
+def test_setup_is_idempotent():
+    """Repeated setup never stacks handlers"""
+    configure(fmt="text")
+    setup_logger()
+    setup_logger("pharmaintel.agents")
+    assert len(logging.getLogger("pharmaintel").handlers) == 1
+    shutdown_logging()
+
+def test_json_output_is_compact():
+    stream = configure(fmt="json")
+    get_logger("agents").info("%s: %s", "Clinical", "analyze", extra={"fields": {"agent": "Clinical"}})
+    shutdown_logging()
     
-    workflow.add_edge("clinical_trials", "router")
-    workflow.add_edge("patent_landscape", "router")
-    workflow.add_edge("iqvia_insights", "router")
-    workflow.add_edge("synthesize", END)
+    line = stream.getvalue().strip()
+    assert "\\n" not in line and ", " not in line
+    entry = json.loads(line)
+    assert entry["msg"] == "Clinical: analyze"
+    assert entry["agent"] == "Clinical"
+
+def test_sampling_keeps_one_in_n():
+    stream = configure(fmt="json", sample_rates={"token": 0.25, "noise": 0})
+    log = get_logger("agents")
+    for i in range(8):
+        log.info("token %d", i, extra={"event": "token"})
+        log.info("noise", extra={"event": "noise"})
+    log.info("unsampled")
+    shutdown_logging()
     
-    return workflow.compile()
+    messages = [json.loads(line)["msg"] for line in stream.getvalue().splitlines()]
+    assert messages == ["token 0", "token 4", "unsampled"]
+
+def test_level_gates_records():
+    stream = configure(fmt="json", level="WARNING")
+    get_logger("agents").info("hidden")
+    get_logger("agents").warning("shown")
+    shutdown_logging()
+    
+    assert [json.loads(line)["msg"] for line in stream.getvalue().splitlines()] == ["shown"]
 ''')
 
-    # ========================================================================
-    # UTILS
-    # ========================================================================
+    create_file("tests/test_tools.py", '''"""Test Tools"""
+import asyncio
+import json
+import httpx
+import pytest
+from src.tools.cache import ToolResultCache
+from src.tools.http_client import HttpClientPool, TokenBucket, UpstreamConfig
+from src.tools.mcp_server import PharmaIntelMCPServer
+from src.tools.registry import ToolRegistry, ToolSpec
+from src.tools.definitions import PubmedInput, RecordsOutput
+
+class StubUpstream:
+    """Minimal keep-alive HTTP/1.1 server on localhost"""
     
-    create_file("src/utils/__init__.py", "")
+    def __init__(self, statuses=None):
+        self.statuses = list(statuses or [])
+        self.connections = 0
+        self.requests = 0
+        self.server = None
     
-    create_file("src/utils/logger.py", '''"""Logging Configuration"""
-import logging
-import sys
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request = await reader.readuntil(b"\\r\\n\\r\\n")
+                if not request:
+                    break
+                self.requests += 1
+                status = self.statuses.pop(0) if self.statuses else 200
+                body = json.dumps({"request": self.requests}).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} X\\r\\nContent-Type: application/json\\r\\n"
+                    f"Content-Length: {len(body)}\\r\\nRetry-After: 0\\r\\n\\r\\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+    
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+    
+    async def __aexit__(self, *exc):
+        self.server.close()
+
+@pytest.mark.asyncio
+async def test_connections_are_kept_alive():
+    async with StubUpstream() as stub:
+        pool = HttpClientPool({"stub": UpstreamConfig(stub.url, rate_per_second=1000, burst=100)})
+        client = pool.get("stub")
+        for _ in range(20):
+            await client.get_json("/studies")
+        await pool.aclose()
+    
+    assert stub.requests == 20
+    assert stub.connections == 1
+
+@pytest.mark.asyncio
+async def test_retries_transient_errors():
+    async with StubUpstream(statuses=[503, 429]) as stub:
+        config = UpstreamConfig(stub.url, rate_per_second=1000, backoff_base=0.01)
+        pool = HttpClientPool({"stub": config})
+        client = pool.get("stub")
+        result = await client.get_json("/studies")
+        await pool.aclose()
+    
+    assert result == {"request": 3}
+    assert client.retries == 2
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries():
+    async with StubUpstream(statuses=[503] * 5) as stub:
+        pool = HttpClientPool({"stub": UpstreamConfig(stub.url, rate_per_second=1000, max_retries=2, backoff_base=0.01)})
+        with pytest.raises(httpx.HTTPStatusError):
+            await pool.get("stub").get_json("/studies")
+        await pool.aclose()
+    assert stub.requests == 3
+
+@pytest.mark.asyncio
+async def test_concurrency_cap_per_upstream():
+    active = peak = 0
+    
+    async def handler(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return httpx.Response(200, json={})
+    
+    config = UpstreamConfig("http://stub", max_concurrency=3, rate_per_second=1000, burst=100)
+    pool = HttpClientPool({"stub": config}, transport=httpx.MockTransport(handler))
+    await asyncio.gather(*(pool.get("stub").get_json("/x") for _ in range(12)))
+    await pool.aclose()
+    
+    assert peak == 3
+
+def test_pool_serves_more_than_one_event_loop():
+    async def handler(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={})
+    
+    config = UpstreamConfig("http://stub", max_concurrency=2, rate_per_second=1000, burst=100)
+    pool = HttpClientPool({"stub": config}, transport=httpx.MockTransport(handler))
+    
+    async def burst():
+        await asyncio.gather(*(pool.get("stub").get_json("/x") for _ in range(6)))
+        await pool.get("stub").aclose()
+    
+    for _ in range(2):
+        asyncio.run(burst())
+    
+    assert pool.get("stub").requests == 12
+
+def test_token_bucket_rate():
+    now = [0.0]
+    bucket = TokenBucket(rate_per_second=2, burst=2, clock=lambda: now[0])
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.try_acquire() == 0
+
+class CountingTool:
+    """Upstream stand-in that counts calls and can be told to fail"""
+    
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+    
+    async def __call__(self, tool_name, args):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return {"success": True, "tool": tool_name, "call": self.calls}
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_request(fresh_tool_cache):
+    server = PharmaIntelMCPServer()
+    server._execute = tool = CountingTool()
+    
+    results = await asyncio.gather(*(
+        server.call_tool("drugbank", {"drug": "sildenafil", "limit": 5}) for _ in range(20)
+    ))
+    again = await server.call_tool("drugbank", {"limit": 5, "drug": "sildenafil", "page": None})
+    
+    assert tool.calls == 1
+    assert all(result["call"] == 1 for result in results)
+    assert again["call"] == 1
+    assert fresh_tool_cache.stats()["coalesced"] == 19
+
+@pytest.mark.asyncio
+async def test_tool_ttls_and_failures_are_not_cached():
+    now = [0.0]
+    cache = ToolResultCache(ttls={"fda": 10, "pubmed": 100}, clock=lambda: now[0])
+    tool = CountingTool(delay=0)
+    
+    await cache.fetch("fda", {"q": "x"}, lambda: tool("fda", {}))
+    await cache.fetch("pubmed", {"q": "x"}, lambda: tool("pubmed", {}))
+    now[0] = 50
+    await cache.fetch("fda", {"q": "x"}, lambda: tool("fda", {}))
+    await cache.fetch("pubmed", {"q": "x"}, lambda: tool("pubmed", {}))
+    assert tool.calls == 3
+    
+    tool.fail = True
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await cache.fetch("patents", {"q": "x"}, lambda: tool("patents", {}))
+    assert tool.calls == 5
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_refreshes_in_background():
+    now = [0.0]
+    cache = ToolResultCache(ttls={"fda": 10}, stale_ttl=30, clock=lambda: now[0])
+    tool = CountingTool()
+    load = lambda: tool("fda", {})
+    
+    assert (await cache.fetch("fda", {"q": "x"}, load))["call"] == 1
+    now[0] = 15
+    stale = await asyncio.gather(*(cache.fetch("fda", {"q": "x"}, load) for _ in range(5)))
+    assert [result["call"] for result in stale] == [1] * 5
+    
+    await asyncio.sleep(0.05)
+    assert tool.calls == 2
+    assert (await cache.fetch("fda", {"q": "x"}, load))["call"] == 2
+    
+    now[0] = 100
+    assert (await cache.fetch("fda", {"q": "x"}, load))["call"] == 3
+
+@pytest.mark.asyncio
+async def test_registry_lists_descriptors_and_validates_arguments():
+    server = PharmaIntelMCPServer()
+    tools = server.list_tools()
+    
+    assert {tool["name"] for tool in tools} == {
+        "clinical_trials", "patents", "fda", "drugbank", "pubmed", "trial_analytics", "market_analytics"
+    }
+    assert server.list_tools() is tools
+    assert tools[0]["inputSchema"]["type"] == "object"
+    
+    server._execute = tool = CountingTool()
+    rejected = await server.call_tool("fda", {"drug": "", "colour": "blue"})
+    unknown = await server.call_tool("nonexistent", {})
+    
+    assert rejected["success"] is False
+    assert {error["loc"][0] for error in rejected["details"]} == {"drug", "colour"}
+    assert unknown == {"success": False, "error": "Unknown tool: nonexistent"}
+    assert tool.calls == 0
+
+@pytest.mark.asyncio
+async def test_handler_errors_come_back_as_results(fresh_tool_cache):
+    server = PharmaIntelMCPServer()
+    server._execute = tool = CountingTool(delay=0)
+    tool.fail = True
+    
+    result = await server.call_tool("fda", {"drug": "sildenafil"})
+    
+    assert result == {"success": False, "error": "fda failed: upstream down"}
+
+@pytest.mark.asyncio
+async def test_tool_handler_is_imported_on_first_call():
+    def handler(request):
+        assert request.url.path.endswith("/esearch.fcgi")
+        return httpx.Response(200, json={"esearchresult": {"count": "2", "idlist": ["1", "2"]}})
+    
+    registry = ToolRegistry()
+    spec = registry.register(ToolSpec(
+        "pubmed", "PubMed search", PubmedInput, RecordsOutput,
+        "src.tools.sources:search_pubmed", validate_output=True
+    ))
+    pool = HttpClientPool(
+        {"pubmed": UpstreamConfig("http://pubmed.test")},
+        transport=httpx.MockTransport(handler)
+    )
+    server = PharmaIntelMCPServer(http=pool, registry=registry)
+    
+    assert not spec.loaded
+    result = await server.call_tool("pubmed", {"query": " sildenafil "})
+    await pool.aclose()
+    
+    assert spec.loaded
+    assert result == {"success": True, "data": {"total": 2, "records": [{"pmid": "1"}, {"pmid": "2"}]}}
 
-def setup_logger(name: str = "pharmaintel") -> logging.Logger:
-    """Setup logger"""
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+@pytest.mark.asyncio
+async def test_market_analytics_sizes_the_latest_year(tmp_path):
+    from src.indexes.market import MarketData, configure_market_data
     
-    handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    path = tmp_path / "market.csv"
+    path.write_text(
+        "indication,region,year,prevalence,diagnosed_rate,treated_rate,annual_cost_usd\\n"
+        "Pulmonary Hypertension,US,2023,40000,0.5,0.5,20000\\n"
+        "Pulmonary Hypertension,US,2024,50000,0.6,0.5,25000\\n"
+        "Pulmonary Hypertension,EU,2024,60000,0.5,0.4,15000\\n"
+        "Hypertension,US,2024,100000000,0.8,0.6,300\\n"
     )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    configure_market_data(MarketData(str(path)))
+    try:
+        result = await PharmaIntelMCPServer().call_tool(
+            "market_analytics", {"query": "Sildenafil for pulmonary hypertension"}
+        )
+        eu_only = await PharmaIntelMCPServer().call_tool(
+            "market_analytics", {"indication": "pulmonary hypertension", "regions": ["eu"], "year": 2024}
+        )
+    finally:
+        configure_market_data(None)
     
-    return logger
+    data = result["data"]
+    assert data["indication"] == "pulmonary hypertension" and data["year"] == 2024
+    assert data["target_population"] == 27000
+    assert data["tam"] == 15000 * 25000 + 12000 * 15000
+    assert [region["region"] for region in data["by_region"]] == ["EU", "US"]
+    assert eu_only["data"]["target_population"] == 12000
 ''')
 
-    # ========================================================================
-    # CONFIG
-    # ========================================================================
+    create_file("tests/test_benchmarks.py", '''"""Test Benchmark Harness"""
+import pytest
+from benchmarks import import_time
+from benchmarks.harness import BenchmarkConfig, compare, percentile, run_benchmark
+
+def test_percentile_is_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 95) == 0.0
+
+@pytest.mark.asyncio
+async def test_benchmark_reports_latency_and_throughput():
+    config = BenchmarkConfig(
+        requests=6, concurrency=3, workers=2,
+        llm_latency_ms=1, llm_latency_p95_ms=2, tool_latency_ms=1, tool_latency_p95_ms=2,
+        poll_interval_ms=5
+    )
+    report = await run_benchmark(config)
+    results = report["results"]
     
-    create_file("src/config/__init__.py", "")
+    assert results["outcomes"] == {"completed": 6}
+    assert results["llm_calls"] == 6 * 4
+    assert results["throughput_per_s"] > 0
+    assert results["latency_ms"]["p50"] <= results["latency_ms"]["p99"]
+    assert compare(report, report) == []
     
-    create_file("src/config/settings.py", '''"""Settings Configuration"""
-from pydantic_settings import BaseSettings
+    slower = {"results": {**results, "latency_ms": {**results["latency_ms"], "p95": results["latency_ms"]["p95"] * 2}}}
+    assert compare(slower, report) == [f"p95 latency {results['latency_ms']['p95']}ms -> {slower['results']['latency_ms']['p95']}ms"]
 
-class Settings(BaseSettings):
-    """Application settings"""
-    google_api_key: str
-    model_name: str = "gemini-1.5-pro"
-    api_host: str = "0.0.0.0"
-    api_port: int = 8000
+def test_api_import_leaves_heavy_dependencies_for_later():
+    report = import_time.profile_imports("src.api.server", runs=1, top=5)
+    results = report["results"]
     
-    class Config:
-        env_file = ".env"
+    assert results["heavy_modules"] == []
+    assert results["total_ms"] > 0
+    assert results["slowest"][0]["module"] == "src.api.server"
+    assert import_time.compare(report, report) == []
+    
+    heavier = {"module": report["module"], "results": {**results, "heavy_modules": ["langgraph"], "total_ms": results["total_ms"] * 2}}
+    assert import_time.compare(heavier, report) == [
+        "src.api.server imports langgraph",
+        f"import time {results['total_ms']}ms -> {heavier['results']['total_ms']}ms"
+    ]
 
-settings = Settings()
 ''')
 
-    # ========================================================================
-    # TESTS
-    # ========================================================================
+    create_file("tests/test_indexes.py", '''"""Test Local Data Indexes"""
+import json
+import zipfile
+import pytest
+from src.indexes.clinical_trials import TrialsIndex, iter_studies, refresh
+
+def study(nct_id, status, interventions, conditions, why_stopped=None, phases=("PHASE2",), updated="2024-01-01"):
+    """API v2 study document"""
+    status_module = {"overallStatus": status, "lastUpdatePostDateStruct": {"date": updated}}
+    if why_stopped:
+        status_module["whyStopped"] = why_stopped
+    return {"protocolSection": {
+        "identificationModule": {"nctId": nct_id, "briefTitle": f"Study of {interventions[0]}"},
+        "statusModule": status_module,
+        "designModule": {"phases": list(phases)},
+        "conditionsModule": {"conditions": conditions},
+        "armsInterventionsModule": {"interventions": [{"name": name} for name in interventions]},
+    }}
+
+LEGACY_XML = """<clinical_study>
+  <id_info><nct_id>NCT00000005</nct_id></id_info>
+  <brief_title>Oral sildenafil in PAH</brief_title>
+  <overall_status>Terminated</overall_status>
+  <why_stopped>Futility at interim analysis</why_stopped>
+  <phase>Phase 2/Phase 3</phase>
+  <condition>Pulmonary Arterial Hypertension</condition>
+  <intervention><intervention_name>Sildenafil citrate</intervention_name></intervention>
+  <last_update_posted>March 5, 2021</last_update_posted>
+</clinical_study>"""
+
+@pytest.fixture
+def export(tmp_path):
+    """A JSON-lines export plus a zip of legacy XML files"""
+    studies = [
+        study("NCT00000001", "TERMINATED", ["Sildenafil"], ["Pulmonary Hypertension"], "Serious adverse events"),
+        study("NCT00000002", "COMPLETED", ["Sildenafil"], ["Pulmonary Hypertension"]),
+        study("NCT00000003", "WITHDRAWN", ["Sildenafil"], ["Pulmonary Hypertension"], "Slow enrollment", ("PHASE3",)),
+        study("NCT00000004", "TERMINATED", ["Metformin"], ["Glioblastoma"], "Lack of efficacy"),
+    ]
+    (tmp_path / "studies.jsonl").write_text("\\n".join(json.dumps(item) for item in studies))
+    with zipfile.ZipFile(tmp_path / "legacy.zip", "w") as archive:
+        archive.writestr("NCT00000005.xml", LEGACY_XML)
+    return tmp_path
+
+def test_trials_index_ingests_and_computes_failure_stats(export):
+    index = TrialsIndex(":memory:")
+    assert index.ingest(iter_studies(str(export))) == {"inserted": 5, "updated": 0, "unchanged": 0}
     
-    create_file("tests/__init__.py", "")
+    terms = index.resolve_query("Why did sildenafil fail in pulmonary hypertension?")
+    assert terms == {"intervention": "sildenafil", "condition": "pulmonary hypertension"}
     
-    create_file("tests/test_agents.py", '''"""Test Agents"""
-import pytest
-from src.agents.master_agent import MasterOrchestratorAgent
+    stats = index.failure_stats(**terms)
+    assert stats["trials_analyzed"] == 4 and stats["finished"] == 4 and stats["failed"] == 3
+    assert stats["failure_rate"] == 0.75
+    assert index.failure_stats(intervention="sildenafil", phase="Phase 3")["trials_analyzed"] == 2
+    
+    for query in ("oral sildenafil failures in PAH", "why did oral sildenafil fail for pulmonary hypertension"):
+        assert index.resolve_query(query) == terms
+        assert len(index.select(**index.resolve_query(query))) == 4
+    assert index.resolve_query("metformin in glioblastoma trials") == {"intervention": "metformin", "condition": "glioblastoma"}
+    assert index.resolve_query("why do trials fail") == {"intervention": None, "condition": None}
+    
+    reasons = index.termination_reasons(**terms)
+    assert [reason["reason"] for reason in reasons] == ["efficacy", "enrollment", "safety"]
+    assert reasons == stats["termination_reasons"] and reasons[0]["share"] == round(1 / 3, 4)
+    assert index.search("glioblastoma")[0]["nct_id"] == "NCT00000004"
+    assert index.last_update() == "2024-01-01"
 
 @pytest.mark.asyncio
-async def test_master_agent():
-    """Test master agent"""
-    agent = MasterOrchestratorAgent()
-    state = {"query": "test", "iteration_count": 0}
-    result = await agent.route_query(state)
-    assert "next_agent" in result
+async def test_delta_refresh_updates_only_changed_studies(export):
+    index = TrialsIndex(":memory:")
+    index.ingest_path(str(export / "studies.jsonl"))
+    
+    class Registry:
+        """Live API stub serving two pages of changes"""
+        def __init__(self):
+            self.calls = []
+        
+        def get(self, name):
+            return self
+        
+        async def get_json(self, path, params=None):
+            self.calls.append(dict(params))
+            if "pageToken" not in params:
+                return {"studies": [study("NCT00000004", "COMPLETED", ["Metformin"], ["Glioblastoma"], updated="2024-06-01")], "nextPageToken": "p2"}
+            return {"studies": [study("NCT00000002", "COMPLETED", ["Sildenafil"], ["Pulmonary Hypertension"])]}
+    
+    registry = Registry()
+    counts = await refresh(index, registry)
+    
+    assert counts == {"inserted": 0, "updated": 1, "unchanged": 1}
+    assert registry.calls[0]["filter.advanced"] == "AREA[LastUpdatePostDate]RANGE[2024-01-01,MAX]"
+    assert index.failure_stats(intervention="metformin")["failed"] == 0
+    assert index.last_update() == "2024-06-01"
+
+@pytest.mark.asyncio
+async def test_clinical_agent_reads_local_index(export):
+    from src.agents.clinical_agent import ClinicalTrialsAgent
+    from src.indexes.clinical_trials import configure_trials_index
+    
+    index = TrialsIndex(":memory:")
+    index.ingest_path(str(export))
+    configure_trials_index(index)
+    try:
+        state = await ClinicalTrialsAgent().analyze_trials({"query": "sildenafil PAH"})
+    finally:
+        configure_trials_index(None)
+    
+    findings = state["clinical_findings"]
+    assert findings["trials_analyzed"] == 4
+    assert findings["failure_rate"] == 0.75
+    assert findings["primary_reason"] == "efficacy"
+    assert findings["groups"] == [
+        {"group": "PHASE2", "trials": 2, "finished": 2, "failed": 1, "failure_rate": 0.5},
+        {"group": "PHASE2/PHASE3", "trials": 1, "finished": 1, "failed": 1, "failure_rate": 1.0},
+        {"group": "PHASE3", "trials": 1, "finished": 1, "failed": 1, "failure_rate": 1.0},
+    ]
+
+@pytest.mark.asyncio
+async def test_batch_shares_trial_analytics_across_wordings(export):
+    """Shared batch results are keyed on the drug and condition a query names"""
+    import asyncio
+    from src.indexes.clinical_trials import configure_trials_index
+    from src.tools.mcp_server import PharmaIntelMCPServer, shared_tool_results
+    
+    index = TrialsIndex(":memory:")
+    index.ingest_path(str(export))
+    configure_trials_index(index)
+    server = PharmaIntelMCPServer()
+    execute = server._execute
+    calls = []
+    
+    async def counted(tool_name, args):
+        calls.append(args)
+        return await execute(tool_name, args)
+    
+    server._execute = counted
+    shared_tool_results.set({})
+    try:
+        results = await asyncio.gather(*(
+            server.call_tool("trial_analytics", {"query": query})
+            for query in ("oral sildenafil failures in PAH", "why did sildenafil fail for pulmonary hypertension")
+        ))
+    finally:
+        shared_tool_results.set(None)
+        configure_trials_index(None)
+    
+    assert calls == [{"intervention": "sildenafil", "condition": "pulmonary hypertension", "group_by": "phase"}]
+    assert results[0] == results[1]
+    assert results[0]["data"]["trials_analyzed"] == 4
+
+GRANT_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE us-patent-grant SYSTEM "us-patent-grant-v47-2022-02-17.dtd" [ ]>
+<us-patent-grant>
+<us-bibliographic-data-grant>
+<publication-reference><document-id><doc-number>07001234</doc-number><date>20100105</date></document-id></publication-reference>
+<application-reference><document-id><date>20080301</date></document-id></application-reference>
+<us-term-of-grant><us-term-extension>100</us-term-extension></us-term-of-grant>
+<classifications-cpc><main-cpc><classification-cpc>
+<section>A</section><class>61</class><subclass>K</subclass><main-group>31</main-group><subgroup>519</subgroup>
+</classification-cpc></main-cpc></classifications-cpc>
+<invention-title>Oral sildenafil formulation</invention-title>
+<assignees><assignee><addressbook><orgname>Pharma Co</orgname></addressbook></assignee></assignees>
+</us-bibliographic-data-grant>
+<claims><claim id="CLM-1"><claim-text>A tablet comprising sildenafil citrate.</claim-text></claim></claims>
+</us-patent-grant>
+<?xml version="1.0" encoding="UTF-8"?>
+<us-patent-grant><us-bibliographic-data-grant></us-bibliographic-data-grant></us-patent-grant>
+"""
+
+@pytest.fixture
+def patent_files(tmp_path):
+    """One weekly grant file plus JSON lines"""
+    (tmp_path / "ipg100105.xml").write_bytes(GRANT_XML)
+    patents = [
+        {"patent_number": "8000001", "title": "Inhaled sildenafil", "grant_date": "2015-06-01",
+         "filing_date": "2012-01-10", "cpc": ["A61K 9/0075"], "claims": ["A method of treating pulmonary hypertension with inhaled sildenafil."]},
+        {"patent_number": "8000002", "title": "Tadalafil dosing", "grant_date": "2016-02-01",
+         "filing_date": "2014-05-20", "cpc": ["A61K31/4985"], "claims": "Daily tadalafil for pulmonary hypertension."},
+        {"patent_number": "6000003", "title": "Sildenafil salt", "grant_date": "2001-01-01",
+         "expiry_date": "2019-01-01", "cpc": ["C07D487/04"], "claims": "Sildenafil mesylate."},
+    ]
+    (tmp_path / "patents.jsonl").write_text("\\n".join(json.dumps(item) for item in patents))
+    return tmp_path
+
+def test_patent_index_answers_expiry_and_freedom_to_operate(patent_files, tmp_path):
+    from src.indexes.patents import PatentIndex, build_index, iter_patents
+    
+    path = str(tmp_path / "patents")
+    assert build_index(iter_patents(str(patent_files)), path)["patents"] == 4
+    index = PatentIndex(path)
+    
+    assert len(index) == 4
+    assert [index.get(int(i))["patent_number"] for i in index.expiring("2028-01-01", "2032-12-31", "sildenafil")] == [
+        "7001234", "8000001"
+    ]
+    assert index.get(int(index.expiring("2028-06-09", "2028-06-09")[0]))["patent_number"] == "7001234"
+    assert len(index.in_force("2020-01-01", cpc="A61K")) == 3
+    assert len(index.in_force("2020-01-01", cpc="A61K31")) == 2
+    
+    fto = index.freedom_to_operate("sildenafil", on="2020-01-01")
+    assert fto["blocking"] == 2
+    assert fto["expiring_by_year"] == {"2028": 1, "2032": 1}
+    assert fto["clear_from"] == "2032-01-11"
+    assert fto["patents"][0]["assignee"] == "Pharma Co"
+    question = index.freedom_to_operate("Why did sildenafil fail in pulmonary hypertension?", on="2020-01-01")
+    assert [patent["patent_number"] for patent in question["patents"]] == ["8000001"]
+    
+    # A rebuild swaps the directory; readers that reopen see the new data
+    build_index(iter_patents(str(patent_files / "patents.jsonl")), path)
+    index.close()
+    assert len(PatentIndex(path)) == 3
+
+@pytest.mark.asyncio
+async def test_patent_agent_rates_freedom_to_operate(patent_files, tmp_path):
+    from src.agents.patent_agent import PatentLandscapeAgent
+    from src.indexes.patents import PatentIndex, build_index, configure_patent_index, iter_patents
+    
+    path = str(tmp_path / "patents")
+    build_index(iter_patents(str(patent_files)), path)
+    configure_patent_index(PatentIndex(path))
+    try:
+        state = await PatentLandscapeAgent().analyze_patents({"query": "tadalafil in PAH"})
+    finally:
+        configure_patent_index(None)
+    
+    findings = state["patent_findings"]
+    assert findings["patent_status"] == "Expiring 2034"
+    assert findings["blocking_patents"] == 1
+    assert findings["freedom_to_operate"] in ("Medium", "Low")
+
+@pytest.mark.asyncio
+async def test_unindexed_drug_has_no_blocking_patents(patent_files, tmp_path):
+    """Route and disease words alone never decide the match"""
+    from src.agents.patent_agent import PatentLandscapeAgent
+    from src.indexes.patents import PatentIndex, build_index, configure_patent_index, iter_patents, query_subject
+    
+    path = str(tmp_path / "patents")
+    build_index(iter_patents(str(patent_files)), path)
+    index = PatentIndex(path)
+    assert query_subject("oral ketamine for pulmonary hypertension") == "ketamine"
+    assert query_subject("Why did inhaled sildenafil fail in PAH?") == "sildenafil"
+    assert index.freedom_to_operate("oral ketamine for pulmonary hypertension", on="2020-01-01")["blocking"] == 0
+    assert index.freedom_to_operate("hypertension", on="2020-01-01", intervention="ketamine")["blocking"] == 0
+    assert index.freedom_to_operate("PAH", on="2020-01-01", intervention="tadalafil")["blocking"] == 1
+    
+    agent = PatentLandscapeAgent()
+    configure_patent_index(index)
+    try:
+        state = await agent.analyze_patents({"query": "oral ketamine for pulmonary hypertension"})
+    finally:
+        configure_patent_index(None)
+    findings = state["patent_findings"]
+    assert findings["blocking_patents"] == 0
+    assert findings["freedom_to_operate"] == "High"
+    assert findings["patent_status"] == "No matching patents in force"
+    
+    fallback = (await agent.analyze_patents({"query": "oral ketamine"}))["patent_findings"]
+    assert set(fallback) == {"patent_status", "freedom_to_operate"}
 ''')
 
     # ========================================================================
@@ -797,6 +9403,449 @@ cp .env.example .env
 echo "✅ Setup complete!"
 ''')
 
+    # ========================================================================
+    # BENCHMARKS
+    # ========================================================================
+    
+    create_file("benchmarks/__init__.py", "")
+
+    create_file("benchmarks/harness.py", '''"""Offline Benchmark Harness
+
+Drives the FastAPI app in-process against simulated Gemini models and stub
+tool upstreams, so runs are repeatable without network access or API keys.
+
+    python -m benchmarks.harness --requests 500 --concurrency 50 \\\\
+        --output benchmarks/results/latest.json --baseline benchmarks/results/main.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import httpx
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from src.agents.clinical_agent import ClinicalTrialsAgent
+from src.agents.iqvia_agent import IQVIAInsightsAgent
+from src.agents.patent_agent import PatentLandscapeAgent
+from src.api.server import app
+from src.config.settings import settings
+from src.graph.workflow import clear_compiled_graphs
+from src.llm.cache import get_response_cache
+from src.llm.fake import Distribution, SimulatedGeminiModel
+from src.llm.pool import ModelPool, configure_model_pool, get_model_pool
+from src.llm.router import get_model_router
+from src.tools.cache import get_tool_cache
+from src.tools.http_client import HttpClientPool, UpstreamConfig, configure_http_pool, get_http_pool
+from src.tools.mcp_server import PharmaIntelMCPServer
+
+DRUGS = ["sildenafil", "metformin", "rapamycin", "thalidomide", "ketamine", "minoxidil", "aspirin", "baricitinib"]
+INDICATIONS = ["pulmonary hypertension", "alzheimer's disease", "glioblastoma", "lupus", "depression", "alopecia"]
+
+# Canned upstream payloads, roughly the size of real first pages
+STUB_PAYLOADS: Dict[str, Dict[str, Any]] = {
+    "clinical_trials": {"totalCount": 20, "studies": [{"nctId": f"NCT{i:08d}", "phase": "PHASE2"} for i in range(20)]},
+    "patents": {"total_hits": 20, "patents": [{"patent_id": str(9000000 + i)} for i in range(20)]},
+    "fda": {"meta": {"results": {"total": 10}}, "results": [{"id": str(i)} for i in range(10)]},
+    "drugbank": {"products": [{"name": "product"}] * 10},
+    "pubmed": {"esearchresult": {"count": "20", "idlist": [str(i) for i in range(20)]}},
+}
+
+@dataclass
+class BenchmarkConfig:
+    """One benchmark scenario; latencies in milliseconds"""
+    requests: int = 200
+    concurrency: int = 20
+    workers: int = 8
+    llm_latency_ms: float = 800.0
+    llm_latency_p95_ms: float = 2500.0
+    output_tokens: float = 300.0
+    output_tokens_p95: float = 900.0
+    tool_latency_ms: float = 150.0
+    tool_latency_p95_ms: float = 600.0
+    distinct_queries: int = 48
+    parallel: bool = True
+    caches: bool = False
+    routing: bool = True
+    poll_interval_ms: float = 20.0
+    seed: int = 7
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def stub_http_pool(config: BenchmarkConfig, rng: random.Random) -> HttpClientPool:
+    """Upstream clients answered in-process after a sampled delay"""
+    latency = Distribution(config.tool_latency_ms / 1000, config.tool_latency_p95_ms / 1000, rng)
+    hosts = {name.replace("_", "-") + ".stub": name for name in STUB_PAYLOADS}
+    
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency.sample())
+        return httpx.Response(200, json=STUB_PAYLOADS[hosts[request.url.host]])
+    
+    unlimited = dict(max_connections=1000, max_keepalive=1000, max_concurrency=1000, rate_per_second=1e6, burst=10**6)
+    return HttpClientPool(
+        {name: UpstreamConfig(f"http://{host}", **unlimited) for host, name in hosts.items()},
+        transport=httpx.MockTransport(handler)
+    )
+
+@contextmanager
+def simulated_workload(config: BenchmarkConfig, models: List[SimulatedGeminiModel]):
+    """Give every agent a simulated model, and each specialist one tool call plus one LLM call
+    
+    The specialists' canned findings are kept, so the graph's control flow and
+    results are those of a normal run; synthesis makes its own model call.
+    """
+    seeds = itertools.count(config.seed)
+    
+    def model_factory(model_name: str, **kwargs) -> SimulatedGeminiModel:
+        rng = random.Random(next(seeds))
+        model = SimulatedGeminiModel(
+            model_name,
+            latency=Distribution(config.llm_latency_ms / 1000, config.llm_latency_p95_ms / 1000, rng),
+            output_tokens=Distribution(config.output_tokens, config.output_tokens_p95, rng)
+        )
+        models.append(model)
+        return model
+    
+    def with_work(method, tool: Optional[str], args_for, task: str):
+        async def run(self, state):
+            context = {"query": state["query"]}
+            if tool is not None:
+                context["tool_result"] = await PharmaIntelMCPServer().call_tool(tool, args_for(state["query"]))
+            await self.agenerate_response(f"{method.__name__}: {state['query']}", context, task=task)
+            return await method(self, state)
+        return run
+    
+    patches = [
+        (ClinicalTrialsAgent, "analyze_trials", "clinical_trials", lambda q: {"condition": q}, "analyze"),
+        (PatentLandscapeAgent, "analyze_patents", "patents", lambda q: {"query": q}, "extract"),
+        (IQVIAInsightsAgent, "analyze_market", "fda", lambda q: {"drug": q.split()[0]}, "analyze"),
+    ]
+    originals = [(cls, name, getattr(cls, name)) for cls, name, *_ in patches]
+    previous_pool = get_model_pool()
+    try:
+        configure_model_pool(ModelPool(model_factory))
+        for cls, name, tool, args_for, task in patches:
+            setattr(cls, name, with_work(getattr(cls, name), tool, args_for, task))
+        # Graphs bind agent methods when compiled, so build them with the patches in place
+        clear_compiled_graphs()
+        yield
+    finally:
+        configure_model_pool(previous_pool)
+        for cls, name, method in originals:
+            setattr(cls, name, method)
+        clear_compiled_graphs()
+
+@contextmanager
+def benchmark_settings(config: BenchmarkConfig):
+    """Override API settings for the run and restore them afterwards"""
+    overrides = {
+        "job_workers": config.workers,
+        "job_queue_size": max(config.requests, 1),
+        "graph_parallel": config.parallel,
+        # Simulated models answer whole responses only
+        "synthesis_streaming": False,
+        "llm_cache_enabled": config.caches,
+        "tool_cache_enabled": config.caches,
+        "semantic_cache_enabled": config.caches,
+        "llm_routing_enabled": config.routing,
+        "checkpoint_store": "memory",
+        "job_resume_on_start": False,
+        "redis_host": None,
+    }
+    saved = {key: getattr(settings, key) for key in overrides}
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(settings, key, value)
+
+async def _drive(client: httpx.AsyncClient, config: BenchmarkConfig, queries: List[str]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {}
+    next_request = itertools.count()
+    poll = config.poll_interval_ms / 1000
+    
+    async def user():
+        while (index := next(next_request)) < config.requests:
+            started = time.perf_counter()
+            while True:
+                response = await client.post("/analyze", json={"query": queries[index % len(queries)]})
+                if response.status_code != 429:
+                    break
+                outcomes["rejected"] = outcomes.get("rejected", 0) + 1
+                await asyncio.sleep(poll)
+            if response.status_code != 200:
+                outcomes[f"http_{response.status_code}"] = outcomes.get(f"http_{response.status_code}", 0) + 1
+                continue
+            analysis_id = response.json()["analysis_id"]
+            while True:
+                record = (await client.get(f"/analyze/{analysis_id}")).json()
+                if record["status"] not in ("queued", "running"):
+                    break
+                await asyncio.sleep(poll)
+            latencies.append(time.perf_counter() - started)
+            outcomes[record["status"]] = outcomes.get(record["status"], 0) + 1
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(config.concurrency)))
+    return {"latencies": latencies, "outcomes": outcomes, "duration": time.perf_counter() - started}
+
+async def run_benchmark(config: BenchmarkConfig) -> Dict[str, Any]:
+    """Run one scenario end to end and return the report"""
+    rng = random.Random(config.seed)
+    pairs = [f"{drug} {indication}" for drug in DRUGS for indication in INDICATIONS]
+    rng.shuffle(pairs)
+    queries = pairs[:max(1, config.distinct_queries)]
+    models: List[SimulatedGeminiModel] = []
+    previous_pool = get_http_pool()
+    
+    configure_http_pool(stub_http_pool(config, rng))
+    try:
+        with benchmark_settings(config), simulated_workload(config, models):
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                    run = await _drive(client, config, queries)
+                tool_cache = get_tool_cache()
+                response_cache = get_response_cache()
+                router = get_model_router()
+                semantic_cache = app.state.job_manager.semantic_cache
+                cache_stats = {
+                    "tool": tool_cache.stats() if tool_cache else None,
+                    "llm": response_cache.stats() if response_cache else None,
+                    "semantic": semantic_cache.stats() if semantic_cache else None
+                }
+                tier_stats = router.stats() if router else None
+                pool_stats = get_model_pool().stats()
+    finally:
+        configure_http_pool(previous_pool)
+    
+    latencies = run["latencies"]
+    completed = run["outcomes"].get("completed", 0)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "config": asdict(config),
+        "results": {
+            "analyses": len(latencies),
+            "outcomes": run["outcomes"],
+            "duration_s": round(run["duration"], 3),
+            "throughput_per_s": round(completed / run["duration"], 3) if run["duration"] else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 1),
+                "p95": round(percentile(latencies, 95) * 1000, 1),
+                "p99": round(percentile(latencies, 99) * 1000, 1),
+                "mean": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                "max": round(max(latencies, default=0.0) * 1000, 1)
+            },
+            "llm_calls": sum(model.calls for model in models),
+            "llm_output_tokens": sum(model.output_tokens for model in models),
+            "peak_llm_concurrency": max((model.peak_active for model in models), default=0),
+            "llm_tiers": tier_stats,
+            "model_clients": pool_stats,
+            "caches": cache_stats,
+            "peak_rss_mb": peak_rss_mb()
+        }
+    }
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.10) -> List[str]:
+    """Regressions beyond ``tolerance`` against a saved report"""
+    current, previous = report["results"], baseline["results"]
+    regressions = []
+    for pct in ("p50", "p95", "p99"):
+        now, before = current["latency_ms"][pct], previous["latency_ms"][pct]
+        if before and now > before * (1 + tolerance):
+            regressions.append(f"{pct} latency {before}ms -> {now}ms")
+    if previous["throughput_per_s"] and current["throughput_per_s"] < previous["throughput_per_s"] * (1 - tolerance):
+        regressions.append(f"throughput {previous['throughput_per_s']}/s -> {current['throughput_per_s']}/s")
+    if previous.get("peak_rss_mb") and current.get("peak_rss_mb") and current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {previous['peak_rss_mb']}MB -> {current['peak_rss_mb']}MB")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    defaults = BenchmarkConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the PharmaIntel graph through the API, offline")
+    for name, value in asdict(defaults).items():
+        flag = "--" + name.replace("_", "-")
+        if isinstance(value, bool):
+            parser.add_argument(flag, action=argparse.BooleanOptionalAction, default=value)
+        else:
+            parser.add_argument(flag, type=type(value), default=value)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = vars(parser.parse_args(argv))
+    
+    output, baseline, tolerance = args.pop("output"), args.pop("baseline"), args.pop("tolerance")
+    # Agent logs would interleave with the JSON report on stdout
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    report = asyncio.run(run_benchmark(BenchmarkConfig(**args)))
+    text = json.dumps(report, indent=2)
+    if output:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\\n")
+    print(text)
+    
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+''')
+
+    create_file("benchmarks/import_time.py", '''"""Import-Time Profile
+
+Imports a module in a fresh interpreter under ``python -X importtime`` and
+reports the cumulative cost, the slowest modules and the heavy dependencies
+it pulled in. API workers should import without LangGraph, NumPy, pandas or
+the Gemini SDK; those load in warm-up or on first use.
+
+    python -m benchmarks.import_time --output benchmarks/results/imports.json \\\\
+        --baseline benchmarks/results/imports-main.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MODULE = "src.api.server"
+
+# Deferred on purpose; importing any of these from the API is a regression
+HEAVY_MODULES = ("numpy", "pandas", "langgraph", "langchain_core", "google.generativeai")
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """``-X importtime`` lines as ``{"module", "self_us", "cumulative_us", "depth"}``"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(name) - len(name.lstrip(" ")) - 1) // 2
+        })
+    return modules
+
+def _import_once(module: str) -> List[Dict[str, Any]]:
+    env = {**os.environ, "GOOGLE_API_KEY": os.environ.get("GOOGLE_API_KEY", "import-profile")}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=False
+    )
+    if completed.returncode:
+        raise RuntimeError(f"import {module} failed:\\n{completed.stderr[-2000:]}")
+    return parse_importtime(completed.stderr)
+
+def profile_imports(module: str = DEFAULT_MODULE, runs: int = 3, top: int = 15) -> Dict[str, Any]:
+    """Fastest of ``runs`` cold imports of ``module``, as a report"""
+    modules = min(
+        (_import_once(module) for _ in range(max(1, runs))),
+        key=lambda found: sum(entry["self_us"] for entry in found)
+    )
+    
+    packages: Dict[str, int] = defaultdict(int)
+    for found in modules:
+        packages[found["module"].split(".")[0]] += found["self_us"]
+    names = {found["module"] for found in modules}
+    heavy = [name for name in HEAVY_MODULES if name in names]
+    
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "module": module,
+        "results": {
+            "total_ms": round(sum(found["self_us"] for found in modules) / 1000, 1),
+            "modules": len(modules),
+            "heavy_modules": heavy,
+            "slowest": [
+                {"module": found["module"], "cumulative_ms": round(found["cumulative_us"] / 1000, 1)}
+                for found in sorted(modules, key=lambda found: -found["cumulative_us"])[:top]
+            ],
+            "packages_ms": {
+                name: round(us / 1000, 1)
+                for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+            }
+        }
+    }
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.10) -> List[str]:
+    """Regressions beyond ``tolerance`` against a saved report, plus any heavy import"""
+    current, previous = report["results"], baseline["results"]
+    regressions = [f"{report['module']} imports {name}" for name in current["heavy_modules"] if name not in previous["heavy_modules"]]
+    if previous["total_ms"] and current["total_ms"] > previous["total_ms"] * (1 + tolerance):
+        regressions.append(f"import time {previous['total_ms']}ms -> {current['total_ms']}ms")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Profile the cold import of a PharmaIntel module")
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--runs", type=int, default=3, help="cold imports to run; the fastest is reported")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules and packages to list")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args(argv)
+    
+    report = profile_imports(args.module, args.runs, args.top)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\\n")
+    print(text)
+    
+    regressions = [f"{args.module} imports {name}" for name in report["results"]["heavy_modules"]]
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+''')
+
     # ========================================================================
     # FRONTEND
     # ========================================================================